@@ -1,23 +1,56 @@
 #!/usr/bin/env python3
 """
 直接使用Kelly.png創建行走動畫精靈表
-確保生成的圖片與參考圖片完全一致
+確保生成的圖片與參考圖片完全一致；行走動作由程序化2D骨架產生，不需GPU。
+金字塔模式只在參考圖片原始尺寸渲染一次，較小的解析度以區塊縮減從幀堆疊推得
 """
 
+import json
+import os
 import numpy as np
 from PIL import Image, ImageEnhance, ImageFilter
 from pathlib import Path
 from rich.console import Console
 from rich.progress import Progress, BarColumn, TextColumn
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Any
+
+from scripts.sprite_rig import SpriteRig, load_rig_keypoints
 
 console = Console()
 
+# 楓之谷角色的原生像素尺寸；--from-canonical 時金字塔模式改以此尺寸渲染再放大
+CANONICAL_SIZE = (32, 48)
+
+def derive_resolution(stack: np.ndarray, size: Tuple[int, int]) -> Tuple[np.ndarray, str]:
+    """由 (N, h, w, 4) 幀堆疊推得指定尺寸，回傳 (幀堆疊, 方法)
+
+    整數倍放大以 repeat 複製像素，整數倍縮小取每個區塊中心像素（與PIL NEAREST相同），
+    非整數比例才逐幀以PIL最近鄰縮放。
+    """
+    height, width = stack.shape[1:3]
+    target_w, target_h = size
+    if (target_w, target_h) == (width, height):
+        return stack, "render"
+    if target_w % width == 0 and target_h % height == 0:
+        return stack.repeat(target_h // height, axis=1).repeat(target_w // width, axis=2), "repeat"
+    if width % target_w == 0 and height % target_h == 0:
+        fy, fx = height // target_h, width // target_w
+        return stack[:, fy // 2::fy, fx // 2::fx], "block"
+    resized = [np.asarray(Image.fromarray(frame, 'RGBA').resize(size, Image.NEAREST)) for frame in stack]
+    return np.stack(resized), "resample"
+
 class KellySpriteCreator:
-    def __init__(self):
+    def __init__(self, canonical_size: Tuple[int, int] = CANONICAL_SIZE):
         """初始化Kelly精靈創建器"""
         self.console = console
         self.output_dir = Path("output/kelly_sprites")
         self.output_dir.mkdir(exist_ok=True, parents=True)
+        self.canonical_size = tuple(canonical_size)
+        
+        # 骨架依尺寸快取，同尺寸的幀共用反向映射索引
+        self.keypoints = load_rig_keypoints()
+        self.rigs: Dict[Tuple[int, int], SpriteRig] = {}
     
     def load_kelly_reference(self) -> Image.Image:
         """載入Kelly參考圖片"""
@@ -32,88 +65,38 @@ class KellySpriteCreator:
         
         return kelly_img
     
+    def get_rig(self, size: Tuple[int, int]) -> SpriteRig:
+        """取得指定尺寸的骨架"""
+        if size not in self.rigs:
+            self.rigs[size] = SpriteRig(size, self.keypoints)
+        return self.rigs[size]
+    
+    def create_walking_cycle(self, kelly_img: Image.Image, total_frames: int = 8) -> List[Image.Image]:
+        """以骨架一次渲染整個行走週期"""
+        return self.get_rig(kelly_img.size).render_images(kelly_img, total_frames)
+    
     def create_walking_frame(self, kelly_img: Image.Image, frame_idx: int, 
                            total_frames: int = 8) -> Image.Image:
         """創建行走動畫幀"""
-        
-        # 計算行走週期進度 (0.0 到 1.0)
-        progress = frame_idx / total_frames
-        
-        # 基於原始Kelly圖片創建變化
-        frame_img = kelly_img.copy()
-        
-        # 創建輕微的行走效果
-        if frame_idx == 0:
-            # 第0幀：原始姿勢
-            pass
-        elif frame_idx == 1:
-            # 第1幀：輕微向前傾
-            frame_img = self.apply_slight_lean(frame_img, 1)
-        elif frame_idx == 2:
-            # 第2幀：右腳前踏
-            frame_img = self.apply_step_pose(frame_img, "right_forward")
-        elif frame_idx == 3:
-            # 第3幀：中間姿勢
-            frame_img = self.apply_slight_lean(frame_img, 0)
-        elif frame_idx == 4:
-            # 第4幀：原始姿勢
-            pass
-        elif frame_idx == 5:
-            # 第5幀：輕微向前傾
-            frame_img = self.apply_slight_lean(frame_img, -1)
-        elif frame_idx == 6:
-            # 第6幀：左腳前踏
-            frame_img = self.apply_step_pose(frame_img, "left_forward")
-        elif frame_idx == 7:
-            # 第7幀：回到中間
-            frame_img = self.apply_slight_lean(frame_img, 0)
-        
-        return frame_img
-    
-    def apply_slight_lean(self, image: Image.Image, direction: int) -> Image.Image:
-        """應用輕微傾斜效果"""
-        if direction == 0:
-            return image
-        
-        # 轉換為numpy陣列
-        img_array = np.array(image)
-        
-        # 輕微水平偏移（模擬身體搖擺）
-        shift = direction * 1  # 很小的像素偏移
-        if shift != 0:
-            shifted = np.roll(img_array, shift, axis=1)
-            return Image.fromarray(shifted, image.mode)
-        
-        return image
-    
-    def apply_step_pose(self, image: Image.Image, step_type: str) -> Image.Image:
-        """應用踏步姿勢效果"""
-        # 這裡可以實現更複雜的腿部動作
-        # 目前只是輕微調整
-        img_array = np.array(image)
-        
-        if step_type == "right_forward":
-            # 輕微向右下偏移
-            shifted = np.roll(img_array, 1, axis=0)  # 向下1像素
-        elif step_type == "left_forward":
-            # 輕微向左下偏移
-            shifted = np.roll(img_array, -1, axis=1)  # 向左1像素
-        else:
-            shifted = img_array
-        
-        return Image.fromarray(shifted, image.mode)
+        return self.create_walking_cycle(kelly_img, total_frames)[frame_idx]
+    
+    def standard_sizes(self, kelly_img: Image.Image) -> Dict[str, Tuple[int, int]]:
+        """各輸出尺寸名稱與像素尺寸"""
+        return {
+            "original": kelly_img.size,
+            "small_32x48": (32, 48),
+            "medium_64x96": (64, 96),
+            "large_128x192": (128, 192),
+            "xlarge_256x384": (256, 384),
+            "standard_512x512": (512, 512),
+        }
     
     def resize_to_standard_sizes(self, kelly_img: Image.Image) -> dict:
         """調整Kelly圖片到不同標準尺寸"""
-        sizes = {
-            "original": kelly_img,
-            "small_32x48": kelly_img.resize((32, 48), Image.NEAREST),
-            "medium_64x96": kelly_img.resize((64, 96), Image.NEAREST),
-            "large_128x192": kelly_img.resize((128, 192), Image.NEAREST),
-            "xlarge_256x384": kelly_img.resize((256, 384), Image.NEAREST),
-            "standard_512x512": kelly_img.resize((512, 512), Image.NEAREST)
+        return {
+            name: kelly_img if size == kelly_img.size else kelly_img.resize(size, Image.NEAREST)
+            for name, size in self.standard_sizes(kelly_img).items()
         }
-        return sizes
     
     def create_sprite_sheet(self, frames: list, sheet_name: str = "kelly_walking") -> Image.Image:
         """創建精靈表"""
@@ -155,9 +138,9 @@ class KellySpriteCreator:
             for size_name, sized_img in size_variants.items():
                 console.print(f"\n🎨 生成 {size_name} 尺寸動畫", style="blue")
                 
-                frames = []
+                # 以骨架渲染8幀行走動畫
+                frames = self.create_walking_cycle(sized_img, 8)
                 
-                # 生成8幀行走動畫
                 with Progress(
                     TextColumn("[progress.description]{task.description}"),
                     BarColumn(),
@@ -166,11 +149,7 @@ class KellySpriteCreator:
                 ) as progress:
                     task = progress.add_task(f"生成{size_name}幀", total=8)
                     
-                    for frame_idx in range(8):
-                        # 創建行走幀
-                        frame = self.create_walking_frame(sized_img, frame_idx, 8)
-                        frames.append(frame)
-                        
+                    for frame_idx, frame in enumerate(frames):
                         # 保存單幀
                         frame_path = self.output_dir / f"kelly_{size_name}_frame_{frame_idx:02d}.png"
                         frame.save(frame_path, "PNG")
@@ -181,6 +160,9 @@ class KellySpriteCreator:
                 # 創建精靈表
                 self.create_sprite_sheet(frames, f"kelly_{size_name}")
                 
+                # 大尺寸的映射索引不再需要，釋放記憶體
+                self.rigs.pop(sized_img.size, None)
+                
                 console.print(f"✅ {size_name} 完成", style="green")
             
             console.print("\n🎉 Kelly行走動畫生成完成！", style="bold green")
@@ -189,6 +171,76 @@ class KellySpriteCreator:
         except Exception as e:
             console.print(f"❌ 生成失敗: {e}", style="red")
     
+    def generate_kelly_pyramid_animation(self, frame_count: int = 8,
+                                         from_canonical: bool = False) -> Dict[str, Any]:
+        """金字塔模式：渲染一次行走週期，推得所有解析度後一次平行寫出
+        
+        預設在參考圖片原始尺寸渲染，original 與參考圖片一致，較小的尺寸以區塊縮減推得；
+        from_canonical=True 時改在標準尺寸渲染後放大（較快，但大尺寸只是放大的縮圖）。
+        """
+        console.print("🎯 開始生成Kelly行走動畫（金字塔模式）", style="bold magenta")
+        
+        kelly_img = self.load_kelly_reference().convert('RGBA')
+        base = kelly_img.resize(self.canonical_size, Image.NEAREST) if from_canonical else kelly_img
+        stack = self.get_rig(base.size).render_cycle(np.asarray(base), frame_count)
+        self.rigs.pop(base.size, None)
+        console.print(f"🦴 以 {base.width}x{base.height} 渲染 {frame_count} 幀", style="blue")
+        
+        # 推得各解析度並準備寫出工作（幀與精靈表）
+        writes = []
+        resolutions = []
+        for size_name, size in self.standard_sizes(kelly_img).items():
+            frames, method = derive_resolution(stack, size)
+            prefix = f"kelly_{size_name}"
+            frame_files = [f"{prefix}_frame_{i:02d}.png" for i in range(frame_count)]
+            sheet_file = f"{prefix}_sheet.png"
+            
+            writes.extend((self.output_dir / name, frame) for name, frame in zip(frame_files, frames))
+            # 水平排列的精靈表直接由堆疊重排而成
+            sheet = frames.transpose(1, 0, 2, 3).reshape(size[1], size[0] * frame_count, 4)
+            writes.append((self.output_dir / sheet_file, sheet))
+            
+            resolutions.append({
+                "name": size_name,
+                "width": size[0],
+                "height": size[1],
+                "scale": {"x": size[0] / base.width, "y": size[1] / base.height},
+                "method": method,
+                "sheet": sheet_file,
+                "frames": frame_files,
+            })
+        
+        def save(item):
+            path, pixels = item
+            Image.fromarray(np.ascontiguousarray(pixels), 'RGBA').save(path, "PNG")
+        
+        with Progress(
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+            console=console
+        ) as progress:
+            task = progress.add_task("寫出所有解析度", total=len(writes))
+            # PNG壓縮時釋放GIL，執行緒即可平行寫出
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                for _ in executor.map(save, writes):
+                    progress.update(task, advance=1)
+        
+        metadata = {
+            "character": "kelly",
+            "frame_count": frame_count,
+            "render_size": {"w": base.width, "h": base.height},
+            "layout": "horizontal",
+            "resolutions": resolutions,
+        }
+        metadata_path = self.output_dir / "kelly_pyramid_metadata.json"
+        with open(metadata_path, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        
+        console.print(f"✅ {len(resolutions)} 種解析度、{len(writes)} 個檔案已寫出", style="green")
+        console.print(f"📋 元數據: {metadata_path}", style="cyan")
+        return metadata
+    
     def create_reference_comparison(self):
         """創建與原始Kelly的對比圖"""
         console.print("📊 創建參考對比圖", style="blue")
@@ -215,13 +267,28 @@ class KellySpriteCreator:
 
 def main():
     """主函數"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Kelly精靈動畫創建工具")
+    parser.add_argument("--per-size", action="store_true",
+                       help="逐一尺寸渲染（預設為金字塔模式：渲染一次後推得所有解析度）")
+    parser.add_argument("--from-canonical", action="store_true",
+                       help="金字塔模式改以32×48渲染後放大（較快，但大尺寸不再與參考圖片一致）")
+    args = parser.parse_args()
+    
     creator = KellySpriteCreator()
     
     console.print("🍁 Kelly精靈動畫創建工具", style="bold magenta")
     console.print("基於您的Kelly.png參考圖片創建完全一致的行走動畫\n", style="cyan")
     
     # 生成完整行走動畫
-    creator.generate_kelly_walking_animation()
+    if args.per_size:
+        creator.generate_kelly_walking_animation()
+    else:
+        try:
+            creator.generate_kelly_pyramid_animation(from_canonical=args.from_canonical)
+        except Exception as e:
+            console.print(f"❌ 生成失敗: {e}", style="red")
     
     # 創建尺寸對比
     creator.create_reference_comparison()
@@ -5,7 +5,6 @@
 """
 
 import os
-import time
 from pathlib import Path
 from rich.console import Console
 from rich.panel import Panel
@@ -13,11 +12,12 @@ from rich.progress import Progress, BarColumn, TextColumn
 
 # 導入工具模組
 from scripts.data_preparation import DataPreparation
-from scripts.sprite_generator import SpriteGenerator
-from scripts.sheet_composer import SpriteSheetComposer
+from scripts.dry_run import DryRunPipeline, StageTimings
 
 console = Console()
 
+DEMO_CHARACTERS = ["warrior", "archer", "mage"]
+
 def demo_banner():
     """顯示演示橫幅"""
     banner_text = """
@@ -39,7 +39,7 @@ def demo_banner():
     )
     console.print(panel)
 
-def demo_data_preparation():
+def demo_data_preparation(timings: StageTimings):
     """演示資料準備步驟"""
     console.print("\n" + "="*60, style="blue")
     console.print("📋 演示步驟 1: 資料準備", style="bold blue")
@@ -68,8 +68,8 @@ def demo_data_preparation():
         
         for desc, func in steps:
             progress.update(task, description=desc)
-            func()
-            time.sleep(1)  # 演示延遲
+            with timings.stage(desc):
+                func()
             progress.advance(task)
     
     console.print("✅ 資料準備完成！", style="green")
@@ -78,79 +78,22 @@ def demo_data_preparation():
     data_files = list(Path("data/processed").glob("*.png"))
     console.print(f"📁 生成了 {len(data_files)} 個處理檔案", style="cyan")
 
-def demo_character_generation():
-    """演示角色生成步驟（簡化版）"""
+def demo_character_generation(pipeline: DryRunPipeline):
+    """演示角色生成步驟（替身後端，不載入模型）"""
     console.print("\n" + "="*60, style="blue")
     console.print("🎨 演示步驟 2: AI角色生成", style="bold blue")
     console.print("="*60, style="blue")
     
-    console.print("🤖 正在初始化AI模型...", style="yellow")
-    console.print("💡 演示模式: 使用簡化生成流程", style="cyan")
-    
-    # 模擬生成過程
-    characters = ["warrior", "archer", "mage"]
-    frames_per_char = 8
+    console.print("💡 演示模式: 以替身後端即時產生幀，後處理與實際流程相同", style="cyan")
     
-    with Progress(
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-        console=console
-    ) as progress:
-        task = progress.add_task("生成角色中...", total=len(characters) * frames_per_char)
-        
-        for char in characters:
-            for frame in range(frames_per_char):
-                progress.update(task, description=f"生成 {char} 第 {frame+1} 幀")
-                time.sleep(0.5)  # 模擬生成時間
-                progress.advance(task)
-                
-                # 創建演示用的空白圖片
-                demo_create_demo_frame(char, frame)
+    frame_count = len(DEMO_CHARACTERS) * len(pipeline.generated_directions()) * pipeline.backend.frame_count
+    with pipeline.timings.stage("替身生成", frame_count):
+        pipeline.run_generate(DEMO_CHARACTERS)
     
     console.print("✅ 角色生成完成！", style="green")
     console.print("📁 生成的幀圖已保存到 output/frames/", style="cyan")
 
-def demo_create_demo_frame(character: str, frame_idx: int):
-    """創建演示用的幀圖"""
-    from PIL import Image, ImageDraw, ImageFont
-    
-    # 創建簡單的演示圖片
-    img = Image.new('RGBA', (256, 384), (255, 255, 255, 0))
-    draw = ImageDraw.Draw(img)
-    
-    # 繪製簡單的角色輪廓
-    colors = {
-        'warrior': (100, 149, 237),
-        'archer': (34, 139, 34),
-        'mage': (138, 43, 226)
-    }
-    
-    color = colors.get(character, (128, 128, 128))
-    
-    # 繪製基本形狀
-    # 頭部
-    draw.ellipse([110, 30, 146, 66], fill=color)
-    # 身體
-    draw.rectangle([118, 66, 138, 150], fill=color)
-    # 腿部（根據幀數調整位置模擬行走）
-    offset = int(10 * (frame_idx % 4 - 2))
-    draw.rectangle([115 + offset, 150, 125 + offset, 200], fill=color)
-    draw.rectangle([131 - offset, 150, 141 - offset, 200], fill=color)
-    
-    # 添加文字標籤
-    try:
-        font = ImageFont.load_default()
-        draw.text((10, 10), f"{character} #{frame_idx}", fill=(255, 255, 255), font=font)
-    except:
-        pass
-    
-    # 保存圖片
-    output_dir = Path("output/frames")
-    output_dir.mkdir(exist_ok=True, parents=True)
-    img.save(output_dir / f"{character}_frame_{frame_idx:02d}.png", "PNG")
-
-def demo_sprite_sheet_composition():
+def demo_sprite_sheet_composition(pipeline: DryRunPipeline):
     """演示精靈表組合步驟"""
     console.print("\n" + "="*60, style="blue")
     console.print("📑 演示步驟 3: 精靈表組合", style="bold blue")
@@ -158,30 +101,9 @@ def demo_sprite_sheet_composition():
     
     console.print("🔧 正在組合精靈表...", style="yellow")
     
-    # 創建精靈表組合器
-    composer = SpriteSheetComposer()
-    
-    # 組合所有角色的精靈表
-    characters = ["warrior", "archer", "mage"]
-    
-    with Progress(
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-        console=console
-    ) as progress:
-        task = progress.add_task("組合精靈表中...", total=len(characters) + 1)
-        
-        for char in characters:
-            progress.update(task, description=f"組合 {char} 精靈表")
-            composer.compose_character_sheet(char)
-            time.sleep(1)
-            progress.advance(task)
-        
-        # 創建主精靈表
-        progress.update(task, description="創建主精靈表")
-        composer.create_master_sheet()
-        progress.advance(task)
+    frame_count = len(DEMO_CHARACTERS) * len(pipeline.generated_directions()) * pipeline.backend.frame_count
+    with pipeline.timings.stage("精靈表組合", frame_count):
+        pipeline.run_compose(DEMO_CHARACTERS)
     
     console.print("✅ 精靈表組合完成！", style="green")
     
@@ -212,9 +134,7 @@ def show_demo_results():
 
 def demo_cleanup():
     """演示清理"""
-    console.print("\n🧹 演示完成，正在清理資源...", style="yellow")
-    time.sleep(1)
-    console.print("✅ 清理完成", style="green")
+    console.print("\n🧹 演示完成", style="yellow")
 
 def run_full_demo():
     """執行完整演示"""
@@ -234,9 +154,11 @@ def run_full_demo():
     
     try:
         # 執行演示步驟
-        demo_data_preparation()
-        demo_character_generation()
-        demo_sprite_sheet_composition()
+        pipeline = DryRunPipeline()
+        demo_data_preparation(pipeline.timings)
+        demo_character_generation(pipeline)
+        demo_sprite_sheet_composition(pipeline)
+        pipeline.timings.print_table("演示各階段實際耗時")
         
         # 顯示完成信息
         console.print("\n" + "="*60, style="green")
@@ -1,14 +1,13 @@
 #!/usr/bin/env python3
 """
 楓之谷風格角色行走圖製作工具簡化演示腳本
-展示基本功能和使用方法（無需AI模型）
+展示基本功能和使用方法（無需AI模型）；精靈表組合步驟執行正式的後處理，
+需要 requirements.txt 中的 SciPy 等依賴
 """
 
 import os
-import time
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont
-import json
+from PIL import Image, ImageDraw
 import yaml
 
 # 嘗試導入rich，如果沒有則使用基本print
@@ -22,6 +21,8 @@ except ImportError:
     console = None
     HAS_RICH = False
 
+DEMO_CHARACTERS = ["warrior", "archer", "mage"]
+
 def print_rich(text, style=None):
     """兼容的打印函數"""
     if HAS_RICH and console:
@@ -90,7 +91,6 @@ def demo_data_preparation():
     
     for i, step in enumerate(steps):
         print_rich(f"⏳ {step}...", "cyan")
-        time.sleep(1)  # 模擬處理時間
         
         # 實際創建一些示例文件
         if i == 0:  # 創建範例精靈圖
@@ -175,235 +175,44 @@ def extract_sample_frames():
 
 def create_pose_references():
     """創建姿勢參考文件"""
+    from scripts.pose_library import write_builtin_clips
+    
     pose_dir = Path("data/references/poses")
-    pose_dir.mkdir(exist_ok=True)
+    pose_dir.mkdir(exist_ok=True, parents=True)
     
-    # 創建基本的行走姿勢JSON
-    for i in range(8):
-        pose_data = {
-            "frame": i,
-            "keypoints": [
-                {"name": "head", "x": 0.5, "y": 0.15},
-                {"name": "torso", "x": 0.5, "y": 0.5},
-                {"name": "left_leg", "x": 0.4, "y": 0.8},
-                {"name": "right_leg", "x": 0.6, "y": 0.8}
-            ],
-            "walk_phase": i / 8.0
-        }
-        
-        with open(pose_dir / f"walk_pose_{i:02d}.json", 'w') as f:
-            json.dump(pose_data, f, indent=2)
+    # 與 DataPreparation 相同的姿勢庫格式（各動作的關鍵幀）
+    write_builtin_clips(pose_dir, formats=("json",))
 
-def demo_character_generation():
-    """演示角色生成步驟（簡化版）"""
+def demo_character_generation(pipeline):
+    """演示角色生成步驟（替身後端，不載入模型）"""
     print_rich("\n" + "="*60, "blue")
     print_rich("🎨 演示步驟 2: AI角色生成模擬", "bold blue")
     print_rich("="*60, "blue")
     
-    print_rich("🤖 模擬AI模型初始化...", "yellow")
-    print_rich("💡 演示模式: 創建示例角色幀", "cyan")
+    print_rich("💡 演示模式: 以替身後端即時產生幀，後處理與實際流程相同", "cyan")
     
-    characters = ["warrior", "archer", "mage"]
-    frames_per_char = 8
-    
-    total_frames = len(characters) * frames_per_char
-    
-    for i, char in enumerate(characters):
-        print_rich(f"🎨 生成 {char} 角色...", "blue")
-        
-        for frame in range(frames_per_char):
-            print_rich(f"  ⏳ 生成第 {frame+1}/{frames_per_char} 幀", "cyan")
-            time.sleep(0.3)  # 模擬生成時間
-            
-            # 創建演示用的幀圖
-            create_demo_frame(char, frame)
-            
-        print_rich(f"  ✅ {char} 完成", "green")
+    frame_count = len(DEMO_CHARACTERS) * len(pipeline.generated_directions()) * pipeline.backend.frame_count
+    with pipeline.timings.stage("替身生成", frame_count):
+        pipeline.run_generate(DEMO_CHARACTERS)
     
     print_rich("✅ 角色生成完成！", "green")
     print_rich("📁 生成的幀圖已保存到 output/frames/", "cyan")
 
-def create_demo_frame(character: str, frame_idx: int):
-    """創建演示用的幀圖"""
-    # 創建較大的演示圖片
-    img = Image.new('RGBA', (256, 384), (255, 255, 255, 0))
-    draw = ImageDraw.Draw(img)
-    
-    # 繪製簡單的角色輪廓
-    colors = {
-        'warrior': (100, 149, 237),
-        'archer': (34, 139, 34),
-        'mage': (138, 43, 226)
-    }
-    
-    color = colors.get(character, (128, 128, 128))
-    
-    # 繪製基本形狀
-    # 頭部
-    draw.ellipse([110, 30, 146, 66], fill=color)
-    # 身體
-    draw.rectangle([118, 66, 138, 150], fill=color)
-    # 腿部（根據幀數調整位置模擬行走）
-    offset = int(15 * (frame_idx % 4 - 2))
-    draw.rectangle([115 + offset, 150, 125 + offset, 200], fill=color)
-    draw.rectangle([131 - offset, 150, 141 - offset, 200], fill=color)
-    
-    # 添加角色標識
-    try:
-        font = ImageFont.load_default()
-        draw.text((10, 10), f"{character.title()} #{frame_idx}", fill=(255, 255, 255), font=font)
-    except:
-        pass
-    
-    # 保存圖片
-    output_dir = Path("output/frames")
-    output_dir.mkdir(exist_ok=True, parents=True)
-    img.save(output_dir / f"{character}_frame_{frame_idx:02d}.png", "PNG")
-    
-    # 同時創建處理後的版本
-    img.save(output_dir / f"{character}_processed_frame_{frame_idx:02d}.png", "PNG")
-
-def demo_sprite_sheet_composition():
-    """演示精靈表組合步驟"""
+def demo_sprite_sheet_composition(pipeline):
+    """演示精靈表組合步驟（與正式流程相同的 SpriteSheetComposer）"""
     print_rich("\n" + "="*60, "blue")
     print_rich("📑 演示步驟 3: 精靈表組合", "bold blue")
     print_rich("="*60, "blue")
     
     print_rich("🔧 正在組合精靈表...", "yellow")
     
-    characters = ["warrior", "archer", "mage"]
-    
-    for char in characters:
-        print_rich(f"📑 組合 {char} 精靈表...", "cyan")
-        compose_character_sheet(char)
-        time.sleep(1)
-        print_rich(f"  ✅ {char} 精靈表完成", "green")
-    
-    # 創建主精靈表
-    print_rich("🎯 創建主精靈表...", "yellow")
-    create_master_sheet()
+    frame_count = len(DEMO_CHARACTERS) * len(pipeline.generated_directions()) * pipeline.backend.frame_count
+    with pipeline.timings.stage("精靈表組合", frame_count):
+        pipeline.run_compose(DEMO_CHARACTERS)
     
     print_rich("✅ 精靈表組合完成！", "green")
     show_demo_results()
 
-def compose_character_sheet(character_type: str):
-    """組合角色精靈表"""
-    frames_dir = Path("output/frames")
-    output_dir = Path("output/sprite_sheets")
-    output_dir.mkdir(exist_ok=True, parents=True)
-    
-    # 收集幀圖
-    pattern = f"{character_type}_processed_frame_*.png"
-    frames = sorted(list(frames_dir.glob(pattern)))
-    
-    if not frames:
-        pattern = f"{character_type}_frame_*.png"
-        frames = sorted(list(frames_dir.glob(pattern)))
-    
-    if not frames:
-        return
-    
-    # 創建水平精靈表
-    sprite_size = (32, 48)  # 目標尺寸
-    padding = 2
-    
-    sheet_width = (sprite_size[0] + padding) * len(frames) - padding
-    sheet_height = sprite_size[1]
-    
-    sprite_sheet = Image.new('RGBA', (sheet_width, sheet_height), (0, 0, 0, 0))
-    
-    for i, frame_path in enumerate(frames):
-        frame = Image.open(frame_path)
-        # 縮放到目標尺寸
-        frame_resized = frame.resize(sprite_size, Image.NEAREST)
-        
-        x_pos = i * (sprite_size[0] + padding)
-        sprite_sheet.paste(frame_resized, (x_pos, 0))
-    
-    # 保存精靈表
-    output_path = output_dir / f"{character_type}_sprite_sheet.png"
-    sprite_sheet.save(output_path, "PNG")
-    
-    # 創建帶標註的版本
-    annotated_sheet = sprite_sheet.copy()
-    draw = ImageDraw.Draw(annotated_sheet)
-    
-    try:
-        font = ImageFont.load_default()
-        title = f"{character_type.title()} Walk Cycle ({len(frames)} frames)"
-        draw.text((5, sheet_height - 15), title, fill=(255, 255, 255), font=font)
-        
-        # 添加幀編號
-        for i in range(len(frames)):
-            x_pos = i * (sprite_size[0] + padding) + 2
-            draw.text((x_pos, 2), str(i), fill=(255, 255, 255), font=font)
-    except:
-        pass
-    
-    annotated_path = output_dir / f"{character_type}_sprite_sheet_annotated.png"
-    annotated_sheet.save(annotated_path, "PNG")
-    
-    # 生成元數據
-    metadata = {
-        "character_type": character_type,
-        "frame_count": len(frames),
-        "frame_size": sprite_size,
-        "layout": "horizontal",
-        "padding": padding,
-        "animation": {
-            "fps": 8,
-            "loop": True,
-            "total_duration": len(frames) / 8
-        },
-        "frames": []
-    }
-    
-    for i in range(len(frames)):
-        frame_info = {
-            "frame": i,
-            "x": i * (sprite_size[0] + padding),
-            "y": 0,
-            "width": sprite_size[0],
-            "height": sprite_size[1]
-        }
-        metadata["frames"].append(frame_info)
-    
-    metadata_path = output_dir / f"{character_type}_metadata.json"
-    with open(metadata_path, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, indent=2, ensure_ascii=False)
-
-def create_master_sheet():
-    """創建主精靈表"""
-    output_dir = Path("output/sprite_sheets")
-    characters = ["warrior", "archer", "mage"]
-    
-    all_sheets = []
-    for char_type in characters:
-        sheet_path = output_dir / f"{char_type}_sprite_sheet.png"
-        if sheet_path.exists():
-            sheet = Image.open(sheet_path)
-            all_sheets.append((char_type, sheet))
-    
-    if not all_sheets:
-        return
-    
-    # 計算主表尺寸
-    max_width = max(sheet.width for _, sheet in all_sheets)
-    total_height = sum(sheet.height + 2 for _, sheet in all_sheets) - 2
-    
-    # 創建主精靈表
-    master_sheet = Image.new('RGBA', (max_width, total_height), (0, 0, 0, 0))
-    
-    # 放置每個角色的精靈表
-    y_offset = 0
-    for char_type, sheet in all_sheets:
-        master_sheet.paste(sheet, (0, y_offset))
-        y_offset += sheet.height + 2
-    
-    # 保存主精靈表
-    master_path = output_dir / "master_sprite_sheet.png"
-    master_sheet.save(master_path, "PNG")
-
 def show_demo_results():
     """顯示演示結果"""
     print_rich("\n📊 演示結果總覽:", "bold cyan")
@@ -428,9 +237,7 @@ def show_demo_results():
 
 def demo_cleanup():
     """演示清理"""
-    print_rich("\n🧹 演示完成，正在清理資源...", "yellow")
-    time.sleep(1)
-    print_rich("✅ 清理完成", "green")
+    print_rich("\n🧹 演示完成", "yellow")
 
 def run_full_demo():
     """執行完整演示"""
@@ -450,9 +257,13 @@ def run_full_demo():
     
     try:
         # 執行演示步驟
+        from scripts.dry_run import DryRunPipeline
+        
         demo_data_preparation()
-        demo_character_generation()
-        demo_sprite_sheet_composition()
+        pipeline = DryRunPipeline()
+        demo_character_generation(pipeline)
+        demo_sprite_sheet_composition(pipeline)
+        pipeline.timings.print_table("演示各階段實際耗時")
         
         # 顯示完成信息
         print_rich("\n" + "="*60, "green")
@@ -11,11 +11,14 @@ from pathlib import Path
 from rich.console import Console
 from rich.panel import Panel
 from rich.text import Text
+from typing import List, Optional
 
 # 導入自定義模組
 from scripts.data_preparation import DataPreparation
-from scripts.sprite_generator import SpriteGenerator
 from scripts.sheet_composer import SpriteSheetComposer
+from scripts.generator_backends import BackendRouter, BACKENDS
+from scripts.dry_run import DryRunPipeline, DRY_RUN_STAGES, DRY_RUN_BACKENDS
+from scripts.config_service import load_config
 
 console = Console()
 
@@ -51,7 +54,38 @@ def setup_character_reference(reference_image: str, character_name: str):
     console.print(f"✅ 參考圖片已設置: {target_path}", style="green")
     return True
 
-def run_full_pipeline(character_name: str = None, reference_image: str = None):
+def expand_characters(roster, character_name: Optional[str], tag: Optional[str]) -> Optional[List[str]]:
+    """--character 為萬用字元樣式（如 'npc_*'）或指定 --tag 時展開為角色列表；單一角色名稱回傳 None"""
+    if not tag and (not character_name or not any(ch in character_name for ch in "*?[")):
+        return None
+    names = roster.resolve([character_name or "*"], tag)
+    console.print(f"🔎 符合的角色: {len(names)} 個", style="cyan")
+    return names
+
+def generate_characters(character_name: str = None, resume: bool = False,
+                        tag: str = None, backend: str = None) -> bool:
+    """依配置（或 --backend）為每個角色選擇生成後端並生成；角色不存在時回傳 False"""
+    router = BackendRouter(load_config(), override=backend)
+    selected = expand_characters(router.roster, character_name, tag)
+    if selected is None and character_name:
+        # 檢查角色是否存在於配置中
+        if character_name not in router.roster:
+            console.print(f"❌ 角色 '{character_name}' 不存在於配置中", style="red")
+            console.print(f"📋 可用角色（共 {router.roster.count()} 個，列出前 20 個）:", style="cyan")
+            for char in router.roster.names(limit=20):
+                console.print(f"   • {char}", style="cyan")
+            return False
+        console.print(f"🎯 生成角色: {character_name}", style="cyan")
+        selected = [character_name]
+    
+    try:
+        router.generate_characters(selected, resume=resume)
+    finally:
+        router.cleanup()
+    return True
+
+def run_full_pipeline(character_name: str = None, reference_image: str = None,
+                      resume: bool = False, tag: str = None, backend: str = None):
     """執行完整的製作流程"""
     console.print("🚀 開始完整的角色行走圖製作流程", style="bold blue")
     
@@ -74,16 +108,8 @@ def run_full_pipeline(character_name: str = None, reference_image: str = None):
         console.print("🎨 步驟 2/3: AI角色生成", style="bold yellow")
         console.print("="*50, style="yellow")
         
-        generator = SpriteGenerator()
-        try:
-            if character_name:
-                # 生成指定角色
-                generator.generate_single_character(character_name)
-            else:
-                # 生成所有角色
-                generator.generate_all_characters()
-        finally:
-            generator.cleanup()
+        if not generate_characters(character_name, resume, tag, backend):
+            return False
         
         # 步驟3: 組合精靈表
         console.print("\n" + "="*50, style="yellow")
@@ -91,7 +117,10 @@ def run_full_pipeline(character_name: str = None, reference_image: str = None):
         console.print("="*50, style="yellow")
         
         composer = SpriteSheetComposer()
-        if character_name:
+        selected = expand_characters(composer.roster, character_name, tag)
+        if selected is not None:
+            composer.compose_all_sheets(selected)
+        elif character_name:
             composer.compose_character_sheet(character_name)
         else:
             composer.compose_all_sheets()
@@ -116,7 +145,8 @@ def run_data_prep_only():
     prep = DataPreparation()
     prep.run_all()
 
-def run_generation_only(character_name: str = None, reference_image: str = None):
+def run_generation_only(character_name: str = None, reference_image: str = None,
+                        resume: bool = False, tag: str = None, backend: str = None):
     """僅執行AI生成"""
     console.print("🎨 執行AI生成流程", style="bold blue")
     
@@ -125,27 +155,40 @@ def run_generation_only(character_name: str = None, reference_image: str = None)
         if not setup_character_reference(reference_image, character_name):
             return False
     
-    generator = SpriteGenerator()
-    try:
-        if character_name:
-            # 生成指定角色
-            console.print(f"🎯 生成角色: {character_name}", style="cyan")
-            generator.generate_single_character(character_name)
-        else:
-            # 生成所有角色
-            generator.generate_all_characters()
-    finally:
-        generator.cleanup()
+    generate_characters(character_name, resume, tag, backend)
 
-def run_composition_only(character_name: str = None):
+def run_composition_only(character_name: str = None, tag: str = None):
     """僅執行精靈表組合"""
     console.print("📑 執行精靈表組合流程", style="bold blue")
     composer = SpriteSheetComposer()
-    if character_name:
+    selected = expand_characters(composer.roster, character_name, tag)
+    if selected is not None:
+        composer.compose_all_sheets(selected)
+    elif character_name:
         composer.compose_character_sheet(character_name)
     else:
         composer.compose_all_sheets()
 
+def run_texture_export(character_name: str = None, tag: str = None):
+    """從已生成的幀匯出遊戲引擎用的紋理陣列"""
+    console.print("🧊 執行紋理陣列匯出", style="bold blue")
+    composer = SpriteSheetComposer()
+    selected = expand_characters(composer.roster, character_name, tag)
+    if selected is None:
+        composer.export_all_textures(character_name)
+    else:
+        for name in selected:
+            composer.export_all_textures(name)
+
+def run_dry_run(character_name: str = None, tag: str = None, stages: Optional[List[str]] = None,
+                backend: str = "synthetic"):
+    """以不載入模型的生成後端執行真正的資料準備與精靈表組合流程，回報各階段耗時"""
+    pipeline = DryRunPipeline(backend=backend)
+    selected = expand_characters(pipeline.roster, character_name, tag)
+    if selected is None and character_name:
+        selected = [character_name]
+    pipeline.run(selected, stages or DRY_RUN_STAGES)
+
 def show_results():
     """顯示生成結果"""
     console.print("\n📊 生成結果:", style="bold cyan")
@@ -192,12 +235,28 @@ def show_help():
    python main.py --data-prep     # 僅資料準備
    python main.py --generate      # 僅AI生成
    python main.py --compose       # 僅精靈表組合
+   python main.py --export-textures  # 匯出紋理陣列 (output/textures)
 
 4. 指定角色操作:
    python main.py --generate --character kelly     # 僅生成kelly角色
    python main.py --compose --character kelly      # 僅組合kelly的精靈表
+   python main.py --generate --character 'npc_*'   # 萬用字元選取多個角色
+   python main.py --generate --tag town            # 依標籤選取角色
 
-5. 其他選項:
+5. 乾跑（不載入模型，替身後端即時產生幀，回報各階段耗時）:
+   python main.py --dry-run
+   python main.py --dry-run --compose --character 'npc_*'
+   python main.py --dry-run --backend procedural   # 以程序化骨架取代合成替身
+
+6. 生成後端（預設依配置 generation_backend 與角色模板的 backend 欄位逐角色選擇）:
+   python main.py --generate --backend procedural --tag npc
+   python main.py --generate --backend img2img_reference --reference Kelly.png --character kelly
+
+7. 中斷後續跑 (沿用任務佇列，已完成的幀不重新生成):
+   python main.py --generate --resume
+   python main.py --full --resume
+
+8. 其他選項:
    python main.py --help          # 顯示此幫助
    python main.py --results       # 顯示當前結果
 
@@ -226,16 +285,26 @@ def main():
                        help="僅執行AI生成")
     parser.add_argument("--compose", action="store_true", 
                        help="僅執行精靈表組合")
+    parser.add_argument("--export-textures", action="store_true",
+                       help="從已生成的幀匯出遊戲引擎用的紋理陣列")
     parser.add_argument("--results", action="store_true", 
                        help="顯示當前結果")
     parser.add_argument("--help-detail", action="store_true", 
                        help="顯示詳細幫助")
+    parser.add_argument("--dry-run", action="store_true",
+                       help="以替身生成後端執行流程（不載入模型），可搭配 --data-prep/--generate/--compose 只跑部分階段")
+    parser.add_argument("--backend", choices=list(BACKENDS),
+                       help="所有角色使用指定的生成後端（預設依配置逐角色選擇）")
+    parser.add_argument("--resume", action="store_true",
+                       help="從任務佇列續跑上次中斷的角色生成")
     
     # 新增參數：指定參考圖片和角色名稱
     parser.add_argument("--reference", "-r", type=str,
                        help="指定參考圖片路徑")
     parser.add_argument("--character", "-c", type=str,
-                       help="指定要生成的角色名稱")
+                       help="指定要生成的角色名稱（可用萬用字元樣式，如 'npc_*'）")
+    parser.add_argument("--tag", type=str,
+                       help="只處理帶有此標籤的角色")
     
     args = parser.parse_args()
     
@@ -246,6 +315,9 @@ def main():
     if args.reference and not args.character:
         console.print("❌ 使用 --reference 時必須同時指定 --character", style="red")
         return
+    if args.reference and (args.tag or any(ch in args.character for ch in "*?[")):
+        console.print("❌ 使用 --reference 時 --character 必須是單一角色名稱", style="red")
+        return
     
     # 如果沒有參數，顯示幫助
     if len(sys.argv) == 1:
@@ -256,14 +328,23 @@ def main():
     # 執行對應功能
     if args.help_detail:
         show_help()
+    elif args.dry_run:
+        stages = [stage for stage, selected in (("data_prep", args.data_prep), ("generate", args.generate),
+                                                 ("compose", args.compose)) if selected]
+        if args.backend and args.backend not in DRY_RUN_BACKENDS:
+            console.print(f"❌ 乾跑只支援不載入模型的後端: {', '.join(DRY_RUN_BACKENDS)}", style="red")
+            return
+        run_dry_run(args.character, args.tag, stages, args.backend or "synthetic")
     elif args.full:
-        run_full_pipeline(args.character, args.reference)
+        run_full_pipeline(args.character, args.reference, args.resume, args.tag, args.backend)
     elif args.data_prep:
         run_data_prep_only()
-    elif args.generate:
-        run_generation_only(args.character, args.reference)
+    elif args.generate or args.resume:
+        run_generation_only(args.character, args.reference, args.resume, args.tag, args.backend)
     elif args.compose:
-        run_composition_only(args.character)
+        run_composition_only(args.character, args.tag)
+    elif args.export_textures:
+        run_texture_export(args.character, args.tag)
     elif args.results:
         show_results()
     else:
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+動畫預覽匯出
+將角色行走週期輸出為 GIF / 動態WebP / APNG 供審閱：所有幀共用一個調色盤，
+只儲存與前一幀不同的矩形區域，並在背景執行緒中編碼以免拖慢精靈表組合
+"""
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from PIL import Image, PngImagePlugin, features
+from rich.console import Console
+from typing import List, Dict, Any, Tuple, Optional
+
+console = Console()
+
+SUPPORTED_FORMATS = ("gif", "webp", "apng")
+
+# 副檔名對應Pillow格式名稱
+PIL_FORMATS = {"gif": "GIF", "webp": "WEBP", "apng": "PNG"}
+
+def delta_rects(indices: np.ndarray) -> List[Optional[Tuple[int, int, int, int]]]:
+    """計算 (N, H, W) 索引堆疊每幀相對前一幀的變動矩形 [x, y, w, h]
+
+    第一幀為整張圖；與前一幀完全相同時為 None。
+    """
+    height, width = indices.shape[1:]
+    rects: List[Optional[Tuple[int, int, int, int]]] = [(0, 0, width, height)]
+
+    changed = indices[1:] != indices[:-1]
+    rows = changed.any(axis=2)
+    cols = changed.any(axis=1)
+    for row, col in zip(rows, cols):
+        if not row.any():
+            rects.append(None)
+            continue
+        top, bottom = row.argmax(), height - row[::-1].argmax()
+        left, right = col.argmax(), width - col[::-1].argmax()
+        rects.append((int(left), int(top), int(right - left), int(bottom - top)))
+    return rects
+
+class AnimationPreviewExporter:
+    def __init__(self,
+                 output_dir: str = "output/previews",
+                 formats: Tuple[str, ...] = ("gif", "webp"),
+                 fps: float = 8.0,
+                 scale: int = 4,
+                 background: Tuple[int, int, int] = (200, 200, 200)):
+        """初始化動畫預覽匯出器"""
+        unknown = set(formats) - set(SUPPORTED_FORMATS)
+        if unknown:
+            raise ValueError(f"不支援的預覽格式: {sorted(unknown)}")
+
+        self.output_dir = Path(output_dir)
+        self.formats = tuple(formats)
+        self.frame_duration = int(round(1000 / fps))
+        self.scale = scale
+        self.background = tuple(background)
+
+        # 單一背景執行緒依序編碼，組合流程不需等待
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="animation-preview")
+        self._pending: List[Future] = []
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "AnimationPreviewExporter":
+        """從生成配置的 animation_preview 區段建立匯出器"""
+        preview_config = config.get('animation_preview', {})
+        return cls(
+            output_dir=preview_config.get('output_dir', "output/previews"),
+            formats=tuple(preview_config.get('formats', ("gif", "webp"))),
+            fps=config.get('animation', {}).get('fps', 8),
+            scale=preview_config.get('scale', 4),
+            background=tuple(preview_config.get('background', (200, 200, 200))),
+        )
+
+    def prepare_frames(self, frames: List[Image.Image]) -> Tuple[List[Image.Image], np.ndarray]:
+        """合成到預覽背景、放大並量化到共用調色盤，回傳 (調色盤幀, 索引堆疊)"""
+        size = frames[0].size
+        flattened = []
+        for frame in frames:
+            canvas = Image.new('RGB', size, self.background)
+            rgba = frame.convert('RGBA')
+            canvas.paste(rgba, (0, 0), rgba)
+            if self.scale > 1:
+                canvas = canvas.resize((size[0] * self.scale, size[1] * self.scale), Image.NEAREST)
+            flattened.append(canvas)
+
+        # 以整個週期橫向拼接後量化一次，所有幀共用同一調色盤
+        strip = Image.new('RGB', (flattened[0].width * len(flattened), flattened[0].height))
+        for i, frame in enumerate(flattened):
+            strip.paste(frame, (i * frame.width, 0))
+        palette_image = strip.quantize(colors=256, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+
+        paletted = [frame.quantize(palette=palette_image, dither=Image.Dither.NONE) for frame in flattened]
+        indices = np.stack([np.asarray(frame) for frame in paletted])
+        return paletted, indices
+
+    def export(self, character_type: str, frames: List[Image.Image]) -> List[Path]:
+        """同步匯出一個角色的動畫預覽，回傳輸出路徑"""
+        self.output_dir.mkdir(exist_ok=True, parents=True)
+        paletted, indices = self.prepare_frames(frames)
+        rects = delta_rects(indices)
+
+        # 與前一幀相同的幀併入前一幀的顯示時間
+        kept, durations, kept_rects = [], [], []
+        for frame, rect in zip(paletted, rects):
+            if rect is None:
+                durations[-1] += self.frame_duration
+                continue
+            kept.append(frame)
+            durations.append(self.frame_duration)
+            kept_rects.append(rect)
+
+        outputs = []
+        for fmt in self.formats:
+            path = self.output_dir / f"{character_type}_walk.{fmt}"
+            if fmt == "gif":
+                # disposal=1 保留前一幀，optimize 讓未變動像素成為透明並只寫入變動矩形
+                kept[0].save(path, PIL_FORMATS[fmt], save_all=True, append_images=kept[1:],
+                             duration=durations, loop=0, disposal=1, optimize=True)
+            elif fmt == "apng":
+                kept[0].save(path, PIL_FORMATS[fmt], save_all=True, append_images=kept[1:],
+                             duration=durations, loop=0,
+                             disposal=PngImagePlugin.Disposal.OP_NONE,
+                             blend=PngImagePlugin.Blend.OP_SOURCE, optimize=True)
+            else:
+                if not features.check("webp"):
+                    console.print("⚠️ Pillow 未支援 WebP，略過動態WebP預覽", style="yellow")
+                    continue
+                # libwebp 動畫編碼器以 minimize_size 只編碼變動的子矩形
+                rgb = [frame.convert('RGB') for frame in kept]
+                rgb[0].save(path, PIL_FORMATS[fmt], save_all=True, append_images=rgb[1:],
+                            duration=durations, loop=0, lossless=True, minimize_size=True)
+            outputs.append(path)
+
+        full_area = indices.shape[1] * indices.shape[2]
+        delta_area = sum(w * h for _, _, w, h in kept_rects[1:])
+        ratio = delta_area / (full_area * max(len(kept_rects) - 1, 1))
+        sizes = ", ".join(f"{path.suffix[1:]} {path.stat().st_size / 1024:.1f}KB" for path in outputs)
+        console.print(f"🎬 {character_type} 動畫預覽: {len(kept)} 幀, 平均變動區域 {ratio:.0%}, {sizes}", style="blue")
+        return outputs
+
+    def submit(self, character_type: str, frames: List[Image.Image]) -> Future:
+        """在背景執行緒中匯出動畫預覽"""
+        frames = [frame.copy() for frame in frames]
+        future = self._executor.submit(self._export_safely, character_type, frames)
+        self._pending.append(future)
+        return future
+
+    def _export_safely(self, character_type: str, frames: List[Image.Image]) -> List[Path]:
+        try:
+            return self.export(character_type, frames)
+        except Exception as e:
+            console.print(f"❌ {character_type} 動畫預覽匯出失敗: {e}", style="red")
+            return []
+
+    def wait(self) -> List[Path]:
+        """等待所有背景匯出完成，回傳全部輸出路徑"""
+        outputs = []
+        for future in self._pending:
+            outputs.extend(future.result())
+        self._pending.clear()
+        return outputs
+
+def main():
+    """主函數：為 output/frames 中的所有角色匯出動畫預覽"""
+    from scripts.sheet_composer import SpriteSheetComposer
+
+    composer = SpriteSheetComposer()
+    for char_type in composer.roster.names():
+        frames = composer.load_character_frames(char_type)
+        if frames:
+            composer.preview_exporter.export(char_type, frames)
+
+if __name__ == "__main__":
+    main()
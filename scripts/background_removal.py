@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+背景移除引擎
+以Lab色彩距離比對背景色鍵，從圖像邊界做連通區域填充（保留角色內部的白色），
+可選邊緣alpha柔化；直接在 (N, H, W, 4) 的uint8陣列上原地處理。
+色鍵容差內的顏色預先算成RGB查表，逐像素只做查表，Lab只用於邊緣柔化的少數像素
+"""
+
+import time
+from functools import lru_cache
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+from rich.console import Console
+from rich.table import Table
+from typing import List, Tuple, Dict, Any
+
+console = Console()
+
+# 同一幀內的4連通結構；堆疊的幀與幀之間互不連通
+FRAME_CONNECTIVITY = np.zeros((3, 3, 3), dtype=bool)
+FRAME_CONNECTIVITY[1] = ndimage.generate_binary_structure(2, 1)
+
+# sRGB (D65) 轉 XYZ 矩陣，已除以白點以直接得到正規化XYZ
+RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+], dtype=np.float32)
+D65_WHITE = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+RGB_TO_XYZ_NORMALIZED = (RGB_TO_XYZ.T / D65_WHITE).astype(np.float32)
+
+# sRGB uint8 到線性值的查表，避免逐像素計算冪次
+_SRGB = np.arange(256, dtype=np.float32) / 255.0
+SRGB_TO_LINEAR = np.where(_SRGB > 0.04045, ((_SRGB + 0.055) / 1.055) ** 2.4, _SRGB / 12.92).astype(np.float32)
+
+LAB_EPSILON = 216 / 24389
+LAB_KAPPA = 24389 / 27
+
+# 色差計算的分塊大小（像素），讓中間陣列留在快取內
+DISTANCE_CHUNK_PIXELS = 1 << 18
+
+# 色鍵查表的初始半徑（RGB單位）；容差區域觸及查表邊界時加倍
+KEY_TABLE_INITIAL_RADIUS = 8
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """將 (..., 3) 的uint8 RGB轉為CIE Lab (float32)"""
+    linear = SRGB_TO_LINEAR[np.ascontiguousarray(rgb)]
+    xyz = linear @ RGB_TO_XYZ_NORMALIZED
+
+    f = np.cbrt(xyz)
+    small = xyz <= LAB_EPSILON
+    if small.any():
+        f[small] = (LAB_KAPPA * xyz[small] + 16) / 116
+
+    lab = np.empty_like(f)
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+    return lab
+
+@lru_cache(maxsize=16)
+def key_color_table(key_color: Tuple[int, int, int], tolerance: float) -> np.ndarray:
+    """色鍵容差查表：以 R | G << 8 | B << 16 為索引的 2^24 布林表（16 MB）
+
+    只有色鍵周圍RGB立方體內的顏色需要轉換Lab。容差區域是包含色鍵的連通區域；
+    立方體由小逐步加倍，直到區域不觸及立方體的內側邊界，此時立方體外的顏色必定超出容差。
+    """
+    key = np.array(key_color, dtype=np.int32)
+    key_lab = rgb_to_lab(key.astype(np.uint8))
+    radius = KEY_TABLE_INITIAL_RADIUS
+
+    while True:
+        lo = np.clip(key - radius, 0, 255)
+        hi = np.clip(key + radius, 0, 255)
+        greens, blues = np.meshgrid(np.arange(lo[1], hi[1] + 1), np.arange(lo[2], hi[2] + 1), indexing='ij')
+        planes = []
+        # 逐個R平面計算，半徑大時中間陣列不會佔用大量記憶體
+        for red in range(lo[0], hi[0] + 1):
+            rgb = np.stack([np.full_like(greens, red), greens, blues], axis=-1).astype(np.uint8)
+            diff = rgb_to_lab(rgb) - key_lab
+            planes.append(np.einsum("...i,...i->...", diff, diff) <= tolerance ** 2)
+        cube = np.stack(planes)
+
+        touches = any(
+            (lo[axis] > 0 and cube.take(0, axis=axis).any()) or
+            (hi[axis] < 255 and cube.take(-1, axis=axis).any())
+            for axis in range(3)
+        )
+        if not touches or radius >= 255:
+            break
+        radius *= 2
+
+    reds, greens, blues = (axis + offset for axis, offset in zip(np.nonzero(cube), lo))
+    table = np.zeros(1 << 24, dtype=bool)
+    table[reds | (greens << 8) | (blues << 16)] = True
+    return table
+
+class BackgroundRemover:
+    def __init__(self,
+                 key_color: Tuple[int, int, int] = (255, 255, 255),
+                 tolerance: float = 6.0,
+                 flood_fill: bool = True,
+                 edge_softness: float = 0.0):
+        """初始化背景移除引擎
+
+        tolerance 為與色鍵的Lab色差 (ΔE76) 上限；flood_fill 為 True 時只移除與圖像邊界
+        連通的背景；edge_softness > 0 時，緊鄰背景的邊緣像素依色差在
+        [tolerance, tolerance + edge_softness] 之間線性給予部分透明度並去除色鍵溢色。
+        """
+        self.key_color = np.array(key_color, dtype=np.uint8)
+        self.key_lab = rgb_to_lab(self.key_color)
+        self.key_table = key_color_table(tuple(int(c) for c in key_color), float(tolerance))
+        self.tolerance = tolerance
+        self.flood_fill = flood_fill
+        self.edge_softness = edge_softness
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "BackgroundRemover":
+        """從生成配置的 postprocess.background_key 建立引擎"""
+        return cls.from_key_config(config.get('postprocess', {}).get('background_key', {}))
+
+    @classmethod
+    def from_key_config(cls, key_config: Dict[str, Any]) -> "BackgroundRemover":
+        """從 background_key 區段建立引擎（程序池只需傳遞這個小字典）"""
+        return cls(
+            key_color=tuple(key_config.get('color', (255, 255, 255))),
+            tolerance=key_config.get('tolerance', 6.0),
+            flood_fill=key_config.get('flood_fill', True),
+            edge_softness=key_config.get('edge_softness', 0.0),
+        )
+
+    def key_distance(self, rgb: np.ndarray) -> np.ndarray:
+        """每個像素與色鍵的Lab色差（分塊計算）"""
+        flat = rgb.reshape(-1, 3)
+        distance = np.empty(flat.shape[0], dtype=np.float32)
+        for start in range(0, flat.shape[0], DISTANCE_CHUNK_PIXELS):
+            chunk = rgb_to_lab(flat[start:start + DISTANCE_CHUNK_PIXELS]) - self.key_lab
+            distance[start:start + DISTANCE_CHUNK_PIXELS] = np.sqrt(np.einsum("ij,ij->i", chunk, chunk))
+        return distance.reshape(rgb.shape[:-1])
+
+    def key_candidates(self, stack: np.ndarray) -> np.ndarray:
+        """與色鍵色差在容差內的像素遮罩；每個像素以32位元視圖的低24位元查表，不轉換Lab"""
+        pixels = np.ascontiguousarray(stack).view('<u4')[..., 0]
+        return np.take(self.key_table, pixels & 0xFFFFFF)
+
+    def background_mask(self, stack: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """計算 (N, H, W) 的背景遮罩"""
+        candidates = candidates | (stack[..., 3] == 0)
+        if not self.flood_fill:
+            return candidates
+
+        # 一次標記整個堆疊的連通區域，保留觸及任一幀邊界的區域
+        labels, count = ndimage.label(candidates, structure=FRAME_CONNECTIVITY)
+        keep = np.zeros(count + 1, dtype=bool)
+        for border in (labels[:, 0, :], labels[:, -1, :], labels[:, :, 0], labels[:, :, -1]):
+            keep[border] = True
+        keep[0] = False
+        return keep[labels]
+
+    def remove_stack(self, stack: np.ndarray) -> np.ndarray:
+        """原地移除 (N, H, W, 4) uint8 堆疊的背景，回傳同一陣列"""
+        if stack.ndim != 4 or stack.shape[-1] != 4 or stack.dtype != np.uint8:
+            raise ValueError(f"需要 (N, H, W, 4) 的uint8堆疊，收到 {stack.shape} {stack.dtype}")
+
+        background = self.background_mask(stack, self.key_candidates(stack))
+
+        if self.edge_softness > 0:
+            self._soften_edges(stack, background)
+
+        if stack.flags.c_contiguous:
+            # 以32位元視圖一次清除整個RGBA像素
+            stack.view(np.uint32)[..., 0][background] = 0
+        else:
+            stack[background] = 0
+        return stack
+
+    def _soften_edges(self, stack: np.ndarray, background: np.ndarray):
+        """緊鄰背景的邊緣像素依色差給予部分透明度，並去除色鍵溢色（只對邊緣像素計算Lab色差）"""
+        edge = ndimage.binary_dilation(background, structure=FRAME_CONNECTIVITY) & ~background
+        if not edge.any():
+            return
+
+        pixels = stack[edge].astype(np.float32)
+        distance = self.key_distance(stack[edge][:, :3])
+        coverage = np.clip((distance - self.tolerance) / self.edge_softness, 0.0, 1.0)
+
+        # 以 C = a*F + (1-a)*K 反解前景色
+        safe = np.maximum(coverage, 1e-3)[:, None]
+        foreground = (pixels[:, :3] - (1 - safe) * self.key_color) / safe
+        pixels[:, :3] = np.clip(foreground, 0, 255)
+        pixels[:, 3] *= coverage
+
+        stack[edge] = pixels.round().astype(np.uint8)
+
+    def remove(self, image: Image.Image) -> Image.Image:
+        """移除單張圖像的背景"""
+        stack = np.array(image.convert('RGBA'))[None]
+        return Image.fromarray(self.remove_stack(stack)[0], 'RGBA')
+
+    def remove_batch(self, images: List[Image.Image]) -> List[Image.Image]:
+        """批次移除背景
+
+        幀之間共用的只有色鍵查表（每組色鍵與容差只建立一次）；逐像素的查表與連通標記
+        在單幀陣列上做，比合併成大堆疊更貼近快取，也省去堆疊的複製。
+        """
+        return [self.remove(image) for image in images]
+
+def legacy_white_threshold(image: Image.Image, threshold: int = 240) -> Image.Image:
+    """舊版逐張白色閾值移除（僅供基準測試比較）"""
+    data = np.array(image.convert('RGBA'))
+    white_pixels = (data[:, :, 0] > threshold) & (data[:, :, 1] > threshold) & (data[:, :, 2] > threshold)
+    data[white_pixels] = [0, 0, 0, 0]
+    return Image.fromarray(data, 'RGBA')
+
+def create_benchmark_frames(count: int, size: Tuple[int, int]) -> List[Image.Image]:
+    """建立白底、角色內含白色區塊的測試幀"""
+    rng = np.random.default_rng(0)
+    width, height = size
+    frames = []
+    for _ in range(count):
+        data = np.full((height, width, 4), 255, dtype=np.uint8)
+        body = (slice(height // 6, height * 5 // 6), slice(width // 4, width * 3 // 4))
+        data[body + (slice(0, 3),)] = rng.integers(0, 200, size=(3,), dtype=np.uint8)
+        # 角色內部的白色衣物，不應被移除
+        data[height // 3:height // 2, width * 3 // 8:width * 5 // 8, :3] = 250
+        frames.append(Image.fromarray(data, 'RGBA'))
+    return frames
+
+def benchmark(count: int = 64, size: Tuple[int, int] = (512, 512), repeats: int = 3):
+    """比較舊版逐張閾值與新引擎的處理時間與內部白色保留率"""
+    frames = create_benchmark_frames(count, size)
+    width, height = size
+    interior = (slice(height // 3, height // 2), slice(width * 3 // 8, width * 5 // 8))
+
+    candidates = {
+        "舊版逐張閾值": lambda: [legacy_white_threshold(frame) for frame in frames],
+        "新引擎逐張": lambda: [BackgroundRemover().remove(frame) for frame in frames],
+        "新引擎批次": lambda: BackgroundRemover().remove_batch(frames),
+        "新引擎批次+邊緣alpha": lambda: BackgroundRemover(edge_softness=8.0).remove_batch(frames),
+    }
+
+    table = Table(title=f"背景移除基準測試 ({count} 幀 {width}x{height})")
+    table.add_column("實作", style="cyan")
+    table.add_column("總時間 (ms)", justify="right")
+    table.add_column("每幀 (ms)", justify="right")
+    table.add_column("內部白色保留", justify="right")
+
+    for name, run in candidates.items():
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            results = run()
+            best = min(best, time.perf_counter() - start)
+
+        kept = np.mean([np.asarray(result)[interior][..., 3].mean() / 255 for result in results])
+        table.add_row(name, f"{best * 1000:.1f}", f"{best * 1000 / count:.2f}", f"{kept:.0%}")
+
+    console.print(table)
+
+def main():
+    """主函數：執行背景移除基準測試"""
+    benchmark()
+
+if __name__ == "__main__":
+    main()
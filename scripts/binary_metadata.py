@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+二進位精靈表元數據
+固定大小檔頭 + 角色表 + 幀結構陣列 + 雜湊名稱索引 + 字串表，可直接記憶體映射，
+以幀名稱 O(1) 查找；同一格式同時用於單一角色與主精靈表索引
+"""
+
+import argparse
+import json
+import mmap
+import struct
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from rich.console import Console
+
+console = Console()
+
+MAGIC = b"MSPR"
+# 版本2：精靈表尺寸與幀 x/y 擴為32位元，主精靈表索引可容納上千個角色的垂直位移
+VERSION = 2
+
+# 檔頭：魔數、版本、旗標、角色數、幀數、各區段位移、雜湊槽數、字串表大小、
+# 精靈表圖檔名稱（字串表位移與長度）、精靈表尺寸；補齊至64位元組
+HEADER_FORMAT = "<4sHHIIIIIIIIIIII"
+HEADER_SIZE = 64
+assert struct.calcsize(HEADER_FORMAT) <= HEADER_SIZE
+
+CHARACTER_DTYPE = np.dtype([
+    ("name_offset", "<u4"), ("name_length", "<u2"), ("flags", "<u2"),
+    ("first_frame", "<u4"), ("frame_count", "<u4"), ("fps", "<f4"),
+])
+
+FRAME_DTYPE = np.dtype([
+    ("name_offset", "<u4"), ("name_length", "<u2"), ("character", "<u2"),
+    ("index", "<u2"), ("flags", "<u2"),
+    ("x", "<u4"), ("y", "<u4"), ("w", "<u2"), ("h", "<u2"),
+    ("source_x", "<u2"), ("source_y", "<u2"), ("source_w", "<u2"), ("source_h", "<u2"),
+    ("source_size_w", "<u2"), ("source_size_h", "<u2"),
+    ("pivot_x", "<f4"), ("pivot_y", "<f4"),
+])
+
+# 幀旗標
+FLAG_TRIMMED = 1 << 0
+FLAG_ROTATED = 1 << 1
+
+# 角色旗標
+FLAG_LOOP = 1 << 0
+
+def fnv1a_32(data: bytes) -> int:
+    """FNV-1a 32位元雜湊"""
+    value = 0x811C9DC5
+    for byte in data:
+        value = ((value ^ byte) * 0x01000193) & 0xFFFFFFFF
+    return value
+
+def _align(offset: int, alignment: int = 8) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+def _frame_rect(frame: Dict[str, Any]) -> Tuple[int, int, int, int]:
+    """取得幀在精靈表中的位置，相容舊版扁平欄位"""
+    rect = frame.get("frame")
+    if isinstance(rect, dict):
+        return rect["x"], rect["y"], rect["w"], rect["h"]
+    return frame["x"], frame["y"], frame["width"], frame["height"]
+
+def write_binary_metadata(path: Path,
+                          characters: List[Tuple[str, Dict[str, Any]]],
+                          image: str,
+                          sheet_size: Tuple[int, int],
+                          y_offsets: Optional[List[int]] = None):
+    """將一或多個角色的JSON元數據寫成二進位格式
+
+    y_offsets 為各角色精靈表在目標圖檔中的垂直位移（主精靈表使用）。
+    """
+    y_offsets = y_offsets or [0] * len(characters)
+    strings = bytearray()
+
+    def add_string(text: str) -> Tuple[int, int]:
+        encoded = text.encode("utf-8")
+        offset = len(strings)
+        strings.extend(encoded)
+        return offset, len(encoded)
+
+    image_offset, image_length = add_string(image)
+
+    character_table = np.zeros(len(characters), dtype=CHARACTER_DTYPE)
+    frame_count = sum(len(metadata["frames"]) for _, metadata in characters)
+    frame_table = np.zeros(frame_count, dtype=FRAME_DTYPE)
+    names: List[bytes] = []
+
+    frame_idx = 0
+    for char_idx, ((name, metadata), y_offset) in enumerate(zip(characters, y_offsets)):
+        name_offset, name_length = add_string(name)
+        animation = metadata.get("animation", {})
+        character_table[char_idx] = (
+            name_offset, name_length, FLAG_LOOP if animation.get("loop", True) else 0,
+            frame_idx, len(metadata["frames"]), animation.get("fps", 0.0),
+        )
+
+        default_size = metadata.get("frame_size", (0, 0))
+        for i, frame in enumerate(metadata["frames"]):
+            frame_name = frame.get("filename", f"{name}_{i:02d}")
+            frame_name_offset, frame_name_length = add_string(frame_name)
+            names.append(frame_name.encode("utf-8"))
+
+            x, y, w, h = _frame_rect(frame)
+            source = frame.get("spriteSourceSize", {"x": 0, "y": 0, "w": w, "h": h})
+            source_size = frame.get("sourceSize", {"w": default_size[0], "h": default_size[1]})
+            pivot = frame.get("pivot", {"x": 0.5, "y": 1.0})
+            flags = (FLAG_TRIMMED if frame.get("trimmed") else 0) | (FLAG_ROTATED if frame.get("rotated") else 0)
+
+            frame_table[frame_idx] = (
+                frame_name_offset, frame_name_length, char_idx, frame.get("index", i), flags,
+                x, y + y_offset, w, h,
+                source["x"], source["y"], source["w"], source["h"],
+                source_size["w"], source_size["h"],
+                pivot["x"], pivot["y"],
+            )
+            frame_idx += 1
+
+    # 開放定址雜湊表：槽數為2的冪次且至少為幀數兩倍，值為幀索引+1（0表示空槽）
+    hash_slots = 1
+    while hash_slots < max(2 * frame_count, 1):
+        hash_slots <<= 1
+    hash_table = np.zeros(hash_slots, dtype="<u4")
+    for i, encoded in enumerate(names):
+        slot = fnv1a_32(encoded) & (hash_slots - 1)
+        while hash_table[slot]:
+            slot = (slot + 1) & (hash_slots - 1)
+        hash_table[slot] = i + 1
+
+    characters_offset = HEADER_SIZE
+    frames_offset = _align(characters_offset + character_table.nbytes)
+    hash_offset = _align(frames_offset + frame_table.nbytes)
+    strings_offset = _align(hash_offset + hash_table.nbytes)
+
+    header = struct.pack(
+        HEADER_FORMAT, MAGIC, VERSION, 0, len(characters), frame_count,
+        characters_offset, frames_offset, hash_offset, hash_slots,
+        strings_offset, len(strings), image_offset, image_length,
+        sheet_size[0], sheet_size[1],
+    )
+
+    path = Path(path)
+    with open(path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        # 依序寫入各區段，並以零補齊到下一區段的對齊位移
+        for payload, next_offset in ((character_table.tobytes(), frames_offset),
+                                     (frame_table.tobytes(), hash_offset),
+                                     (hash_table.tobytes(), strings_offset)):
+            f.write(payload)
+            f.write(b"\0" * (next_offset - f.tell()))
+        f.write(bytes(strings))
+
+class BinarySpriteMetadata:
+    def __init__(self, path: str):
+        """以記憶體映射開啟二進位元數據"""
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, _, character_count, frame_count,
+         characters_offset, frames_offset, hash_offset, self.hash_slots,
+         strings_offset, strings_size, image_offset, image_length,
+         sheet_w, sheet_h) = struct.unpack_from(HEADER_FORMAT, self._mmap, 0)
+
+        if magic != MAGIC:
+            raise ValueError(f"不是精靈表二進位元數據: {self.path}")
+        if version != VERSION:
+            raise ValueError(f"不支援的元數據版本 {version}: {self.path}")
+
+        # 各區段皆為零拷貝視圖
+        self.characters = np.frombuffer(self._mmap, CHARACTER_DTYPE, character_count, characters_offset)
+        self.frames = np.frombuffer(self._mmap, FRAME_DTYPE, frame_count, frames_offset)
+        self._hash_table = np.frombuffer(self._mmap, "<u4", self.hash_slots, hash_offset)
+        self._strings_offset = strings_offset
+        self.image = self._string(image_offset, image_length)
+        self.sheet_size = (sheet_w, sheet_h)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """釋放記憶體映射"""
+        # 先釋放numpy視圖；呼叫端仍持有視圖時交由垃圾回收釋放映射
+        self.characters = self.frames = self._hash_table = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self._strings_offset + offset
+        return self._mmap[start:start + length].decode("utf-8")
+
+    def _name_bytes(self, frame_idx: int) -> bytes:
+        record = self.frames[frame_idx]
+        start = self._strings_offset + int(record["name_offset"])
+        return self._mmap[start:start + int(record["name_length"])]
+
+    def lookup(self, name: str) -> Optional[int]:
+        """以幀名稱查找幀索引，找不到時回傳None"""
+        encoded = name.encode("utf-8")
+        mask = self.hash_slots - 1
+        slot = fnv1a_32(encoded) & mask
+        while True:
+            value = int(self._hash_table[slot])
+            if value == 0:
+                return None
+            if self._name_bytes(value - 1) == encoded:
+                return value - 1
+            slot = (slot + 1) & mask
+
+    def frame(self, name: str) -> Optional[np.void]:
+        """以幀名稱取得幀結構記錄（複本，不依賴映射存活）"""
+        frame_idx = self.lookup(name)
+        return None if frame_idx is None else self.frames[frame_idx].copy()
+
+    def character_names(self) -> List[str]:
+        return [self._string(int(c["name_offset"]), int(c["name_length"])) for c in self.characters]
+
+    def character_frames(self, character: str) -> np.ndarray:
+        """取得指定角色的所有幀記錄"""
+        for name, record in zip(self.character_names(), self.characters):
+            if name == character:
+                start = int(record["first_frame"])
+                return self.frames[start:start + int(record["frame_count"])]
+        raise KeyError(character)
+
+    def to_json(self) -> Dict[str, Dict[str, Any]]:
+        """轉回與 SpriteSheetComposer 相同結構的JSON元數據，以角色名稱為鍵"""
+        result = {}
+        for name, record in zip(self.character_names(), self.characters):
+            start = int(record["first_frame"])
+            frame_count = int(record["frame_count"])
+            fps = float(record["fps"])
+            frames = []
+            for frame_idx in range(start, start + frame_count):
+                f = self.frames[frame_idx]
+                x, y, w, h = (int(f[k]) for k in ("x", "y", "w", "h"))
+                frames.append({
+                    "filename": self._name_bytes(frame_idx).decode("utf-8"),
+                    "frame": {"x": x, "y": y, "w": w, "h": h},
+                    "rotated": bool(f["flags"] & FLAG_ROTATED),
+                    "trimmed": bool(f["flags"] & FLAG_TRIMMED),
+                    "spriteSourceSize": {"x": int(f["source_x"]), "y": int(f["source_y"]),
+                                         "w": int(f["source_w"]), "h": int(f["source_h"])},
+                    "sourceSize": {"w": int(f["source_size_w"]), "h": int(f["source_size_h"])},
+                    "pivot": {"x": round(float(f["pivot_x"]), 4), "y": round(float(f["pivot_y"]), 4)},
+                    "index": int(f["index"]),
+                    "x": x, "y": y, "width": w, "height": h,
+                })
+            result[name] = {
+                "character_type": name,
+                "frame_count": frame_count,
+                "trimmed": any(frame["trimmed"] for frame in frames),
+                "animation": {
+                    "fps": fps,
+                    "loop": bool(record["flags"] & FLAG_LOOP),
+                    "total_duration": frame_count / fps if fps else 0.0,
+                },
+                "frames": frames,
+                "meta": {
+                    "app": "maplestory-sprite-generator",
+                    "image": self.image,
+                    "format": "RGBA8888",
+                    "size": {"w": self.sheet_size[0], "h": self.sheet_size[1]},
+                    "scale": "1",
+                },
+            }
+        return result
+
+def json_to_binary(json_paths: List[str], output_path: str):
+    """將一或多個角色JSON元數據轉為單一二進位檔
+
+    檔頭只記錄一張精靈表，幀座標也相對於該圖檔；所有輸入必須屬於同一張精靈表
+    （如主精靈表展開的角色），否則拋出 ValueError。
+    """
+    characters = []
+    sheets = {}
+    for json_path in json_paths:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        name = metadata["character_type"]
+        characters.append((name, metadata))
+        meta = metadata.get("meta", {})
+        size = meta.get("size", {"w": 0, "h": 0})
+        sheets.setdefault((meta.get("image", f"{name}_sprite_sheet.png"), size["w"], size["h"]), []).append(name)
+
+    if len(sheets) > 1:
+        listing = "; ".join(f"{image} ({w}x{h}): {', '.join(names)}" for (image, w, h), names in sheets.items())
+        raise ValueError(f"輸入的角色元數據分屬 {len(sheets)} 張精靈表，無法寫入同一個二進位檔"
+                         f"（請逐張轉換，或使用主精靈表索引）: {listing}")
+
+    (image, width, height), = sheets
+    write_binary_metadata(Path(output_path), characters, image, (width, height))
+
+def binary_to_json(binary_path: str, output_dir: str) -> List[Path]:
+    """將二進位元數據展開為每個角色一個JSON檔"""
+    output = Path(output_dir)
+    output.mkdir(exist_ok=True, parents=True)
+    written = []
+    with BinarySpriteMetadata(binary_path) as metadata:
+        for name, character in metadata.to_json().items():
+            json_path = output / f"{name}_metadata.json"
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(character, f, indent=2, ensure_ascii=False)
+            written.append(json_path)
+    return written
+
+def main():
+    """主函數：JSON與二進位元數據互轉"""
+    parser = argparse.ArgumentParser(description="精靈表元數據 JSON ↔ 二進位 轉換")
+    parser.add_argument("--to-binary", nargs="+", metavar="JSON", help="要轉換的角色JSON元數據")
+    parser.add_argument("--to-json", metavar="BIN", help="要展開的二進位元數據")
+    parser.add_argument("--output", "-o", required=True, help="輸出檔案（--to-binary）或目錄（--to-json）")
+    args = parser.parse_args()
+
+    if args.to_binary:
+        try:
+            json_to_binary(args.to_binary, args.output)
+        except ValueError as e:
+            parser.error(str(e))
+        console.print(f"✅ 已寫入二進位元數據: {args.output}", style="green")
+    elif args.to_json:
+        for path in binary_to_json(args.to_json, args.output):
+            console.print(f"✅ 已寫入: {path}", style="green")
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+配置服務
+每個程序只解析一次生成配置（優先使用C加速的YAML載入器），以型別化結構驗證，
+檔案變更時重新載入並通知訂閱者；寫入時持有鎖檔並以原子替換完成，
+避免多個角色添加程序同時寫入而損毀角色名單
+"""
+
+import copy
+import os
+import sys
+import tempfile
+import threading
+import time
+import yaml
+from contextlib import contextmanager
+from dataclasses import MISSING, dataclass, field, fields, is_dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, get_args, get_origin, get_type_hints
+from rich.console import Console
+
+console = Console()
+
+DEFAULT_CONFIG_PATH = "configs/generation_config.yaml"
+
+# 有C擴充時使用 libyaml 加速解析與輸出
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# 鎖檔超過此秒數視為持有者已中止，可強制取得
+STALE_LOCK_SECONDS = 60.0
+
+# Python 3.10 起 dataclass 支援 slots，大量角色模板時減少記憶體；舊版退回一般 dataclass
+DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+class ConfigError(ValueError):
+    """配置內容不符合結構定義"""
+
+@dataclass(**DATACLASS_SLOTS)
+class CharacterTemplate:
+    positive: str
+    style: str = ""
+    negative: str = ""
+    tags: List[str] = field(default_factory=list)
+    backend: str = ""
+    reference: str = ""
+
+@dataclass(**DATACLASS_SLOTS)
+class ImageSettings:
+    width: int = 512
+    height: int = 512
+    original_sprite_size: Tuple[int, int] = (32, 48)
+    upscale_factor: int = 8
+    output_format: str = "PNG"
+
+@dataclass(**DATACLASS_SLOTS)
+class GenerationParams:
+    num_inference_steps: int = 30
+    guidance_scale: float = 7.5
+
+@dataclass(**DATACLASS_SLOTS)
+class AnimationSettings:
+    walk_cycle_frames: int = 8
+    fps: float = 8.0
+    directions: List[str] = field(default_factory=lambda: ["right"])
+    pose_clip: str = "walk"
+
+@dataclass(**DATACLASS_SLOTS)
+class PromptSettings:
+    base_positive: str = ""
+    base_negative: str = ""
+    character_templates: Dict[str, CharacterTemplate] = field(default_factory=dict)
+
+@dataclass(**DATACLASS_SLOTS)
+class GenerationConfig:
+    """生成配置中各模組共同依賴的部分；其餘區段不在此驗證"""
+    image_settings: ImageSettings = field(default_factory=ImageSettings)
+    generation_params: GenerationParams = field(default_factory=GenerationParams)
+    animation: AnimationSettings = field(default_factory=AnimationSettings)
+    prompts: PromptSettings = field(default_factory=PromptSettings)
+
+def _convert(value: Any, hint: Any, path: str) -> Any:
+    """依型別提示驗證並轉換單一值"""
+    origin = get_origin(hint)
+
+    if is_dataclass(hint):
+        return build_schema(hint, value, path)
+    if origin is tuple:
+        item_types = get_args(hint)
+        if not isinstance(value, (list, tuple)) or len(value) != len(item_types):
+            raise ConfigError(f"{path} 需要 {len(item_types)} 個元素的列表，收到 {value!r}")
+        return tuple(_convert(v, t, f"{path}[{i}]") for i, (v, t) in enumerate(zip(value, item_types)))
+    if origin is list:
+        if not isinstance(value, list):
+            raise ConfigError(f"{path} 需要列表，收到 {value!r}")
+        (item_type,) = get_args(hint)
+        return [_convert(v, item_type, f"{path}[{i}]") for i, v in enumerate(value)]
+    if origin is dict:
+        if not isinstance(value, dict):
+            raise ConfigError(f"{path} 需要映射，收到 {value!r}")
+        key_type, value_type = get_args(hint)
+        return {_convert(k, key_type, path): _convert(v, value_type, f"{path}.{k}") for k, v in value.items()}
+
+    # 布林值不可當作數字；整數可當作浮點數
+    if hint is float and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if hint is int and isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if hint is str and isinstance(value, str):
+        return value
+    if value is None and hint is str:
+        return ""
+    raise ConfigError(f"{path} 需要 {getattr(hint, '__name__', hint)}，收到 {value!r}")
+
+def build_schema(cls, data: Any, path: str = "config"):
+    """以 dataclass 結構驗證映射；未知欄位忽略，缺少且無預設值的欄位報錯"""
+    if not isinstance(data, dict):
+        raise ConfigError(f"{path} 需要映射，收到 {data!r}")
+
+    hints = get_type_hints(cls)
+    values = {}
+    for f in fields(cls):
+        if f.name in data:
+            values[f.name] = _convert(data[f.name], hints[f.name], f"{path}.{f.name}")
+        elif f.default is MISSING and f.default_factory is MISSING:
+            raise ConfigError(f"{path}.{f.name} 為必要欄位")
+    return cls(**values)
+
+def validate_config(raw: Dict[str, Any]) -> GenerationConfig:
+    """驗證原始配置並回傳型別化結構"""
+    return build_schema(GenerationConfig, raw)
+
+def atomic_write_text(path: Path, text: str):
+    """先寫入同目錄的暫存檔再原子替換，避免中斷時留下半寫入的檔案"""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+@contextmanager
+def file_lock(path: Path, timeout: float = 30.0, poll_interval: float = 0.05):
+    """以 O_EXCL 建立鎖檔的跨程序互斥鎖"""
+    lock_path = Path(f"{path}.lock")
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - lock_path.stat().st_mtime > STALE_LOCK_SECONDS:
+                    console.print(f"⚠️ 移除過期的鎖檔: {lock_path}", style="yellow")
+                    lock_path.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"無法在 {timeout} 秒內取得配置鎖: {lock_path}")
+            time.sleep(poll_interval)
+
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        lock_path.unlink(missing_ok=True)
+
+class ConfigService:
+    def __init__(self, path: str = DEFAULT_CONFIG_PATH):
+        """初始化配置服務（通常透過 get_config_service 取得共用實例）"""
+        self.path = Path(path)
+        self._raw: Optional[Dict[str, Any]] = None
+        self._schema: Optional[GenerationConfig] = None
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._subscribers: List[Callable[[Dict[str, Any]], None]] = []
+        self._lock = threading.RLock()
+
+    def _file_stamp(self) -> Tuple[int, int]:
+        stat = self.path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read_disk(self) -> Dict[str, Any]:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return yaml.load(f, Loader=YAML_LOADER) or {}
+
+    def _refresh(self) -> bool:
+        """檔案有變更時重新解析，回傳是否重新載入"""
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return False
+        raw = self._read_disk()
+        self._schema = validate_config(raw)
+        self._raw = raw
+        self._stamp = stamp
+        return True
+
+    def get(self) -> Dict[str, Any]:
+        """取得配置字典（複本，呼叫端可自由修改）"""
+        self.check_for_changes()
+        with self._lock:
+            return copy.deepcopy(self._raw)
+
+    def schema(self) -> GenerationConfig:
+        """取得已驗證的型別化配置"""
+        self.check_for_changes()
+        return self._schema
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None]):
+        """訂閱配置變更；檔案被其他程序修改或經由 update 寫入後呼叫"""
+        self._subscribers.append(callback)
+
+    def _notify(self):
+        for callback in list(self._subscribers):
+            callback(copy.deepcopy(self._raw))
+
+    def check_for_changes(self) -> bool:
+        """檢查檔案是否變更，變更時重新載入並通知訂閱者"""
+        with self._lock:
+            first_load = self._stamp is None
+            changed = self._refresh()
+        if changed and not first_load:
+            self._notify()
+        return changed
+
+    def update(self, mutator: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+        """在鎖內以磁碟上的最新內容套用修改並原子寫回
+
+        先重新讀取再修改，避免覆蓋其他程序在此期間寫入的內容。
+        """
+        with self._lock, file_lock(self.path):
+            raw = self._read_disk()
+            mutator(raw)
+            self._schema = validate_config(raw)
+            text = yaml.dump(raw, Dumper=YAML_DUMPER, default_flow_style=False,
+                             allow_unicode=True, sort_keys=False)
+            atomic_write_text(self.path, text)
+            self._raw = raw
+            self._stamp = self._file_stamp()
+        self._notify()
+        return copy.deepcopy(raw)
+
+# 每個配置檔路徑在程序內共用一個服務
+_services: Dict[Path, ConfigService] = {}
+_services_lock = threading.Lock()
+
+def get_config_service(path: str = DEFAULT_CONFIG_PATH) -> ConfigService:
+    """取得指定配置檔的共用服務"""
+    key = Path(path).resolve()
+    with _services_lock:
+        if key not in _services:
+            _services[key] = ConfigService(path)
+        return _services[key]
+
+def load_config(path: str = DEFAULT_CONFIG_PATH) -> Dict[str, Any]:
+    """載入並驗證配置（程序內快取，檔案未變更時不重新解析）"""
+    return get_config_service(path).get()
+
+def main():
+    """主函數：驗證配置檔"""
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CONFIG_PATH
+    try:
+        schema = get_config_service(path).schema()
+    except ConfigError as e:
+        console.print(f"❌ 配置驗證失敗: {e}", style="red")
+        sys.exit(1)
+
+    console.print(f"✅ 配置驗證通過: {path}", style="green")
+    console.print(f"   角色模板: {len(schema.prompts.character_templates)} 個", style="cyan")
+    console.print(f"   YAML載入器: {YAML_LOADER.__name__}", style="cyan")
+
+if __name__ == "__main__":
+    main()
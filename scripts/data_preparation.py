@@ -5,7 +5,7 @@
 """
 
 import os
-import yaml
+import time
 import requests
 from pathlib import Path
 from PIL import Image, ImageOps
@@ -13,19 +13,30 @@ import numpy as np
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, TextColumn
 import cv2
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple
 
+from scripts.config_service import load_config
+from scripts.pose_library import PoseLibrary, build_clip, write_builtin_clips, LEGACY_PATTERN
+
 console = Console()
 
 class DataPreparation:
     def __init__(self, config_path: str = "configs/generation_config.yaml"):
         """初始化資料準備器"""
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+        self.config = load_config(config_path)
         
         self.raw_dir = Path("data/raw_sprites")
         self.processed_dir = Path("data/processed")
         self.reference_dir = Path("data/references")
+        self.frames_dir = self.processed_dir / "frames"
+        
+        # 幀輸出設定：每張精靈表只解碼一次，幀以陣列視圖切割
+        prep_config = self.config.get('data_preparation', {})
+        self.frame_store = prep_config.get('frame_store', "png")
+        self.upscale_frames = prep_config.get('upscale_frames', True)
+        self.save_upscaled_sheets = prep_config.get('save_upscaled_sheets', False)
+        self.workers = prep_config.get('workers', 4)
         
         # 確保目錄存在
         for dir_path in [self.raw_dir, self.processed_dir, self.reference_dir]:
@@ -82,69 +93,106 @@ class DataPreparation:
         
         return sprite_sheet
     
+    @staticmethod
+    def upscale_array(pixels: np.ndarray, factor: int) -> np.ndarray:
+        """以最近鄰方式放大 (..., H, W, C) 陣列的最後兩個空間維度（單次複製）"""
+        if factor == 1:
+            return pixels
+        *lead, height, width, channels = pixels.shape
+        expanded = np.broadcast_to(
+            pixels[..., :, None, :, None, :],
+            (*lead, height, factor, width, factor, channels)
+        )
+        return expanded.reshape(*lead, height * factor, width * factor, channels)
+    
+    def load_sheet(self, sprite_path: Path) -> np.ndarray:
+        """解碼精靈表為 (H, W, 4) uint8 陣列"""
+        with Image.open(sprite_path) as img:
+            return np.asarray(img.convert('RGBA'))
+    
+    def slice_frames(self, sheet: np.ndarray) -> np.ndarray:
+        """以原始解析度將精靈表第一列切成 (N, h, w, 4) 的幀（陣列視圖，不複製）"""
+        frame_width, frame_height = self.config['image_settings']['original_sprite_size']
+        cols = sheet.shape[1] // frame_width
+        
+        row = sheet[:frame_height, :cols * frame_width]
+        return row.reshape(frame_height, cols, frame_width, 4).swapaxes(0, 1)
+    
+    @staticmethod
+    def character_name(sprite_path: Path) -> str:
+        """從精靈表檔名取得角色名稱"""
+        return sprite_path.stem.replace("_walk_cycle", "")
+    
     def upscale_sprites(self):
-        """將原始32x48像素放大到256x384用於SD處理"""
+        """將原始32x48像素精靈表放大到256x384（選用的中間產物，幀提取不再依賴）"""
         console.print("🔍 開始放大精靈圖至SD合適尺寸...", style="bold blue")
         
         upscale_factor = self.config['image_settings']['upscale_factor']
         
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            console=console
-        ) as progress:
-            task = progress.add_task("處理精靈圖...", total=None)
-            
-            for sprite_file in self.raw_dir.glob("*.png"):
-                self.process_single_sprite(sprite_file, upscale_factor)
-                progress.update(task, description=f"已處理 {sprite_file.name}")
+        def process(sprite_file: Path):
+            self.process_single_sprite(sprite_file, upscale_factor)
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(process, sorted(self.raw_dir.glob("*.png"))))
         
         console.print("✅ 精靈圖放大完成", style="green")
     
     def process_single_sprite(self, sprite_path: Path, upscale_factor: int):
         """處理單個精靈圖"""
-        img = Image.open(sprite_path)
-        
-        # 使用最近鄰插值放大以保持像素風格
-        upscaled_img = img.resize(
-            (img.width * upscale_factor, img.height * upscale_factor),
-            Image.NEAREST
-        )
+        upscaled = self.upscale_array(self.load_sheet(sprite_path), upscale_factor)
         
         # 保存到processed目錄
         output_path = self.processed_dir / f"upscaled_{sprite_path.name}"
-        upscaled_img.save(output_path, "PNG")
+        Image.fromarray(upscaled, 'RGBA').save(output_path, "PNG")
     
     def extract_frames(self):
-        """從精靈表中提取單幀"""
-        console.print("🎞️  提取單幀圖片...", style="bold blue")
-        
-        frames_dir = self.processed_dir / "frames"
-        frames_dir.mkdir(exist_ok=True)
+        """從原始精靈表提取單幀：每張只解碼一次，需要時才放大
         
-        sprite_size = self.config['image_settings']['original_sprite_size']
-        upscale_factor = self.config['image_settings']['upscale_factor']
-        frame_size = (sprite_size[0] * upscale_factor, sprite_size[1] * upscale_factor)
-        
-        for sprite_file in self.processed_dir.glob("upscaled_*.png"):
-            self.extract_frames_from_sheet(sprite_file, frame_size, frames_dir)
+        只處理 *_walk_cycle.png 精靈表；參考圖片等非精靈表的圖片不切幀。
+        """
+        console.print("🎞️  提取單幀圖片...", style="bold blue")
+        start = time.perf_counter()
+        
+        self.frames_dir.mkdir(exist_ok=True)
+        upscale_factor = self.config['image_settings']['upscale_factor'] if self.upscale_frames else 1
+        sprite_files = sorted(self.raw_dir.glob("*_walk_cycle.png"))
+        skipped = len(list(self.raw_dir.glob("*.png"))) - len(sprite_files)
+        if skipped:
+            console.print(f"⏭️  略過 {skipped} 張非精靈表圖片（參考圖片等）", style="yellow")
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = []
+            frame_count = 0
+            for sprite_file in sprite_files:
+                sheet = self.load_sheet(sprite_file)
+                frames = self.slice_frames(sheet)
+                char_name = self.character_name(sprite_file)
+                frame_count += len(frames)
+                
+                if self.save_upscaled_sheets:
+                    upscaled_sheet = self.upscale_array(sheet, self.config['image_settings']['upscale_factor'])
+                    output_path = self.processed_dir / f"upscaled_{sprite_file.name}"
+                    pending.append(executor.submit(
+                        Image.fromarray(upscaled_sheet, 'RGBA').save, output_path, "PNG"
+                    ))
+                
+                if self.frame_store == "npy":
+                    # 幀庫：每個角色一個 (N, H, W, 4) 陣列，可直接記憶體映射
+                    np.save(self.frames_dir / f"{char_name}_frames.npy", self.upscale_array(frames, upscale_factor))
+                else:
+                    for i, frame in enumerate(frames):
+                        frame_path = self.frames_dir / f"{char_name}_frame_{i:02d}.png"
+                        pending.append(executor.submit(self._save_frame, frame, upscale_factor, frame_path))
+            
+            for future in pending:
+                future.result()
         
-        console.print("✅ 單幀提取完成", style="green")
+        elapsed = time.perf_counter() - start
+        console.print(f"✅ 單幀提取完成: {len(sprite_files)} 張精靈表, {frame_count} 幀, {elapsed:.2f}s", style="green")
     
-    def extract_frames_from_sheet(self, sheet_path: Path, frame_size: Tuple[int, int], output_dir: Path):
-        """從精靈表提取單幀"""
-        sheet = Image.open(sheet_path)
-        frame_width, frame_height = frame_size
-        frames_count = sheet.width // frame_width
-        
-        char_name = sheet_path.stem.replace("upscaled_", "").replace("_walk_cycle", "")
-        
-        for i in range(frames_count):
-            left = i * frame_width
-            frame = sheet.crop((left, 0, left + frame_width, frame_height))
-            
-            frame_path = output_dir / f"{char_name}_frame_{i:02d}.png"
-            frame.save(frame_path, "PNG")
+    def _save_frame(self, frame: np.ndarray, upscale_factor: int, frame_path: Path):
+        """放大並保存單幀（在工作執行緒中執行）"""
+        Image.fromarray(np.ascontiguousarray(self.upscale_array(frame, upscale_factor)), 'RGBA').save(frame_path, "PNG")
     
     def create_pose_references(self):
         """創建姿勢參考文件（用於ControlNet）"""
@@ -153,43 +201,19 @@ class DataPreparation:
         pose_dir = self.reference_dir / "poses"
         pose_dir.mkdir(exist_ok=True)
         
-        # 創建基本行走姿勢的OpenPose格式JSON
-        walk_poses = self.generate_walk_poses()
+        # 各動作只存關鍵幀，同時寫成可檢視的JSON與可直接載入的 .npz
+        written = write_builtin_clips(pose_dir)
         
-        for i, pose in enumerate(walk_poses):
-            pose_file = pose_dir / f"walk_pose_{i:02d}.json"
-            with open(pose_file, 'w') as f:
-                yaml.dump(pose, f)
+        # 舊版逐幀檔已由姿勢庫取代
+        for legacy_file in pose_dir.glob(LEGACY_PATTERN):
+            legacy_file.unlink()
         
-        console.print("✅ 姿勢參考創建完成", style="green")
+        walk_poses = self.generate_walk_poses()
+        console.print(f"✅ 姿勢參考創建完成: {len(written)} 個檔案，行走 {walk_poses.frame_count} 幀", style="green")
     
-    def generate_walk_poses(self) -> List[dict]:
-        """生成行走姿勢資料"""
-        # 簡化的行走姿勢關鍵點
-        base_pose = {
-            "keypoints": [
-                {"name": "head", "x": 0.5, "y": 0.15},
-                {"name": "neck", "x": 0.5, "y": 0.25},
-                {"name": "torso", "x": 0.5, "y": 0.5},
-                {"name": "left_shoulder", "x": 0.3, "y": 0.3},
-                {"name": "right_shoulder", "x": 0.7, "y": 0.3},
-                {"name": "left_hip", "x": 0.4, "y": 0.65},
-                {"name": "right_hip", "x": 0.6, "y": 0.65},
-            ]
-        }
-        
-        poses = []
-        frames = self.config['animation']['walk_cycle_frames']
-        
-        for i in range(frames):
-            pose = base_pose.copy()
-            # 簡單的行走動畫偏移
-            walk_offset = np.sin(2 * np.pi * i / frames) * 0.1
-            pose["frame"] = i
-            pose["walk_offset"] = walk_offset
-            poses.append(pose)
-        
-        return poses
+    def generate_walk_poses(self) -> PoseLibrary:
+        """生成行走姿勢資料（由關鍵幀插值為配置的幀數）"""
+        return build_clip("walk").sample(self.config['animation']['walk_cycle_frames'])
     
     def validate_data(self):
         """驗證準備的資料"""
@@ -201,9 +225,9 @@ class DataPreparation:
                 console.print(f"❌ 缺少目錄: {dir_path}", style="red")
                 return False
         
-        # 檢查是否有處理後的圖片
-        if not list(self.processed_dir.glob("upscaled_*.png")):
-            console.print("❌ 缺少處理後的精靈圖", style="red")
+        # 檢查是否有提取後的幀
+        if not any(self.frames_dir.glob("*_frame_*.png")) and not any(self.frames_dir.glob("*_frames.npy")):
+            console.print("❌ 缺少提取後的幀", style="red")
             return False
         
         console.print("✅ 資料驗證通過", style="green")
@@ -215,7 +239,6 @@ class DataPreparation:
         
         try:
             self.download_sample_sprites()
-            self.upscale_sprites()
             self.extract_frames()
             self.create_pose_references()
             
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+行走方向規劃
+決定每個方向要重新生成還是由鏡像方向水平翻轉而來：左右互為鏡像，
+只有上、下等不對稱方向需要額外的擴散生成
+"""
+
+from typing import Dict, Any, List, Optional
+
+# 可由水平翻轉互相得到的方向
+MIRROR_DIRECTIONS = {"left": "right", "right": "left"}
+
+# 鏡像方向的處理方式
+MIRROR_METADATA = "metadata"  # 只存來源方向的精靈表，元數據標記 flipX
+MIRROR_FLIP = "flip"          # 組合時水平翻轉，另存一張精靈表
+
+def plan_directions(directions: List[str]) -> Dict[str, Optional[str]]:
+    """回傳 {方向: 鏡像來源方向}；需要生成的方向對應 None
+
+    列表中的第一個方向為基準方向，沿用既有的幀與精靈表檔名。
+    """
+    plan: Dict[str, Optional[str]] = {}
+    for direction in directions:
+        mirror = MIRROR_DIRECTIONS.get(direction)
+        plan[direction] = mirror if plan.get(mirror, "") is None else None
+    return plan
+
+def direction_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    """從生成配置讀取方向設定"""
+    animation = config.get('animation', {})
+    directions = list(animation.get('directions') or ["right"])
+    return {
+        "directions": directions,
+        "base": directions[0],
+        "plan": plan_directions(directions),
+        "mirror_mode": animation.get('mirror_mode', MIRROR_METADATA),
+        "prompts": animation.get('direction_prompts', {}),
+    }
+
+def frame_prefix(character_type: str, direction: Optional[str], base_direction: str) -> str:
+    """幀與精靈表的檔名前綴；基準方向沿用角色名稱"""
+    if direction is None or direction == base_direction:
+        return character_type
+    return f"{character_type}_{direction}"
+
+def generated_directions(settings: Dict[str, Any]) -> List[str]:
+    """需要實際生成的方向（鏡像方向不在其中）；settings 為 direction_settings 的結果"""
+    return [direction for direction, source in settings["plan"].items() if source is None]
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+乾跑模式
+以不載入模型的生成後端（預設為合成替身）取代擴散模型，其餘照常執行真正的 DataPreparation 與
+SpriteSheetComposer 程式路徑，並逐階段計時；演示與 main.py --dry-run 共用，
+量測的是實際的後處理吞吐量而非模擬延遲
+"""
+
+import time
+from contextlib import contextmanager
+from rich.console import Console
+from rich.table import Table
+from typing import List, Optional, Iterable, Tuple
+
+from scripts.generator_backends import create_backend
+from scripts.directions import direction_settings, generated_directions
+from scripts.config_service import load_config
+from scripts.template_store import CharacterRoster
+
+console = Console()
+
+DRY_RUN_STAGES = ("data_prep", "generate", "compose")
+
+# 不載入模型的生成後端
+DRY_RUN_BACKENDS = ("synthetic", "solid", "procedural")
+
+STAGE_LABELS = {
+    "data_prep": "資料準備",
+    "generate": "替身生成",
+    "compose": "精靈表組合",
+}
+
+class StageTimings:
+    """逐階段計時並以表格輸出"""
+
+    def __init__(self):
+        self.rows: List[Tuple[str, float, Optional[int]]] = []
+
+    @contextmanager
+    def stage(self, label: str, items: Optional[int] = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.rows.append((label, time.perf_counter() - start, items))
+
+    @property
+    def total(self) -> float:
+        return sum(seconds for _, seconds, _ in self.rows)
+
+    def print_table(self, title: str = "各階段耗時"):
+        table = Table(title=title)
+        table.add_column("階段", style="cyan")
+        table.add_column("時間 (s)", justify="right")
+        table.add_column("數量", justify="right")
+        table.add_column("每項 (ms)", justify="right")
+        for label, seconds, items in self.rows:
+            per_item = f"{seconds * 1000 / items:.2f}" if items else "—"
+            table.add_row(label, f"{seconds:.2f}", str(items) if items is not None else "—", per_item)
+        table.add_row("合計", f"{self.total:.2f}", "", "", style="bold")
+        console.print(table)
+
+class DryRunPipeline:
+    def __init__(self, config_path: str = "configs/generation_config.yaml", backend: str = "synthetic"):
+        """以生成配置與不載入模型的生成後端初始化乾跑流程"""
+        if backend not in DRY_RUN_BACKENDS:
+            raise ValueError(f"乾跑不支援的生成後端: {backend}（可用: {', '.join(DRY_RUN_BACKENDS)}）")
+        self.config_path = config_path
+        self.config = load_config(config_path)
+        self.roster = CharacterRoster(self.config)
+        self.directions = direction_settings(self.config)
+        self.backend = create_backend(backend, self.config, config_path)
+        self.timings = StageTimings()
+
+    def generated_directions(self) -> List[str]:
+        """需要生成的方向（與 SpriteGenerator 相同，鏡像方向不在其中）"""
+        return generated_directions(self.directions)
+
+    def run_data_prep(self):
+        # 資料準備（requests / OpenCV）與精靈表組合（SciPy）只在執行該階段時載入
+        from scripts.data_preparation import DataPreparation
+        DataPreparation(self.config_path).run_all()
+
+    def run_generate(self, character_types: List[str]) -> int:
+        """以生成後端寫出幀，檔名與像素化後處理與 SpriteGenerator 相同"""
+        return self.backend.generate_characters(character_types)
+
+    def run_compose(self, character_types: List[str]):
+        from scripts.sheet_composer import SpriteSheetComposer
+        SpriteSheetComposer(self.config_path).compose_all_sheets(character_types)
+
+    def run(self, character_types: Optional[List[str]] = None,
+            stages: Iterable[str] = DRY_RUN_STAGES) -> StageTimings:
+        """執行指定階段（預設完整流程）並輸出各階段耗時"""
+        if character_types is None:
+            character_types = self.roster.names()
+        console.print(f"🧪 乾跑模式: {len(character_types)} 個角色，生成後端 {self.backend.name}（不載入模型）",
+                      style="bold magenta")
+
+        frame_total = len(character_types) * len(self.generated_directions()) * self.backend.frame_count
+        for stage in stages:
+            if stage not in DRY_RUN_STAGES:
+                raise ValueError(f"未知的階段: {stage}（可用: {', '.join(DRY_RUN_STAGES)}）")
+            if stage == "data_prep":
+                with self.timings.stage(STAGE_LABELS[stage]):
+                    self.run_data_prep()
+            elif stage == "generate":
+                with self.timings.stage(STAGE_LABELS[stage], frame_total):
+                    self.run_generate(character_types)
+            else:
+                with self.timings.stage(STAGE_LABELS[stage], frame_total):
+                    self.run_compose(character_types)
+
+        self.timings.print_table("乾跑各階段耗時")
+        return self.timings
+
+def main():
+    """主函數：執行完整的乾跑流程"""
+    DryRunPipeline().run()
+
+if __name__ == "__main__":
+    main()
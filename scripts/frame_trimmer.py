@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+幀裁切
+計算每幀不透明區域的最小外框，裁掉透明邊緣並提供腳底錨點
+"""
+
+import numpy as np
+from PIL import Image
+from typing import List, Tuple
+
+def compute_alpha_bboxes(stack: np.ndarray) -> np.ndarray:
+    """計算 (N, H, W, 4) 堆疊每幀的alpha外框，回傳 (N, 4) 的 [x, y, w, h]
+
+    全透明的幀回傳 [0, 0, 0, 0]。
+    """
+    opaque = stack[..., 3] > 0
+    rows = opaque.any(axis=2)
+    cols = opaque.any(axis=1)
+    height, width = opaque.shape[1:]
+
+    top = rows.argmax(axis=1)
+    bottom = height - rows[:, ::-1].argmax(axis=1)
+    left = cols.argmax(axis=1)
+    right = width - cols[:, ::-1].argmax(axis=1)
+
+    bboxes = np.stack([left, top, right - left, bottom - top], axis=1)
+    bboxes[~rows.any(axis=1)] = 0
+    return bboxes
+
+def trim_frames(frames: List[Image.Image]) -> Tuple[List[Image.Image], np.ndarray]:
+    """將同尺寸的幀裁切到各自的alpha外框，回傳 (裁切後的幀, 外框)"""
+    stack = np.stack([np.asarray(frame.convert('RGBA')) for frame in frames])
+    bboxes = compute_alpha_bboxes(stack)
+
+    trimmed = []
+    for frame, (x, y, w, h) in zip(stack, bboxes):
+        if w == 0 or h == 0:
+            # 全透明幀保留1x1透明像素，避免零尺寸圖像
+            trimmed.append(Image.new('RGBA', (1, 1), (0, 0, 0, 0)))
+        else:
+            trimmed.append(Image.fromarray(frame[y:y + h, x:x + w], 'RGBA'))
+    return trimmed, bboxes
+
+def foot_pivots(bboxes: np.ndarray, source_size: Tuple[int, int]) -> np.ndarray:
+    """計算每幀以腳底為基準的錨點，回傳相對於未裁切來源幀 (sourceSize) 的正規化 (N, 2) [x, y]
+
+    錨點取來源幀水平中心與整個週期最低的不透明列，與 TexturePacker 的 pivot 相同以來源尺寸正規化，
+    引擎依 spriteSourceSize 還原裁切位移後，所有幀對齊同一條地面線。
+    """
+    _, source_height = source_size
+    ground_y = float((bboxes[:, 1] + bboxes[:, 3]).max()) if len(bboxes) else float(source_height)
+    pivot = [0.5, ground_y / source_height]
+    return np.tile(np.array(pivot, dtype=np.float64), (len(bboxes), 1))
+
+def pack_frames(frames: List[Image.Image], layout: str, padding: int,
+                cols: int = 4) -> Tuple[Image.Image, List[Tuple[int, int, int, int]]]:
+    """將不同尺寸的幀排入精靈表，回傳 (精靈表, 每幀在表中的 [x, y, w, h])"""
+    sizes = [frame.size for frame in frames]
+    rects = []
+
+    if layout == "horizontal":
+        x = 0
+        for w, h in sizes:
+            rects.append((x, 0, w, h))
+            x += w + padding
+        sheet_size = (max(x - padding, 1), max(h for _, h in sizes))
+    else:
+        cell_w = max(w for w, _ in sizes)
+        cell_h = max(h for _, h in sizes)
+        rows = (len(frames) + cols - 1) // cols
+        for i, (w, h) in enumerate(sizes):
+            rects.append(((i % cols) * (cell_w + padding), (i // cols) * (cell_h + padding), w, h))
+        sheet_size = ((cell_w + padding) * cols - padding, (cell_h + padding) * rows - padding)
+
+    sheet = Image.new('RGBA', sheet_size, (0, 0, 0, 0))
+    for frame, (x, y, _, _) in zip(frames, rects):
+        sheet.paste(frame, (x, y), frame)
+    return sheet, rects
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+生成後端
+將「為一個角色產生一個方向的行走週期」抽象為共同介面，main.py、Web介面與精靈表組合共用：
+diffusion（SD + ControlNet）、img2img_reference（參考圖片批次img2img）、
+procedural（程序化2D骨架，與Kelly生成器相同）、synthetic 與 solid（不載入模型的替身）。
+後端依配置逐角色選擇，低優先度的角色可改用便宜的後端而不佔用擴散管線
+"""
+
+import json
+import zlib
+import numpy as np
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from PIL import Image
+from rich.console import Console
+from typing import Dict, Any, List, Optional, Iterator, Type
+
+from scripts.directions import direction_settings, frame_prefix, generated_directions
+from scripts.pixel_art_optimizer import posterize_pixel_art
+from scripts.synthetic_workload import SyntheticSpriteRenderer
+from scripts.sprite_rig import SpriteRig, load_rig_keypoints
+from scripts.template_store import CharacterRoster
+from scripts.config_service import load_config, atomic_write_text
+
+console = Console()
+
+DEFAULT_BACKEND = "diffusion"
+
+RAW_SPRITES_DIR = Path("data/raw_sprites")
+
+# 幀目錄中記錄各幀前綴由哪個後端產生，精靈表元數據據此標記
+BACKEND_MANIFEST = "generator_backends.json"
+
+@dataclass
+class WalkCycleEvent:
+    """行走週期串流事件：kind 為 "preview"（去噪中間預覽）或 "frame"（完成幀）"""
+    kind: str
+    character_type: str
+    frame_idx: int
+    image: Image.Image
+    step: Optional[int] = None
+    total_steps: Optional[int] = None
+
+def write_frames(frames: List[Image.Image], prefix: str, output_dir: Path):
+    """以生成器的檔名寫出原始幀與像素化後處理幀"""
+    output_dir.mkdir(exist_ok=True, parents=True)
+    for frame_idx, frame in enumerate(frames):
+        frame.save(output_dir / f"{prefix}_frame_{frame_idx:02d}.png", "PNG")
+        posterize_pixel_art(frame).save(output_dir / f"{prefix}_processed_frame_{frame_idx:02d}.png", "PNG")
+
+def read_backend_manifest(frames_dir: Path) -> Dict[str, str]:
+    """讀取 {幀前綴: 後端名稱}，不存在時為空"""
+    path = Path(frames_dir) / BACKEND_MANIFEST
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def record_backend(frames_dir: Path, prefixes: List[str], name: str):
+    """記錄這些幀前綴由指定後端產生（整批合併後原子寫回）"""
+    manifest = read_backend_manifest(frames_dir)
+    manifest.update(dict.fromkeys(prefixes, name))
+    Path(frames_dir).mkdir(exist_ok=True, parents=True)
+    atomic_write_text(Path(frames_dir) / BACKEND_MANIFEST, json.dumps(manifest, indent=2, ensure_ascii=False))
+
+def find_reference_sprite(character_type: str, template: Optional[Dict[str, Any]] = None,
+                          raw_dir: Path = RAW_SPRITES_DIR) -> Optional[Path]:
+    """角色的參考圖片：模板的 reference 欄位、{角色}_reference.png、{角色}.png（不分大小寫）"""
+    if template and template.get('reference'):
+        return Path(template['reference'])
+    for name in (f"{character_type}_reference.png", f"{character_type}.png"):
+        if (raw_dir / name).exists():
+            return raw_dir / name
+    for path in sorted(raw_dir.glob("*.png")):
+        if path.stem.lower() == character_type.lower():
+            return path
+    return None
+
+class FrameBackend(ABC):
+    """生成後端的共同介面；config 為呼叫端持有的配置字典，執行中的修改（如幀數）即時生效"""
+
+    name = ""
+
+    def __init__(self, config: Dict[str, Any], config_path: str = "configs/generation_config.yaml"):
+        self.config = config
+        self.config_path = config_path
+        self.roster = CharacterRoster(config)
+        self.output_dir = Path("output/frames")
+
+    @property
+    def frame_count(self) -> int:
+        return self.config['animation']['walk_cycle_frames']
+
+    @property
+    def directions(self) -> Dict[str, Any]:
+        return direction_settings(self.config)
+
+    def prefixes(self, character_types: List[str]) -> List[str]:
+        """角色在各生成方向的幀前綴"""
+        settings = self.directions
+        return [frame_prefix(character_type, direction, settings["base"])
+                for character_type in character_types for direction in generated_directions(settings)]
+
+    @abstractmethod
+    def generate_cycle(self, character_type: str, direction: Optional[str] = None) -> List[Image.Image]:
+        """產生一個方向的完整行走週期；direction 為 None 時為基準方向"""
+
+    def iter_cycle(self, character_type: str, direction: Optional[str] = None,
+                   preview_every: int = 0) -> Iterator[WalkCycleEvent]:
+        """逐幀產出 "frame" 事件並保存原始幀；不支援去噪預覽的後端忽略 preview_every
+
+        週期完整產出後才記錄到後端清單。
+        """
+        prefix = frame_prefix(character_type, direction, self.directions["base"])
+        for frame_idx, frame in enumerate(self.generate_cycle(character_type, direction)):
+            frame.save(self.output_dir / f"{prefix}_frame_{frame_idx:02d}.png", "PNG")
+            yield WalkCycleEvent("frame", character_type, frame_idx, frame)
+        record_backend(self.output_dir, [prefix], self.name)
+
+    def generate_characters(self, character_types: List[str], resume: bool = False) -> int:
+        """為每個角色的每個生成方向寫出原始幀與後處理幀，回傳幀數
+
+        便宜的後端整個週期一次完成，不經任務佇列；resume 只對擴散後端有意義。
+        每個週期寫出後才記錄到後端清單，中途失敗時未完成的週期不會被標記。
+        """
+        settings = self.directions
+        written = 0
+        for character_type in character_types:
+            for direction in generated_directions(settings):
+                prefix = frame_prefix(character_type, direction, settings["base"])
+                frames = self.generate_cycle(character_type, direction)
+                write_frames(frames, prefix, self.output_dir)
+                record_backend(self.output_dir, [prefix], self.name)
+                written += len(frames)
+        console.print(f"✅ {self.name} 後端: {len(character_types)} 個角色, {written} 幀", style="green")
+        return written
+
+    def cleanup(self):
+        """釋放後端資源"""
+
+class DiffusionBackend(FrameBackend):
+    """SD + ControlNet：包裝 SpriteGenerator，保留任務佇列、微批次、潛空間重用與去噪預覽"""
+
+    name = "diffusion"
+
+    def __init__(self, config: Dict[str, Any], config_path: str = "configs/generation_config.yaml"):
+        super().__init__(config, config_path)
+        # 只有擴散後端需要 torch 與 diffusers
+        from scripts.sprite_generator import SpriteGenerator
+        self.generator = SpriteGenerator(config_path)
+        self.generator.config = config
+        self.generator.roster = self.roster
+        if self.generator.controlnet is None:
+            console.print("⚠️  ControlNet 未載入，擴散後端將不使用姿勢控制", style="yellow")
+
+    def generate_cycle(self, character_type: str, direction: Optional[str] = None) -> List[Image.Image]:
+        return self.generator.generate_walk_cycle(character_type, direction)
+
+    def iter_cycle(self, character_type: str, direction: Optional[str] = None,
+                   preview_every: int = 0) -> Iterator[WalkCycleEvent]:
+        yield from self.generator.iter_walk_cycle(character_type, preview_every=preview_every, direction=direction)
+        record_backend(self.output_dir, [frame_prefix(character_type, direction, self.directions["base"])], self.name)
+
+    def generate_characters(self, character_types: List[str], resume: bool = False) -> int:
+        # 只記錄所有幀都完成的前綴；有幀達重試上限的週期不標記
+        completed = self.generator.generate_all_characters(resume=resume, character_types=character_types)
+        record_backend(self.output_dir, completed, self.name)
+        return len(completed) * self.frame_count
+
+    def cleanup(self):
+        self.generator.cleanup()
+
+class ReferenceImg2ImgBackend(FrameBackend):
+    """參考圖片img2img：以角色的參考圖片批次img2img產生週期（參考圖片為單一側視，所有方向共用）"""
+
+    name = "img2img_reference"
+
+    def __init__(self, config: Dict[str, Any], config_path: str = "configs/generation_config.yaml"):
+        super().__init__(config, config_path)
+        from scripts.reference_guided_generator import ReferenceGuidedGenerator
+        self.generator = ReferenceGuidedGenerator(config_path)
+        self.generator.config = config
+        self.generator.roster = self.roster
+        if self.generator.engine is None:
+            raise RuntimeError("img2img模型載入失敗，無法使用 img2img_reference 後端")
+
+    def generate_cycle(self, character_type: str, direction: Optional[str] = None) -> List[Image.Image]:
+        reference = find_reference_sprite(character_type, self.roster.get(character_type))
+        if reference is None:
+            raise FileNotFoundError(f"找不到 {character_type} 的參考圖片（{RAW_SPRITES_DIR}/{character_type}_reference.png）")
+        frames = self.generator.generate_reference_walking_cycle(str(reference), character_type, self.frame_count)
+        # 失敗的幀不在回傳列表中，依序編號會把後續幀寫到錯誤的檔名並留下舊檔
+        if len(frames) != self.frame_count:
+            raise RuntimeError(f"{character_type} 參考生成只完成 {len(frames)}/{self.frame_count} 幀，週期不完整")
+        return frames
+
+    def cleanup(self):
+        self.generator.cleanup()
+
+class ProceduralRigBackend(FrameBackend):
+    """程序化2D骨架：參考圖片縮到原生像素尺寸後以骨架渲染週期，再整數倍放大到幀尺寸（不需GPU）"""
+
+    name = "procedural"
+
+    def __init__(self, config: Dict[str, Any], config_path: str = "configs/generation_config.yaml"):
+        super().__init__(config, config_path)
+        self.sprite_size = tuple(config['image_settings']['original_sprite_size'])
+        self.keypoints = load_rig_keypoints()
+        self.rig = SpriteRig(self.sprite_size, self.keypoints)
+
+    def load_sprite(self, character_type: str) -> np.ndarray:
+        """角色在原生尺寸的 (h, w, 4) 精靈；只有走路精靈表時取第一幀"""
+        reference = find_reference_sprite(character_type, self.roster.get(character_type))
+        if reference is not None:
+            with Image.open(reference) as img:
+                return np.asarray(img.convert('RGBA').resize(self.sprite_size, Image.NEAREST))
+
+        sheet_path = RAW_SPRITES_DIR / f"{character_type}_walk_cycle.png"
+        if not sheet_path.exists():
+            raise FileNotFoundError(f"找不到 {character_type} 的參考圖片或精靈表（{RAW_SPRITES_DIR}）")
+        width, height = self.sprite_size
+        with Image.open(sheet_path) as img:
+            return np.asarray(img.convert('RGBA').crop((0, 0, width, height)))
+
+    def generate_cycle(self, character_type: str, direction: Optional[str] = None) -> List[Image.Image]:
+        stack = self.rig.render_cycle(self.load_sprite(character_type), self.frame_count)
+        factor = self.config['image_settings']['upscale_factor']
+        stack = stack.repeat(factor, axis=1).repeat(factor, axis=2)
+        return [Image.fromarray(frame, 'RGBA') for frame in stack]
+
+class SyntheticBackend(FrameBackend):
+    """替身：以合成渲染器即時產生白底角色幀，質感接近擴散輸出（乾跑與演示使用）"""
+
+    name = "synthetic"
+
+    def __init__(self, config: Dict[str, Any], config_path: str = "configs/generation_config.yaml"):
+        super().__init__(config, config_path)
+        size = (config['image_settings']['width'], config['image_settings']['height'])
+        self.renderer = SyntheticSpriteRenderer(size, clip=config['animation'].get('pose_clip', 'walk'))
+
+    def generate_cycle(self, character_type: str, direction: Optional[str] = None) -> List[Image.Image]:
+        # 不同方向以不同名稱取種子，產生的幀才不會完全相同
+        stack = self.renderer.render_character(f"{character_type}:{direction}", self.frame_count)
+        return [Image.fromarray(frame, 'RGB') for frame in stack]
+
+class SolidColorBackend(FrameBackend):
+    """最便宜的替身：白底上角色專屬顏色的單色方塊，每幀相同"""
+
+    name = "solid"
+
+    def generate_cycle(self, character_type: str, direction: Optional[str] = None) -> List[Image.Image]:
+        width, height = self.config['image_settings']['width'], self.config['image_settings']['height']
+        rng = np.random.default_rng(zlib.crc32(character_type.encode('utf-8')))
+        color = tuple(int(c) for c in rng.integers(40, 200, size=3))
+        frame = Image.new('RGB', (width, height), (255, 255, 255))
+        frame.paste(color, (width // 3, height // 6, width * 2 // 3, height * 5 // 6))
+        return [frame.copy() for _ in range(self.frame_count)]
+
+BACKENDS: Dict[str, Type[FrameBackend]] = {
+    backend.name: backend for backend in (
+        DiffusionBackend, ReferenceImg2ImgBackend, ProceduralRigBackend, SyntheticBackend, SolidColorBackend
+    )
+}
+
+def create_backend(name: str, config: Dict[str, Any],
+                   config_path: str = "configs/generation_config.yaml") -> FrameBackend:
+    """依名稱建立後端"""
+    if name not in BACKENDS:
+        raise ValueError(f"未知的生成後端: {name}（可用: {', '.join(BACKENDS)}）")
+    return BACKENDS[name](config, config_path)
+
+class BackendRouter:
+    def __init__(self, config: Dict[str, Any], config_path: str = "configs/generation_config.yaml",
+                 override: Optional[str] = None):
+        """依配置為每個角色選擇後端；後端在第一次使用時才建立（擴散後端才會載入模型）
+
+        選擇順序：override > 角色模板的 backend > generation_backend.by_tag > generation_backend.default
+        """
+        if override is not None and override not in BACKENDS:
+            raise ValueError(f"未知的生成後端: {override}（可用: {', '.join(BACKENDS)}）")
+        self.config = config
+        self.config_path = config_path
+        self.override = override
+        self.roster = CharacterRoster(config)
+        self.backends: Dict[str, FrameBackend] = {}
+
+    @property
+    def settings(self) -> Dict[str, Any]:
+        return self.config.get('generation_backend', {})
+
+    def backend_name(self, character_type: str, override: Optional[str] = None) -> str:
+        """角色使用的後端名稱（只讀配置，不建立後端）"""
+        name = override or self.override
+        if name is None:
+            template = self.roster.get(character_type) or {}
+            name = template.get('backend')
+            if not name:
+                by_tag = self.settings.get('by_tag') or {}
+                name = next((by_tag[tag] for tag in template.get('tags') or [] if tag in by_tag), None)
+        name = name or self.settings.get('default', DEFAULT_BACKEND)
+        if name not in BACKENDS:
+            raise ValueError(f"角色 {character_type} 的生成後端未知: {name}（可用: {', '.join(BACKENDS)}）")
+        return name
+
+    def get(self, name: str) -> FrameBackend:
+        """取得（必要時建立）指定後端"""
+        if name not in self.backends:
+            console.print(f"🔌 啟用生成後端: {name}", style="blue")
+            self.backends[name] = create_backend(name, self.config, self.config_path)
+        return self.backends[name]
+
+    def backend_for(self, character_type: str, override: Optional[str] = None) -> FrameBackend:
+        return self.get(self.backend_name(character_type, override))
+
+    def partition(self, character_types: List[str]) -> Dict[str, List[str]]:
+        """依後端分組角色（保持角色順序）"""
+        groups: Dict[str, List[str]] = {}
+        for character_type in character_types:
+            groups.setdefault(self.backend_name(character_type), []).append(character_type)
+        return groups
+
+    def generate_characters(self, character_types: Optional[List[str]] = None, resume: bool = False) -> int:
+        """各後端分別生成自己負責的角色，回傳總幀數"""
+        if character_types is None:
+            character_types = self.roster.names()
+        groups = self.partition(character_types)
+        for name, names in groups.items():
+            console.print(f"🧭 {name}: {len(names)} 個角色", style="cyan")
+        return sum(self.get(name).generate_characters(names, resume) for name, names in groups.items())
+
+    def cleanup(self):
+        """釋放所有已建立的後端"""
+        for backend in self.backends.values():
+            backend.cleanup()
+        self.backends.clear()
+
+def main():
+    """主函數：以指定後端（或依配置選擇）生成角色"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="以可替換的生成後端產生角色行走週期")
+    parser.add_argument("characters", nargs="*", help="角色名稱或萬用字元樣式（預設全部）")
+    parser.add_argument("--backend", choices=list(BACKENDS), help="所有角色使用同一後端（預設依配置）")
+    parser.add_argument("--config", default="configs/generation_config.yaml", help="生成配置檔")
+    parser.add_argument("--list", action="store_true", help="只列出每個角色會使用的後端")
+    args = parser.parse_args()
+
+    router = BackendRouter(load_config(args.config), args.config, args.backend)
+    names = router.roster.resolve(args.characters) if args.characters else router.roster.names()
+
+    if args.list:
+        for name, group in router.partition(names).items():
+            console.print(f"🧭 {name}: {', '.join(group)}", style="cyan")
+        return
+
+    try:
+        router.generate_characters(names)
+    finally:
+        router.cleanup()
+
+if __name__ == "__main__":
+    main()
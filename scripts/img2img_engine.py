@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+批次img2img引擎
+以一個張量批次對多幀執行img2img，每幀可有各自的strength與種子：
+strength 決定每幀從排程的第幾步開始加入去噪，同一步驟的所有進行中幀共用一次UNet呼叫，
+只執行實際需要的步數並逐幀回報；失敗的幀個別回報而非以參考圖片替代
+"""
+
+import copy
+import torch
+from dataclasses import dataclass
+from PIL import Image
+from rich.console import Console
+from typing import List, Optional, Dict
+
+from diffusers.utils.torch_utils import randn_tensor
+
+console = Console()
+
+class Img2ImgFrameError(RuntimeError):
+    """單幀img2img失敗"""
+
+@dataclass
+class Img2ImgRequest:
+    """單幀img2img請求；latents 為已乘上 scaling_factor 的 (1, 4, h, w) 初始潛空間"""
+    frame_idx: int
+    prompt: str
+    negative_prompt: str
+    latents: torch.Tensor
+    strength: float
+    seed: int
+
+@dataclass
+class Img2ImgResult:
+    """單幀結果；失敗時 image 為 None 並記錄錯誤"""
+    frame_idx: int
+    image: Optional[Image.Image]
+    effective_steps: int
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+@dataclass
+class _StrengthGroup:
+    """從同一步開始去噪的幀，共用一份排程器狀態"""
+    start: int
+    indices: List[int]
+    scheduler: object
+    latents: Optional[torch.Tensor] = None
+
+class BatchedImg2ImgEngine:
+    def __init__(self, pipe, num_inference_steps: int = 30, guidance_scale: float = 7.5):
+        """以已載入的img2img管線元件初始化引擎（不複製權重）"""
+        self.pipe = pipe
+        self.num_inference_steps = num_inference_steps
+        self.guidance_scale = guidance_scale
+
+    def effective_steps(self, strength: float) -> int:
+        """strength 對應實際執行的推理步數（與diffusers img2img相同的截斷規則）"""
+        return min(int(self.num_inference_steps * strength), self.num_inference_steps)
+
+    def run(self, requests: List[Img2ImgRequest]) -> List[Img2ImgResult]:
+        """執行一批請求，回傳與請求同順序的結果
+
+        整批失敗（例如記憶體不足）時改為逐幀執行，找出實際失敗的幀。
+        """
+        if not requests:
+            return []
+        try:
+            return self._run_batch(requests)
+        except Exception as e:
+            if len(requests) == 1:
+                request = requests[0]
+                return [Img2ImgResult(request.frame_idx, None, 0, str(e))]
+            console.print(f"⚠️  批次img2img失敗，改為逐幀執行: {e}", style="yellow")
+            return [self.run([request])[0] for request in requests]
+
+    def _run_batch(self, requests: List[Img2ImgRequest]) -> List[Img2ImgResult]:
+        pipe = self.pipe
+        device = pipe._execution_device
+
+        pipe.scheduler.set_timesteps(self.num_inference_steps, device=device)
+        timesteps = pipe.scheduler.timesteps
+        order = pipe.scheduler.order
+
+        # 依起始步分組；每組複製一份排程器，多步求解器的歷史狀態才不會互相干擾
+        groups: Dict[int, _StrengthGroup] = {}
+        steps = []
+        for i, request in enumerate(requests):
+            effective = self.effective_steps(request.strength)
+            start = (self.num_inference_steps - effective) * order
+            steps.append(max(len(timesteps) - start, 0))
+            if start not in groups:
+                scheduler = copy.deepcopy(pipe.scheduler)
+                if hasattr(scheduler, "set_begin_index"):
+                    scheduler.set_begin_index(start)
+                groups[start] = _StrengthGroup(start, [], scheduler)
+            groups[start].indices.append(i)
+
+        with torch.no_grad():
+            prompt_embeds, negative_embeds = pipe.encode_prompt(
+                [request.prompt for request in requests], device, 1, True,
+                [request.negative_prompt for request in requests],
+            )
+
+            # 每幀以各自的種子產生雜訊，並依其起始步加噪
+            for group in groups.values():
+                init = torch.cat([requests[i].latents for i in group.indices]).to(device=device, dtype=prompt_embeds.dtype)
+                if group.start >= len(timesteps):
+                    group.latents = init
+                    continue
+                noise = torch.cat([
+                    randn_tensor(requests[i].latents.shape,
+                                 generator=torch.Generator(device="cpu").manual_seed(requests[i].seed),
+                                 device=device, dtype=init.dtype)
+                    for i in group.indices
+                ])
+                start_timestep = timesteps[group.start:group.start + 1].repeat(len(group.indices))
+                group.latents = group.scheduler.add_noise(init, noise, start_timestep)
+
+            for step, t in enumerate(timesteps):
+                active = [group for group in groups.values() if group.start <= step]
+                if not active:
+                    continue
+
+                indices = [i for group in active for i in group.indices]
+                model_input = torch.cat([group.scheduler.scale_model_input(group.latents, t) for group in active])
+                embeds = torch.cat([negative_embeds[indices], prompt_embeds[indices]])
+
+                noise_pred = pipe.unet(torch.cat([model_input] * 2), t, encoder_hidden_states=embeds,
+                                       return_dict=False)[0]
+                noise_uncond, noise_text = noise_pred.chunk(2)
+                noise_pred = noise_uncond + self.guidance_scale * (noise_text - noise_uncond)
+
+                for group, group_pred in zip(active, noise_pred.split([len(g.indices) for g in active])):
+                    group.latents = group.scheduler.step(group_pred, t, group.latents, return_dict=False)[0]
+
+            latents = torch.empty_like(torch.cat([group.latents for group in groups.values()]))
+            for group in groups.values():
+                latents[group.indices] = group.latents
+
+            # 數值發散的幀個別標記為失敗
+            finite = torch.isfinite(latents.flatten(1)).all(dim=1).tolist()
+            decoded = pipe.vae.decode(latents / pipe.vae.config.scaling_factor, return_dict=False)[0]
+            images = pipe.image_processor.postprocess(decoded, output_type="pil")
+
+        results = []
+        for request, image, effective, ok in zip(requests, images, steps, finite):
+            if ok:
+                results.append(Img2ImgResult(request.frame_idx, image, effective))
+            else:
+                results.append(Img2ImgResult(request.frame_idx, None, effective, "潛空間出現非有限值"))
+
+        total = sum(steps)
+        console.print(f"⏱️  img2img 批次 {len(requests)} 幀: 實際執行 {total} 幀步 "
+                      f"（完整去噪需 {len(timesteps) * len(requests)}），"
+                      f"{len(groups)} 種起始步，UNet 呼叫 {max(len(timesteps) - min(groups), 0)} 次",
+                      style="blue")
+        return results
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Web介面生成任務管理器
+以asyncio管理共用的常駐管線、有限長度的請求佇列、排隊位置與ETA、逐幀預覽及取消；
+每個任務可指定生成後端，未指定時依配置逐角色選擇
+"""
+
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, AsyncIterator
+from PIL import Image
+from rich.console import Console
+
+from scripts.generator_backends import BackendRouter
+from scripts.config_service import load_config
+
+console = Console()
+
+# 任務狀態
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+class QueueFullError(RuntimeError):
+    """請求佇列已滿"""
+
+@dataclass
+class GenerationJob:
+    """單一使用者提交的生成請求"""
+    job_id: str
+    owner: str
+    character_types: List[str]
+    guidance_scale: float
+    num_frames: int
+    # None 表示依配置逐角色選擇後端
+    backend: Optional[str] = None
+    status: str = QUEUED
+    frames: List[Image.Image] = field(default_factory=list)
+    # 目前幀的去噪中間預覽（完成後清除）
+    preview: Optional[Image.Image] = None
+    message: str = ""
+    cancel_requested: bool = False
+    finished_at: Optional[float] = None
+    # 每次狀態或幀更新時遞增，串流據此判斷是否需要推送
+    version: int = 0
+
+    @property
+    def total_frames(self) -> int:
+        return len(self.character_types) * self.num_frames
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def update(self, status: Optional[str] = None, message: Optional[str] = None):
+        """更新狀態並遞增版本號"""
+        if status is not None:
+            self.status = status
+            if self.finished:
+                self.finished_at = time.time()
+        if message is not None:
+            self.message = message
+        self.version += 1
+
+class GenerationJobManager:
+    def __init__(self,
+                 config_path: str = "configs/generation_config.yaml",
+                 max_queued_jobs: int = 8,
+                 poll_interval: float = 0.5,
+                 preview_every: int = 5,
+                 seconds_per_frame: float = 20.0,
+                 keep_finished_jobs: int = 50):
+        """初始化任務管理器"""
+        self.config_path = config_path
+        self.max_queued_jobs = max_queued_jobs
+        self.poll_interval = poll_interval
+        self.preview_every = preview_every
+        self.keep_finished_jobs = keep_finished_jobs
+
+        # 每幀耗時的移動平均，用於ETA估算（首幀完成前使用預設值）
+        self.seconds_per_frame = seconds_per_frame
+        self._measured = False
+
+        self.jobs: Dict[str, GenerationJob] = {}
+        self.pending: List[str] = []
+        self.running: Optional[GenerationJob] = None
+
+        # 單一執行緒確保常駐管線一次只服務一個任務
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sprite-generator")
+        self._router: Optional[BackendRouter] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def _ensure_worker(self):
+        """在目前事件迴圈上啟動背景工作協程"""
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.get_running_loop().create_task(self._run_worker())
+
+    def _get_router(self) -> BackendRouter:
+        """取得共用的後端路由；各後端在首次使用時才建立（擴散後端此時才載入模型）"""
+        if self._router is None:
+            self._router = BackendRouter(load_config(self.config_path), self.config_path)
+        return self._router
+
+    def _prune_finished(self):
+        """只保留最近完成的任務記錄"""
+        finished = sorted((job for job in self.jobs.values() if job.finished),
+                          key=lambda job: job.finished_at)
+        for job in finished[:max(0, len(finished) - self.keep_finished_jobs)]:
+            del self.jobs[job.job_id]
+
+    async def submit(self, owner: str, character_types: List[str],
+                     guidance_scale: float, num_frames: int,
+                     backend: Optional[str] = None) -> GenerationJob:
+        """提交生成請求；佇列已滿時拋出 QueueFullError"""
+        self._ensure_worker()
+        self._prune_finished()
+
+        if len(self.pending) >= self.max_queued_jobs:
+            raise QueueFullError(f"請求佇列已滿 ({self.max_queued_jobs})，請稍後再試")
+
+        job = GenerationJob(
+            job_id=uuid.uuid4().hex[:8],
+            owner=owner,
+            character_types=list(character_types),
+            guidance_scale=guidance_scale,
+            num_frames=int(num_frames),
+            backend=backend,
+        )
+        self.jobs[job.job_id] = job
+        self.pending.append(job.job_id)
+        self._wakeup.set()
+
+        console.print(f"📥 任務 {job.job_id} 已加入佇列 ({job.total_frames} 幀)", style="blue")
+        return job
+
+    async def cancel(self, job_id: str, owner: str) -> bool:
+        """取消自己的任務；執行中的任務在當前幀完成後停止
+
+        以協程在事件迴圈上執行，與背景工作協程取出 pending 不會交錯。
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.owner != owner or job.finished:
+            return False
+
+        if job.status == QUEUED:
+            self.pending.remove(job_id)
+            job.update(CANCELLED, "已取消")
+        else:
+            job.cancel_requested = True
+            job.update(message="取消中，等待當前幀完成...")
+        return True
+
+    def queue_position(self, job_id: str) -> int:
+        """排隊位置（從1開始），不在佇列中時為0"""
+        try:
+            return self.pending.index(job_id) + 1
+        except ValueError:
+            return 0
+
+    def eta_seconds(self, job_id: str) -> float:
+        """估算任務完成所需秒數"""
+        job = self.jobs[job_id]
+        if job.finished:
+            return 0.0
+
+        remaining = job.total_frames - len(job.frames)
+        if job.status == QUEUED:
+            if self.running is not None:
+                remaining += self.running.total_frames - len(self.running.frames)
+            for ahead_id in self.pending[:self.queue_position(job_id) - 1]:
+                remaining += self.jobs[ahead_id].total_frames
+
+        return remaining * self.seconds_per_frame
+
+    async def stream(self, job_id: str) -> AsyncIterator[GenerationJob]:
+        """持續產出任務快照，直到任務結束"""
+        job = self.jobs[job_id]
+        last_version = -1
+
+        while True:
+            # 排隊中時位置與ETA會隨其他任務變動，每次輪詢都推送
+            if job.version != last_version or job.status == QUEUED:
+                last_version = job.version
+                yield job
+            if job.finished:
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    async def _run_worker(self):
+        """依序執行佇列中的任務"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self.pending:
+                job = self.jobs[self.pending.pop(0)]
+                self.running = job
+                job.update(RUNNING, "載入模型中..." if self._router is None else "生成中...")
+
+                try:
+                    await loop.run_in_executor(self._executor, self._execute, job)
+                except Exception as e:
+                    console.print(f"❌ 任務 {job.job_id} 失敗: {e}", style="red")
+                    job.update(FAILED, str(e))
+                finally:
+                    self.running = None
+
+    def _record_frame_time(self, seconds: float):
+        """更新每幀耗時的移動平均"""
+        if not self._measured:
+            self.seconds_per_frame = seconds
+            self._measured = True
+        else:
+            self.seconds_per_frame = 0.8 * self.seconds_per_frame + 0.2 * seconds
+
+    def _execute(self, job: GenerationJob):
+        """在生成執行緒中執行任務（阻塞）"""
+        router = self._get_router()
+        # 常駐後端沿用已載入的模型，但角色模板以最新配置為準；所有後端共用路由的配置
+        latest = load_config(self.config_path)
+        router.config['prompts'] = latest['prompts']
+        router.config['generation_backend'] = latest.get('generation_backend', {})
+        router.config['generation_params']['guidance_scale'] = job.guidance_scale
+        router.config['animation']['walk_cycle_frames'] = job.num_frames
+
+        for char_type in job.character_types:
+            last_frame_time = time.time()
+            cycle = router.backend_for(char_type, job.backend).iter_cycle(
+                char_type, preview_every=self.preview_every)
+            try:
+                for event in cycle:
+                    if job.cancel_requested:
+                        job.update(CANCELLED, "已取消")
+                        return
+
+                    if event.kind == "preview":
+                        job.preview = event.image
+                        job.update(message=f"{char_type} 第 {event.frame_idx+1}/{job.num_frames} 幀 "
+                                           f"去噪 {event.step}/{event.total_steps or '?'}")
+                        continue
+
+                    now = time.time()
+                    self._record_frame_time(now - last_frame_time)
+                    last_frame_time = now
+
+                    job.frames.append(event.image)
+                    job.preview = None
+                    job.update(message=f"已生成 {char_type} 第 {event.frame_idx+1}/{job.num_frames} 幀")
+            finally:
+                cycle.close()
+
+        job.update(DONE, "角色生成完成！")
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+持久化生成任務佇列
+以本地SQLite記錄每個 (角色, 幀, 參數) 工作項目，支援重試與中斷後續跑；
+可一次取出解析度與步數相同的多個項目，跨角色組成微批次
+"""
+
+import json
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+from rich.console import Console
+
+console = Console()
+
+# 工作項目狀態
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# 參數中必須相同才能在同一次管線呼叫中生成的欄位
+BATCH_KEY_FIELDS = ("width", "height", "num_inference_steps", "guidance_scale")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    character TEXT NOT NULL,
+    frame INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    output_path TEXT,
+    updated_at REAL NOT NULL,
+    UNIQUE (character, frame)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, character, frame);
+CREATE TEMP TABLE IF NOT EXISTS scope (
+    character TEXT NOT NULL,
+    frame INTEGER NOT NULL,
+    PRIMARY KEY (character, frame)
+);
+"""
+
+# 只取本次執行範圍內的項目；續跑時佇列可能留有已移除角色、舊方向或舊幀數的項目
+IN_SCOPE = "EXISTS (SELECT 1 FROM scope WHERE scope.character = jobs.character AND scope.frame = jobs.frame)"
+
+@dataclass
+class Job:
+    """單一生成工作項目"""
+    id: int
+    character: str
+    frame: int
+    params: Dict[str, Any]
+    attempts: int
+
+class JobQueue:
+    def __init__(self, db_path: str = "output/job_queue.sqlite", max_retries: int = 3):
+        """初始化任務佇列"""
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(exist_ok=True, parents=True)
+        self.max_retries = max_retries
+
+        # isolation_level=None 改為手動管理交易
+        self.conn = sqlite3.connect(str(self.db_path), isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        # enqueue 之後取出與計數只涵蓋該次加入的項目
+        self.scoped = False
+
+    def close(self):
+        """關閉資料庫連線"""
+        self.conn.close()
+
+    def reset(self):
+        """清空佇列，用於全新執行"""
+        self.conn.execute("DELETE FROM jobs")
+
+    def _scope(self) -> str:
+        return f" AND {IN_SCOPE}" if self.scoped else ""
+
+    def enqueue(self, items: Iterable[Tuple[str, int, Dict[str, Any]]]) -> int:
+        """加入工作項目並設為本次執行範圍；已存在且參數相同者保留原狀態，參數改變者重設為待處理
+
+        範圍外的既有項目保留在佇列中（之後選取到該角色時可續跑），但不會被取出。
+        """
+        added = 0
+        now = time.time()
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute("DELETE FROM scope")
+            for character, frame, params in items:
+                self.conn.execute("INSERT OR IGNORE INTO scope (character, frame) VALUES (?, ?)",
+                                  (character, frame))
+                params_json = json.dumps(params, sort_keys=True, ensure_ascii=False)
+                row = self.conn.execute(
+                    "SELECT params FROM jobs WHERE character = ? AND frame = ?",
+                    (character, frame)
+                ).fetchone()
+
+                if row is None:
+                    self.conn.execute(
+                        "INSERT INTO jobs (character, frame, params, state, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (character, frame, params_json, PENDING, now)
+                    )
+                    added += 1
+                elif row[0] != params_json:
+                    self.conn.execute(
+                        "UPDATE jobs SET params = ?, state = ?, attempts = 0, error = NULL, "
+                        "output_path = NULL, updated_at = ? WHERE character = ? AND frame = ?",
+                        (params_json, PENDING, now, character, frame)
+                    )
+                    added += 1
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        self.scoped = True
+        return added
+
+    def out_of_scope_pending(self) -> int:
+        """不在本次執行範圍內的待處理項目數"""
+        if not self.scoped:
+            return 0
+        return self.conn.execute(
+            f"SELECT COUNT(*) FROM jobs WHERE state = ? AND NOT {IN_SCOPE}",
+            (PENDING,)
+        ).fetchone()[0]
+
+    def recover_interrupted(self) -> int:
+        """將上次中斷時仍在執行中的項目重設為待處理"""
+        cursor = self.conn.execute(
+            "UPDATE jobs SET state = ?, updated_at = ? WHERE state = ?",
+            (PENDING, time.time(), RUNNING)
+        )
+        return cursor.rowcount
+
+    def claim_next(self) -> Optional[Job]:
+        """取出下一個待處理項目並標記為執行中"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT id, character, frame, params, attempts FROM jobs "
+                f"WHERE state = ?{self._scope()} ORDER BY character, frame LIMIT 1",
+                (PENDING,)
+            ).fetchone()
+
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (RUNNING, time.time(), row[0])
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        return Job(id=row[0], character=row[1], frame=row[2],
+                   params=json.loads(row[3]), attempts=row[4] + 1)
+
+    def claim_batch(self, limit: int) -> List[Job]:
+        """取出最多 limit 個可同批生成的待處理項目並標記為執行中
+
+        依解析度與步數排序，取第一組參數相同的項目；組內依幀號再依角色排序，
+        同一幀的不同角色相鄰，微批次可共用同一張姿勢控制圖像。
+        """
+        key_columns = [f"json_extract(params, '$.{field}')" for field in BATCH_KEY_FIELDS]
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            first = self.conn.execute(
+                f"SELECT params FROM jobs WHERE state = ?{self._scope()} "
+                f"ORDER BY {', '.join(key_columns)}, frame, character LIMIT 1",
+                (PENDING,)
+            ).fetchone()
+
+            if first is None:
+                self.conn.execute("COMMIT")
+                return []
+
+            params = json.loads(first[0])
+            key = [params.get(field) for field in BATCH_KEY_FIELDS]
+            rows = self.conn.execute(
+                "SELECT id, character, frame, params, attempts FROM jobs WHERE state = ? AND "
+                + " AND ".join(f"{column} IS ?" for column in key_columns)
+                + self._scope() + " ORDER BY frame, character LIMIT ?",
+                (PENDING, *key, limit)
+            ).fetchall()
+
+            self.conn.executemany(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(RUNNING, time.time(), row[0]) for row in rows]
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        return [Job(id=row[0], character=row[1], frame=row[2],
+                    params=json.loads(row[3]), attempts=row[4] + 1) for row in rows]
+
+    def mark_done(self, job: Job, output_path: str):
+        """標記項目完成"""
+        self.conn.execute(
+            "UPDATE jobs SET state = ?, error = NULL, output_path = ?, updated_at = ? WHERE id = ?",
+            (DONE, output_path, time.time(), job.id)
+        )
+
+    def mark_failed(self, job: Job, error: str) -> bool:
+        """標記項目失敗；未達重試上限時放回待處理，回傳是否會重試"""
+        will_retry = job.attempts < self.max_retries
+        self.conn.execute(
+            "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+            (PENDING if will_retry else FAILED, error, time.time(), job.id)
+        )
+        return will_retry
+
+    def counts(self) -> Dict[str, int]:
+        """各狀態的項目數量（已設定範圍時只計範圍內）"""
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        query = "SELECT state, COUNT(*) FROM jobs WHERE 1 = 1" + self._scope() + " GROUP BY state"
+        for state, count in self.conn.execute(query):
+            counts[state] = count
+        return counts
+
+    def failed_jobs(self) -> List[Tuple[str, int, str]]:
+        """列出失敗項目 (角色, 幀, 錯誤訊息)"""
+        return self.conn.execute(
+            f"SELECT character, frame, error FROM jobs WHERE state = ?{self._scope()} ORDER BY character, frame",
+            (FAILED,)
+        ).fetchall()
+
+    def print_summary(self):
+        """輸出佇列狀態總結"""
+        counts = self.counts()
+        console.print(
+            f"📊 任務佇列: 完成 {counts[DONE]}，待處理 {counts[PENDING]}，"
+            f"執行中 {counts[RUNNING]}，失敗 {counts[FAILED]}",
+            style="bold cyan"
+        )
+        for character, frame, error in self.failed_jobs():
+            console.print(f"   ❌ {character} 第 {frame} 幀: {error}", style="red")
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+後處理壓力測試
+以合成工作負載填滿幀目錄，再依序執行像素藝術優化、背景移除與精靈表組合，
+逐階段回報耗時與吞吐量；不需要任何模型即可在上萬幀的規模下測試後處理
+"""
+
+import copy
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from PIL import Image
+from rich.console import Console
+from rich.table import Table
+from typing import Dict, Any, List, Optional, Iterable
+
+from scripts.synthetic_workload import SyntheticWorkload, populate_frame_store, BACKGROUNDS
+from scripts.pixel_art_optimizer import PixelArtOptimizer
+from scripts.background_removal import BackgroundRemover
+from scripts.sheet_composer import SpriteSheetComposer
+from scripts.template_store import CharacterRoster
+from scripts.config_service import load_config
+
+console = Console()
+
+STAGES = ("render", "optimize", "background", "compose")
+
+STAGE_LABELS = {
+    "render": "合成幀寫入",
+    "optimize": "像素藝術優化",
+    "background": "背景移除",
+    "compose": "精靈表組合",
+}
+
+@contextmanager
+def quiet_consoles():
+    """暫時關閉各模組的逐幀輸出，計時只反映處理本身"""
+    consoles = [module.console for name, module in list(sys.modules.items())
+                if name.startswith("scripts.") and isinstance(getattr(module, "console", None), Console)
+                and module.console is not console]
+    previous = [c.quiet for c in consoles]
+    for c in consoles:
+        c.quiet = True
+    try:
+        yield
+    finally:
+        for c, quiet in zip(consoles, previous):
+            c.quiet = quiet
+
+class PostprocessLoadTest:
+    def __init__(self, workload: SyntheticWorkload, config_path: str = "configs/generation_config.yaml",
+                 output_root: str = "output/load_test", workers: Optional[int] = None):
+        """以工作負載與輸出目錄初始化；所有輸出都寫在 output_root 下，不影響正式的幀與精靈表"""
+        self.workload = workload
+        self.config = load_config(config_path)
+        self.config_path = config_path
+        self.output_root = Path(output_root)
+        self.frames_dir = self.output_root / "frames"
+        self.workers = workers or os.cpu_count()
+        self.results: Dict[str, Dict[str, float]] = {}
+
+    def frame_paths(self, name: str) -> List[Path]:
+        return [self.frames_dir / f"{name}_frame_{i:02d}.png" for i in range(self.workload.frames)]
+
+    def _record(self, stage: str, frames: int, seconds: float):
+        self.results[stage] = {"frames": frames, "seconds": seconds}
+        console.print(f"⏱️  {STAGE_LABELS[stage]}: {frames} 幀 {seconds:.2f}s", style="blue")
+
+    def run_render(self):
+        stats = populate_frame_store(self.workload, self.frames_dir, self.workers)
+        self._record("render", int(stats["frames"]), stats["seconds"])
+
+    def run_optimize(self):
+        """以 PixelArtOptimizer 逐幀優化並寫出（執行緒平行）"""
+        optimizer = PixelArtOptimizer(self.config)
+        target_size = tuple(self.config['image_settings']['original_sprite_size'])
+        output_dir = self.output_root / "optimized"
+        output_dir.mkdir(exist_ok=True, parents=True)
+
+        def optimize(frame_path: Path):
+            with Image.open(frame_path) as img:
+                optimized = optimizer.enhance_pixel_art_quality(img.convert('RGBA'), target_size)
+            optimized.save(output_dir / frame_path.name.replace("_frame_", "_optimized_frame_"), "PNG")
+
+        paths = [path for name in self.workload.character_names() for path in self.frame_paths(name)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(optimize, paths))
+        self._record("optimize", len(paths), time.perf_counter() - start)
+
+    def run_background(self):
+        """每個角色的週期合併為一個堆疊移除背景（與精靈表組合相同的呼叫），只計入移除本身"""
+        remover = BackgroundRemover.from_config(self.config)
+        elapsed = 0.0
+        frames = 0
+        for name in self.workload.character_names():
+            images = [Image.open(path) for path in self.frame_paths(name)]
+            start = time.perf_counter()
+            remover.remove_batch(images)
+            elapsed += time.perf_counter() - start
+            frames += len(images)
+        self._record("background", frames, elapsed)
+
+    def run_compose(self):
+        """以合成角色作為角色名單執行完整的精靈表組合（含主精靈表）"""
+        composer = SpriteSheetComposer(self.config_path)
+        composer.frames_dir = self.frames_dir
+        composer.output_dir = self.output_root / "sprite_sheets"
+        composer.output_dir.mkdir(exist_ok=True, parents=True)
+        # 預覽與紋理陣列也寫在壓力測試目錄下
+        composer.preview_exporter.output_dir = self.output_root / "previews"
+        composer.texture_exporter.output_dir = self.output_root / "textures"
+
+        config = copy.deepcopy(composer.config)
+        config.setdefault('prompts', {})['character_templates'] = {
+            name: {"positive": "synthetic load test"} for name in self.workload.character_names()
+        }
+        config['template_store'] = {'enabled': False}
+        composer.roster = CharacterRoster(config)
+
+        start = time.perf_counter()
+        composer.compose_all_sheets()
+        self._record("compose", self.workload.total_frames, time.perf_counter() - start)
+
+    def run(self, stages: Iterable[str] = STAGES, verbose: bool = False) -> Dict[str, Any]:
+        """依序執行指定階段並回傳報告"""
+        self.output_root.mkdir(exist_ok=True, parents=True)
+        console.print(f"🧪 壓力測試: {self.workload.characters} 個角色 × {self.workload.frames} 幀 "
+                      f"({self.workload.size[0]}x{self.workload.size[1]})", style="bold magenta")
+
+        for stage in stages:
+            if stage not in STAGES:
+                raise ValueError(f"未知的階段: {stage}（可用: {', '.join(STAGES)}）")
+            if verbose:
+                getattr(self, f"run_{stage}")()
+            else:
+                with quiet_consoles():
+                    getattr(self, f"run_{stage}")()
+
+        report = {
+            "characters": self.workload.characters,
+            "frames_per_character": self.workload.frames,
+            "size": list(self.workload.size),
+            "workers": self.workers,
+            "stages": self.results,
+        }
+        report_path = self.output_root / "load_test_report.json"
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+        self.print_report()
+        console.print(f"📋 報告: {report_path}", style="cyan")
+        return report
+
+    def print_report(self):
+        table = Table(title="後處理壓力測試")
+        table.add_column("階段", style="cyan")
+        table.add_column("幀數", justify="right")
+        table.add_column("時間 (s)", justify="right")
+        table.add_column("幀/秒", justify="right")
+        table.add_column("每幀 (ms)", justify="right")
+        for stage, result in self.results.items():
+            frames, seconds = result["frames"], result["seconds"]
+            table.add_row(STAGE_LABELS[stage], str(frames), f"{seconds:.2f}",
+                          f"{frames / max(seconds, 1e-9):.1f}", f"{seconds * 1000 / max(frames, 1):.2f}")
+        console.print(table)
+
+def main():
+    """主函數：執行後處理壓力測試"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="後處理壓力測試（合成工作負載）")
+    parser.add_argument("--characters", type=int, default=16, help="角色數")
+    parser.add_argument("--frames", type=int, default=8, help="每個角色的幀數")
+    parser.add_argument("--size", default="512x512", help="合成幀解析度")
+    parser.add_argument("--seed", type=int, default=0, help="隨機種子")
+    parser.add_argument("--backgrounds", default=",".join(BACKGROUNDS), help="輪流使用的背景樣式")
+    parser.add_argument("--stages", default=",".join(STAGES), help="執行的階段")
+    parser.add_argument("--config", default="configs/generation_config.yaml", help="生成配置檔")
+    parser.add_argument("--output-root", default="output/load_test", help="壓力測試輸出目錄")
+    parser.add_argument("--workers", type=int, help="平行處理的執行緒數")
+    parser.add_argument("--verbose", action="store_true", help="保留各模組的逐幀輸出")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    workload = SyntheticWorkload(args.characters, args.frames, (width, height), args.seed,
+                                 tuple(args.backgrounds.split(",")))
+    PostprocessLoadTest(workload, args.config, args.output_root, args.workers).run(
+        args.stages.split(","), args.verbose)
+
+if __name__ == "__main__":
+    main()
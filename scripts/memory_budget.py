@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+記憶體預算管理
+將設定的最大RSS轉換為記憶體優化決策，並記錄各階段峰值記憶體
+"""
+
+import os
+import resource
+import sys
+from contextlib import contextmanager
+from typing import Dict, Any
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+# 512x512 為估算基準解析度
+BASE_PIXELS = 512 * 512
+
+class MemoryBudget:
+    def __init__(self, config: Dict[str, Any]):
+        """初始化記憶體預算"""
+        budget_config = config.get('memory_budget', {})
+
+        self.enabled = budget_config.get('enabled', False)
+        self.max_rss_mb = budget_config.get('max_rss_mb', 6144)
+        self.per_image_mb = budget_config.get('per_image_mb', 1200)
+        self.max_micro_batch = budget_config.get('max_micro_batch', 8)
+
+        # 各階段峰值記憶體 (MB)
+        self.stage_peaks: Dict[str, float] = {}
+
+    @staticmethod
+    def current_rss_mb() -> float:
+        """目前行程的常駐記憶體 (MB)"""
+        try:
+            with open("/proc/self/statm", 'r') as f:
+                resident_pages = int(f.read().split()[1])
+            return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+        except (OSError, ValueError, IndexError):
+            return MemoryBudget.peak_rss_mb()
+
+    @staticmethod
+    def peak_rss_mb() -> float:
+        """行程峰值常駐記憶體 (MB)"""
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 以位元組回報，Linux 以KB回報
+        if sys.platform == "darwin":
+            return peak / (1024 * 1024)
+        return peak / 1024
+
+    @staticmethod
+    def _reset_peak() -> bool:
+        """重設峰值記憶體計數（僅Linux支援）"""
+        try:
+            with open("/proc/self/clear_refs", 'w') as f:
+                f.write("5")
+            return True
+        except OSError:
+            return False
+
+    @contextmanager
+    def track(self, stage: str):
+        """記錄區塊執行期間的峰值記憶體"""
+        peak_reset = self._reset_peak()
+        start_rss = self.current_rss_mb()
+        try:
+            yield
+        finally:
+            # 無法重設峰值時，只能取整個行程的峰值作為上界
+            peak = self.peak_rss_mb() if peak_reset else max(self.peak_rss_mb(), start_rss)
+            self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0.0), peak)
+
+    def estimate_image_mb(self, width: int, height: int) -> float:
+        """估算單張圖像在去噪與解碼期間的額外記憶體"""
+        return self.per_image_mb * (width * height) / BASE_PIXELS
+
+    def plan_micro_batch(self, width: int, height: int) -> int:
+        """依剩餘預算決定微批次大小"""
+        if not self.enabled:
+            return 1
+
+        available = self.max_rss_mb - self.current_rss_mb()
+        per_image = self.estimate_image_mb(width, height)
+        batch_size = int(available // per_image) if per_image > 0 else 1
+
+        if batch_size < 1:
+            console.print(
+                f"⚠️  剩餘記憶體預算 {available:.0f}MB 不足單張估算 {per_image:.0f}MB，使用微批次 1",
+                style="yellow"
+            )
+        return max(1, min(batch_size, self.max_micro_batch))
+
+    def apply_to_pipeline(self, pipe, width: int, height: int):
+        """依預算啟用管線的記憶體節省功能"""
+        if not self.enabled or pipe is None:
+            return
+
+        pipe.enable_attention_slicing()
+        if hasattr(pipe, "enable_vae_slicing"):
+            pipe.enable_vae_slicing()
+
+        # 單張估算已超過預算的一半，或解析度高於基準時，改用分塊解碼
+        available = self.max_rss_mb - self.current_rss_mb()
+        if width * height > BASE_PIXELS or self.estimate_image_mb(width, height) > available / 2:
+            if hasattr(pipe, "enable_vae_tiling"):
+                pipe.enable_vae_tiling()
+                console.print("🧩 已啟用VAE分塊解碼", style="blue")
+
+        console.print(
+            f"💾 記憶體預算模式: 上限 {self.max_rss_mb}MB，已啟用注意力切片與VAE切片",
+            style="blue"
+        )
+
+    def report(self):
+        """輸出各階段峰值記憶體"""
+        if not self.stage_peaks:
+            return
+
+        table = Table(title="各階段峰值記憶體")
+        table.add_column("階段", style="cyan")
+        table.add_column("峰值RSS (MB)", justify="right")
+        table.add_column("預算佔比", justify="right")
+
+        for stage, peak in self.stage_peaks.items():
+            ratio = peak / self.max_rss_mb if self.max_rss_mb else 0.0
+            style = "red" if ratio > 1.0 else "green"
+            table.add_row(stage, f"{peak:.0f}", f"[{style}]{ratio:.0%}[/{style}]")
+
+        console.print(table)
@@ -8,14 +8,35 @@ import numpy as np
 from PIL import Image, ImageFilter, ImageEnhance
 from pathlib import Path
 from rich.console import Console
-import cv2
+from typing import Dict, Any, Optional
+
+from scripts.config_service import load_config
 
 console = Console()
 
+def posterize_pixel_art(image: Image.Image, color_step: int = 32, block: int = 8) -> Image.Image:
+    """生成幀的基本像素化：色階量化後縮小再以最近鄰放大回原尺寸（alpha通道不量化）"""
+    # 簡單的色彩量化
+    # 減少顏色數量以獲得更像素化的效果
+    img_array = np.array(image)
+    img_array[..., :3] = img_array[..., :3] // color_step * color_step
+    processed_img = Image.fromarray(img_array.astype(np.uint8))
+    
+    # 縮小後放大以創建像素效果
+    original_size = processed_img.size
+    small_size = (original_size[0] // block, original_size[1] // block)
+    processed_img = processed_img.resize(small_size, Image.NEAREST)
+    return processed_img.resize(original_size, Image.NEAREST)
+
 class PixelArtOptimizer:
-    def __init__(self):
-        """初始化像素藝術優化器"""
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """初始化像素藝術優化器；背景移除依配置的 postprocess.background_key（未提供時載入預設配置）"""
         self.console = console
+        # 背景移除依賴SciPy；只用 posterize_pixel_art 的生成後端不需載入
+        from scripts.background_removal import BackgroundRemover
+        
+        self.config = config if config is not None else load_config()
+        self.background_remover = BackgroundRemover.from_config(self.config)
     
     def enhance_pixel_art_quality(self, image: Image.Image, 
                                 target_size: tuple = (32, 48)) -> Image.Image:
@@ -73,25 +94,8 @@ class PixelArtOptimizer:
         return resized
     
     def process_background(self, image: Image.Image) -> Image.Image:
-        """背景處理，移除不必要的背景並保持透明"""
-        # 轉換為numpy陣列
-        img_array = np.array(image)
-        
-        # 如果圖像沒有alpha通道，添加一個
-        if img_array.shape[2] == 3:
-            alpha = np.ones((img_array.shape[0], img_array.shape[1], 1), dtype=np.uint8) * 255
-            img_array = np.concatenate([img_array, alpha], axis=2)
-        
-        # 檢測接近白色的像素並設為透明
-        white_threshold = 240
-        white_pixels = (
-            (img_array[:, :, 0] > white_threshold) & 
-            (img_array[:, :, 1] > white_threshold) & 
-            (img_array[:, :, 2] > white_threshold)
-        )
-        img_array[white_pixels, 3] = 0  # 設為透明
-        
-        return Image.fromarray(img_array, 'RGBA')
+        """背景處理，移除與邊界連通的背景並保持透明"""
+        return self.background_remover.remove(image)
     
     def create_reference_guided_prompt(self, character_name: str, 
                                      reference_path: str = None) -> str:
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+姿勢庫
+統一的姿勢參考格式：每個動作（walk / run / idle / jump）一個檔案，只存關鍵幀，
+關鍵點為 (關鍵幀, 關鍵點, 2) 的 float32 相對座標，可寫成純JSON或 .npz。
+任意幀數的姿勢以相位上的 Catmull-Rom 樣條一次向量化插值產生；
+載入器以檔案路徑與修改時間快取，姿勢條件圖每幀呼叫也只讀一次檔案；
+另提供舊版 walk_pose_XX.json（yaml.dump 寫出、含 numpy 標籤）的安全轉換
+"""
+
+import json
+import numpy as np
+import yaml
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Iterable
+from rich.console import Console
+
+console = Console()
+
+POSE_DIR = "data/references/poses"
+FORMAT_NAME = "pose_library"
+FORMAT_VERSION = 1
+
+# 關鍵點的固定順序；缺少的關鍵點以 NaN（JSON 中為 null）表示
+KEYPOINT_NAMES: Tuple[str, ...] = (
+    "head", "neck", "torso",
+    "left_shoulder", "right_shoulder",
+    "left_hip", "right_hip",
+    "left_hand", "right_hand",
+    "left_foot", "right_foot",
+)
+
+# 預設靜止姿勢（相對座標），與過去 DataPreparation.generate_walk_poses 相同並補上手腳端點
+DEFAULT_KEYPOINTS: Dict[str, Tuple[float, float]] = {
+    "head": (0.5, 0.15),
+    "neck": (0.5, 0.25),
+    "torso": (0.5, 0.5),
+    "left_shoulder": (0.3, 0.3),
+    "right_shoulder": (0.7, 0.3),
+    "left_hip": (0.4, 0.65),
+    "right_hip": (0.6, 0.65),
+    "left_hand": (0.42, 0.56),
+    "right_hand": (0.58, 0.56),
+    "left_foot": (0.47, 0.9),
+    "right_foot": (0.53, 0.9),
+}
+
+# 隨身體起伏的關鍵點（手腳端點以外）
+BODY_KEYPOINTS = ("head", "neck", "torso", "left_shoulder", "right_shoulder",
+                  "left_hip", "right_hip", "left_hand", "right_hand")
+
+# demo_simple 舊格式以腿部端點表示腳底
+LEGACY_ALIASES = {"left_leg": "left_foot", "right_leg": "right_foot"}
+
+LEGACY_PATTERN = "walk_pose_*.json"
+
+def interpolate_keyframes(values: np.ndarray, phases: np.ndarray, targets: np.ndarray,
+                          loop: bool = True) -> np.ndarray:
+    """以 Catmull-Rom 樣條在相位上插值 (關鍵幀, ...) 陣列，回傳 (目標數, ...)
+
+    循環動作首尾相接（相位以1為週期），非循環動作在兩端夾住端點。
+    """
+    values = np.asarray(values, dtype=np.float32)
+    phases = np.asarray(phases, dtype=np.float64)
+    count = len(phases)
+    if count == 1:
+        return np.broadcast_to(values[0], (len(targets), *values.shape[1:])).copy()
+
+    if loop:
+        knots = np.append(phases, phases[0] + 1.0)
+        targets = phases[0] + np.mod(np.asarray(targets, dtype=np.float64) - phases[0], 1.0)
+        segment = np.clip(np.searchsorted(knots, targets, side='right') - 1, 0, count - 1)
+        index = lambda offset: np.mod(segment + offset, count)
+    else:
+        knots = phases
+        targets = np.clip(np.asarray(targets, dtype=np.float64), phases[0], phases[-1])
+        segment = np.clip(np.searchsorted(knots, targets, side='right') - 1, 0, count - 2)
+        index = lambda offset: np.clip(segment + offset, 0, count - 1)
+
+    t = (targets - knots[segment]) / (knots[segment + 1] - knots[segment])
+    t = t.reshape(-1, *([1] * (values.ndim - 1))).astype(np.float32)
+    p0, p1, p2, p3 = (values[index(offset)] for offset in (-1, 0, 1, 2))
+    return 0.5 * (2 * p1 + (p2 - p0) * t + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t ** 2
+                  + (3 * (p1 - p2) + p3 - p0) * t ** 3)
+
+@dataclass(eq=False)
+class PoseLibrary:
+    """單一動作的姿勢序列"""
+    name: str
+    keypoint_names: Tuple[str, ...]
+    keypoints: np.ndarray      # (幀, 關鍵點, 2) float32，缺少為 NaN
+    phases: np.ndarray         # (幀,) 週期相位 0~1
+    walk_offsets: np.ndarray   # (幀,) 舊版格式的行走偏移量
+    loop: bool = True          # 循環動作（walk/run/idle）首尾相接
+
+    @property
+    def frame_count(self) -> int:
+        return self.keypoints.shape[0]
+
+    def index(self, name: str) -> int:
+        return self.keypoint_names.index(name)
+
+    def point(self, frame_idx: int, name: str) -> Optional[Tuple[float, float]]:
+        """指定幀的關鍵點相對座標；不存在時回傳 None"""
+        if name not in self.keypoint_names:
+            return None
+        x, y = self.keypoints[frame_idx % self.frame_count, self.index(name)]
+        if np.isnan(x) or np.isnan(y):
+            return None
+        return float(x), float(y)
+
+    def frame(self, frame_idx: int, fill_defaults: bool = False) -> Dict[str, Tuple[float, float]]:
+        """指定幀所有存在的關鍵點 {名稱: (x, y)}；fill_defaults 時缺少的關鍵點以靜止姿勢補上"""
+        points = self.keypoints[frame_idx % self.frame_count]
+        present = ~np.isnan(points).any(axis=1)
+        frame = dict(DEFAULT_KEYPOINTS) if fill_defaults else {}
+        frame.update({name: (float(x), float(y))
+                      for name, (x, y), ok in zip(self.keypoint_names, points, present) if ok})
+        return frame
+
+    def pixel_frame(self, frame_idx: int, size: Tuple[int, int],
+                    fill_defaults: bool = False) -> Dict[str, Tuple[int, int]]:
+        """指定幀的關鍵點像素座標；size 為 (寬, 高)"""
+        width, height = size
+        return {name: (int(round(x * width)), int(round(y * height)))
+                for name, (x, y) in self.frame(frame_idx, fill_defaults).items()}
+
+    def sample(self, frame_count: int) -> "PoseLibrary":
+        """由關鍵幀插值出 frame_count 幀；循環動作均分一個週期，非循環動作包含首尾關鍵幀"""
+        if self.loop:
+            targets = self.phases[0] + np.arange(frame_count) / frame_count
+        else:
+            targets = np.linspace(self.phases[0], self.phases[-1], frame_count)
+        keypoints = interpolate_keyframes(self.keypoints, self.phases, targets, self.loop)
+        walk_offsets = interpolate_keyframes(self.walk_offsets, self.phases, targets, self.loop)
+        return PoseLibrary._build(self.name, self.keypoint_names, keypoints,
+                                  np.mod(targets, 1.0) if self.loop else targets, walk_offsets, self.loop)
+
+    def to_json_dict(self) -> dict:
+        """純JSON結構；缺少的關鍵點寫為 null"""
+        frames = [
+            [None if np.isnan(point).any() else [round(float(point[0]), 6), round(float(point[1]), 6)]
+             for point in frame]
+            for frame in self.keypoints
+        ]
+        return {
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "name": self.name,
+            "keypoint_names": list(self.keypoint_names),
+            "phases": [round(float(p), 6) for p in self.phases],
+            "walk_offsets": [round(float(o), 6) for o in self.walk_offsets],
+            "loop": self.loop,
+            "frames": frames,
+        }
+
+    @classmethod
+    def from_json_dict(cls, data: dict) -> "PoseLibrary":
+        if data.get("format") != FORMAT_NAME:
+            raise ValueError(f"不是姿勢庫格式: {data.get('format')!r}")
+        names = tuple(data["keypoint_names"])
+        keypoints = np.array(
+            [[(np.nan, np.nan) if point is None else point for point in frame] for frame in data["frames"]],
+            dtype=np.float32,
+        ).reshape(-1, len(names), 2)
+        return cls._build(data.get("name", "walk"), names, keypoints,
+                          data.get("phases"), data.get("walk_offsets"), bool(data.get("loop", True)))
+
+    @classmethod
+    def _build(cls, name: str, names: Iterable[str], keypoints: np.ndarray,
+               phases=None, walk_offsets=None, loop: bool = True) -> "PoseLibrary":
+        """補齊預設欄位並將陣列設為唯讀（快取中的實例會被共用）"""
+        keypoints = np.asarray(keypoints, dtype=np.float32)
+        frame_count = keypoints.shape[0]
+        if phases is None or len(phases) != frame_count:
+            phases = np.arange(frame_count) / max(frame_count, 1)
+        if walk_offsets is None or len(walk_offsets) != frame_count:
+            walk_offsets = np.zeros(frame_count)
+        arrays = [keypoints, np.asarray(phases, dtype=np.float32), np.asarray(walk_offsets, dtype=np.float32)]
+        for array in arrays:
+            array.setflags(write=False)
+        return cls(name, tuple(str(n) for n in names), *arrays, loop=loop)
+
+def _offsets(phases: np.ndarray, **joints) -> np.ndarray:
+    """將 {關鍵點: (dx, dy)}（每項為純量或逐關鍵幀陣列）組成 (關鍵幀, 關鍵點, 2) 位移"""
+    offsets = np.zeros((len(phases), len(KEYPOINT_NAMES), 2), dtype=np.float32)
+    for name, (dx, dy) in joints.items():
+        targets = BODY_KEYPOINTS if name == "body" else (name,)
+        for target in targets:
+            index = KEYPOINT_NAMES.index(target)
+            offsets[:, index, 0] += dx
+            offsets[:, index, 1] += dy
+    return offsets
+
+def _gait_offsets(phases: np.ndarray, stride: float, arm: float, lift: float,
+                  bob: float, lean: float) -> np.ndarray:
+    """行走與跑步的關鍵幀：雙腳前後交替、手臂反向擺動，雙腳著地時身體下沉"""
+    swing = np.sin(2 * np.pi * phases)
+    arm_swing = np.cos(2 * np.pi * phases)
+    # 向前擺動中的腳在經過身體下方時抬起
+    left_lift = -lift * np.clip(np.cos(2 * np.pi * phases), 0, None)
+    right_lift = -lift * np.clip(-np.cos(2 * np.pi * phases), 0, None)
+    return _offsets(
+        phases,
+        body=(0.0, bob * np.abs(swing)),
+        head=(lean, 0.0),
+        neck=(lean * 0.6, 0.0),
+        left_hand=(arm * arm_swing, 0.0),
+        right_hand=(-arm * arm_swing, 0.0),
+        left_foot=(stride * swing, left_lift),
+        right_foot=(-stride * swing, right_lift),
+    )
+
+def _clip_walk(phases):
+    return _gait_offsets(phases, stride=0.06, arm=0.04, lift=0.02, bob=0.01, lean=0.0), True
+
+def _clip_run(phases):
+    return _gait_offsets(phases, stride=0.11, arm=0.08, lift=0.05, bob=0.02, lean=0.03), True
+
+def _clip_idle(phases):
+    # 呼吸：上半身微微起伏，雙腳不動
+    breath = 0.008 * (1 - np.cos(2 * np.pi * phases)) / 2
+    return _offsets(phases, body=(0.0, breath)), True
+
+def _clip_jump(phases):
+    # 蹲下 → 起跳 → 最高點 → 下落 → 落地緩衝
+    body = np.array([0.05, -0.05, -0.15, -0.05, 0.04], dtype=np.float32)
+    feet = np.array([0.0, 0.0, -0.1, -0.03, 0.0], dtype=np.float32)
+    hands = np.array([0.04, -0.06, -0.12, -0.02, 0.03], dtype=np.float32)
+    return _offsets(
+        phases,
+        body=(0.0, body),
+        left_hand=(0.0, hands - body), right_hand=(0.0, hands - body),
+        left_foot=(0.0, feet), right_foot=(0.0, feet),
+    ), False
+
+# 內建動作：(關鍵幀相位, 關鍵幀位移產生函式)
+BUILTIN_CLIPS = {
+    "walk": (np.array([0.0, 0.25, 0.5, 0.75]), _clip_walk),
+    "run": (np.array([0.0, 0.25, 0.5, 0.75]), _clip_run),
+    "idle": (np.array([0.0, 0.5]), _clip_idle),
+    "jump": (np.array([0.0, 0.25, 0.5, 0.75, 1.0]), _clip_jump),
+}
+
+@lru_cache(maxsize=None)
+def build_clip(name: str = "walk") -> PoseLibrary:
+    """產生內建動作的關鍵幀姿勢庫"""
+    if name not in BUILTIN_CLIPS:
+        raise ValueError(f"未知的動作: {name}（可用: {', '.join(BUILTIN_CLIPS)}）")
+    phases, offsets_fn = BUILTIN_CLIPS[name]
+    offsets, loop = offsets_fn(phases)
+    rest = np.array([DEFAULT_KEYPOINTS[n] for n in KEYPOINT_NAMES], dtype=np.float32)
+    # 保留舊版的行走偏移量語意
+    walk_offsets = np.sin(2 * np.pi * phases) * 0.1 if loop else np.zeros(len(phases))
+    return PoseLibrary._build(name, KEYPOINT_NAMES, rest + offsets, phases, walk_offsets, loop)
+
+def save_pose_library(library: PoseLibrary, path) -> Path:
+    """依副檔名寫成 .json 或 .npz"""
+    path = Path(path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    if path.suffix == ".npz":
+        np.savez(path,
+                 name=np.array(library.name),
+                 loop=np.array(library.loop),
+                 keypoint_names=np.array(library.keypoint_names),
+                 keypoints=library.keypoints,
+                 phases=library.phases,
+                 walk_offsets=library.walk_offsets)
+    elif path.suffix == ".json":
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(library.to_json_dict(), f, indent=2, ensure_ascii=False)
+    else:
+        raise ValueError(f"不支援的姿勢庫副檔名: {path.suffix}")
+    return path
+
+def read_pose_library(path) -> PoseLibrary:
+    """直接讀取單一姿勢庫檔案（不經快取）"""
+    path = Path(path)
+    if path.suffix == ".npz":
+        with np.load(path, allow_pickle=False) as data:
+            loop = bool(data["loop"]) if "loop" in data.files else True
+            return PoseLibrary._build(str(data["name"]), data["keypoint_names"].tolist(), data["keypoints"],
+                                      data["phases"], data["walk_offsets"], loop)
+    with open(path, 'r', encoding='utf-8') as f:
+        return PoseLibrary.from_json_dict(json.load(f))
+
+class _LegacyPoseLoader(yaml.SafeLoader):
+    """舊版姿勢檔的安全載入器：只還原 numpy 純量，其餘 python 標籤一律略過"""
+
+_NUMPY_SCALAR_TAGS = ("object/apply:numpy._core.multiarray.scalar", "object/apply:numpy.core.multiarray.scalar")
+
+def _construct_python_tag(loader: _LegacyPoseLoader, suffix: str, node):
+    if suffix in _NUMPY_SCALAR_TAGS and isinstance(node, yaml.SequenceNode) and len(node.value) >= 2:
+        dtype_node, data_node = node.value[:2]
+        # dtype 只取其字串代碼（如 'f8'），資料為 !!binary 原始位元組
+        args = loader.construct_mapping(dtype_node, deep=True).get("args") if isinstance(dtype_node, yaml.MappingNode) else None
+        if args:
+            return np.frombuffer(loader.construct_object(data_node), dtype=np.dtype(str(args[0])))[0].item()
+    return None
+
+_LegacyPoseLoader.add_multi_constructor("tag:yaml.org,2002:python/", _construct_python_tag)
+
+def read_legacy_poses(pose_files: List[Path], name: str = "walk") -> PoseLibrary:
+    """將舊版逐幀姿勢檔（yaml.dump 或 demo_simple 的JSON）合併為姿勢庫"""
+    poses = []
+    for pose_file in pose_files:
+        with open(pose_file, 'r', encoding='utf-8') as f:
+            poses.append(yaml.load(f, Loader=_LegacyPoseLoader) or {})
+    poses.sort(key=lambda pose: pose.get("frame", 0))
+
+    # 依固定順序排列，額外的關鍵點附加在後
+    names = list(KEYPOINT_NAMES)
+    for pose in poses:
+        for kp in pose.get("keypoints", []):
+            kp_name = LEGACY_ALIASES.get(kp["name"], kp["name"])
+            if kp_name not in names:
+                names.append(kp_name)
+
+    keypoints = np.full((len(poses), len(names), 2), np.nan, dtype=np.float32)
+    for i, pose in enumerate(poses):
+        for kp in pose.get("keypoints", []):
+            keypoints[i, names.index(LEGACY_ALIASES.get(kp["name"], kp["name"]))] = (kp["x"], kp["y"])
+
+    frame_count = len(poses)
+    phases = [pose.get("walk_phase", i / frame_count) for i, pose in enumerate(poses)]
+    walk_offsets = [pose.get("walk_offset") or 0.0 for pose in poses]
+    return PoseLibrary._build(name, names, keypoints, phases, walk_offsets)
+
+def resolve_pose_source(path=POSE_DIR, clip: str = "walk") -> Tuple[Optional[Path], List[Path]]:
+    """找出姿勢庫來源：.npz 或 .json，沒有時退回舊版逐幀檔；回傳 (檔案, 舊版檔案列表)"""
+    path = Path(path)
+    if path.is_file():
+        return path, []
+    # 兩種格式並存時取較新的檔案，同時寫出時優先 .npz
+    candidates = [path / f"{clip}{suffix}" for suffix in (".npz", ".json")]
+    candidates = [candidate for candidate in candidates if candidate.exists()]
+    if candidates:
+        return max(candidates, key=lambda candidate: candidate.stat().st_mtime_ns), []
+    if clip == "walk":
+        return None, sorted(path.glob(LEGACY_PATTERN))
+    return None, []
+
+@lru_cache(maxsize=32)
+def _load_cached(path: str, legacy: Tuple[str, ...], clip: str, mtime_ns: int) -> PoseLibrary:
+    if legacy:
+        return read_legacy_poses([Path(p) for p in legacy], clip)
+    return read_pose_library(path)
+
+def load_pose_library(path=POSE_DIR, clip: str = "walk") -> PoseLibrary:
+    """載入動作的關鍵幀姿勢庫（依路徑與修改時間快取）；找不到檔案時使用內建動作"""
+    source, legacy = resolve_pose_source(path, clip)
+    if source is not None:
+        return _load_cached(str(source), (), clip, source.stat().st_mtime_ns)
+    if legacy:
+        mtime_ns = max(p.stat().st_mtime_ns for p in legacy)
+        return _load_cached(str(path), tuple(str(p) for p in legacy), clip, mtime_ns)
+    return build_clip(clip)
+
+@lru_cache(maxsize=64)
+def _sample_cached(library: PoseLibrary, frame_count: int) -> PoseLibrary:
+    return library.sample(frame_count)
+
+def sample_pose_clip(clip: str = "walk", frame_count: int = 8, path=POSE_DIR) -> PoseLibrary:
+    """取得動作插值為 frame_count 幀的姿勢（關鍵幀與插值結果皆快取）"""
+    return _sample_cached(load_pose_library(path, clip), frame_count)
+
+def write_builtin_clips(pose_dir=POSE_DIR, formats: Iterable[str] = ("json", "npz")) -> List[Path]:
+    """將所有內建動作的關鍵幀寫入姿勢目錄"""
+    return [save_pose_library(build_clip(name), Path(pose_dir) / f"{name}.{fmt}")
+            for name in BUILTIN_CLIPS for fmt in formats]
+
+def convert_legacy_poses(pose_dir=POSE_DIR, formats: Iterable[str] = ("json", "npz"),
+                         remove_legacy: bool = False) -> List[Path]:
+    """將目錄中的舊版 walk_pose_XX.json 轉為姿勢庫檔案"""
+    pose_dir = Path(pose_dir)
+    legacy = sorted(pose_dir.glob(LEGACY_PATTERN))
+    if not legacy:
+        return []
+
+    library = read_legacy_poses(legacy)
+    written = [save_pose_library(library, pose_dir / f"{library.name}.{fmt}") for fmt in formats]
+    if remove_legacy:
+        for pose_file in legacy:
+            pose_file.unlink()
+    return written
+
+def main():
+    """主函數：轉換舊版姿勢檔、寫出內建動作或顯示插值後的姿勢"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="姿勢庫工具")
+    parser.add_argument("--pose-dir", default=POSE_DIR, help="姿勢參考目錄")
+    parser.add_argument("--convert", action="store_true", help="將舊版 walk_pose_XX.json 轉為姿勢庫")
+    parser.add_argument("--format", choices=["json", "npz", "both"], default="both", help="轉換輸出格式")
+    parser.add_argument("--remove-legacy", action="store_true", help="轉換後刪除舊版逐幀檔")
+    parser.add_argument("--write-clips", action="store_true", help="寫出所有內建動作的關鍵幀")
+    parser.add_argument("--clip", default="walk", help="顯示的動作名稱")
+    parser.add_argument("--frames", type=int, help="顯示插值為此幀數的姿勢（預設顯示關鍵幀）")
+    args = parser.parse_args()
+    formats = ["json", "npz"] if args.format == "both" else [args.format]
+
+    if args.write_clips:
+        for path in write_builtin_clips(args.pose_dir, formats):
+            console.print(f"✅ 已寫出 {path}", style="green")
+
+    if args.convert:
+        written = convert_legacy_poses(args.pose_dir, formats, args.remove_legacy)
+        if not written:
+            console.print(f"⚠️  {args.pose_dir} 中沒有舊版姿勢檔", style="yellow")
+        for path in written:
+            console.print(f"✅ 已寫出 {path}", style="green")
+
+    library = load_pose_library(args.pose_dir, args.clip)
+    if args.frames:
+        library = library.sample(args.frames)
+    kind = "循環" if library.loop else "單次"
+    console.print(f"🦴 {library.name}（{kind}）: {library.frame_count} 幀 × {len(library.keypoint_names)} 個關鍵點",
+                  style="cyan")
+    for frame_idx in range(library.frame_count):
+        points = library.frame(frame_idx)
+        feet = [points.get(f"{side}_foot") for side in ("left", "right")]
+        feet_text = " / ".join(f"({p[0]:.3f}, {p[1]:.3f})" if p else "—" for p in feet)
+        console.print(f"   • 第 {frame_idx} 幀 相位 {library.phases[frame_idx]:.3f}  腳底 {feet_text}", style="cyan")
+
+if __name__ == "__main__":
+    main()
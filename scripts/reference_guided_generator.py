@@ -1,18 +1,19 @@
 #!/usr/bin/env python3
 """
 參考圖片指導生成器
-使用img2img和Reference ControlNet確保生成的角色與參考圖片一致
+使用img2img和Reference ControlNet確保生成的角色與參考圖片一致；
+參考圖片只經VAE編碼一次，行走搖擺在潛空間套用後以批次img2img引擎生成，
+每幀可有各自的strength與種子，失敗的幀逐一回報
 """
 
 import os
-import yaml
 import torch
 from pathlib import Path
 from PIL import Image, ImageEnhance, ImageFilter
 import numpy as np
 from rich.console import Console
 from rich.progress import Progress, BarColumn, TextColumn
-from typing import List, Optional
+from typing import List, Optional, Dict, Tuple
 
 # Diffusers 相關導入
 from diffusers import (
@@ -24,13 +25,17 @@ from diffusers import (
 from controlnet_aux import OpenposeDetector
 import cv2
 
+from scripts.config_service import load_config
+from scripts.template_store import CharacterRoster
+from scripts.img2img_engine import BatchedImg2ImgEngine, Img2ImgRequest, Img2ImgResult, Img2ImgFrameError
+
 console = Console()
 
 class ReferenceGuidedGenerator:
     def __init__(self, config_path: str = "configs/generation_config.yaml"):
         """初始化參考圖片指導生成器"""
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+        self.config = load_config(config_path)
+        self.roster = CharacterRoster(self.config)
         
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         if torch.backends.mps.is_available():
@@ -39,10 +44,18 @@ class ReferenceGuidedGenerator:
         self.output_dir = Path("output/reference_guided")
         self.output_dir.mkdir(exist_ok=True, parents=True)
         
+        # 較低的strength保持參考圖片特徵；strengths 可逐幀覆寫；同一批次的幀一起去噪
+        ref_config = self.config.get('reference_guided', {})
+        self.strength = ref_config.get('strength', 0.3)
+        self.frame_strengths = ref_config.get('strengths') or []
+        self.seed = ref_config.get('seed', 42)
+        self.batch_size = ref_config.get('batch_size', 8)
+        
         console.print(f"🔧 使用設備: {self.device}", style="blue")
         
         # 初始化模型
         self.img2img_pipe = None
+        self.engine = None
         self.reference_path = None
         self._load_models()
     
@@ -70,6 +83,12 @@ class ReferenceGuidedGenerator:
             
             self.img2img_pipe = self.img2img_pipe.to(self.device)
             
+            self.engine = BatchedImg2ImgEngine(
+                self.img2img_pipe,
+                num_inference_steps=self.config['generation_params']['num_inference_steps'],
+                guidance_scale=self.config['generation_params']['guidance_scale'],
+            )
+            
             console.print("✅ img2img模型載入完成", style="green")
             
         except Exception as e:
@@ -129,6 +148,11 @@ class ReferenceGuidedGenerator:
         
         return variations
     
+    @staticmethod
+    def walking_sway(progress: float) -> int:
+        """行走週期進度對應的左右搖擺像素數"""
+        return int(2 * np.sin(2 * np.pi * progress))
+    
     def apply_walking_transform(self, image: Image.Image, progress: float) -> Image.Image:
         """應用行走動畫變換"""
         # 轉換為numpy陣列
@@ -136,7 +160,7 @@ class ReferenceGuidedGenerator:
         h, w = img_array.shape[:2]
         
         # 計算輕微的左右搖擺
-        sway = int(2 * np.sin(2 * np.pi * progress))
+        sway = self.walking_sway(progress)
         
         # 創建變換矩陣（輕微搖擺）
         if sway != 0:
@@ -146,48 +170,94 @@ class ReferenceGuidedGenerator:
         
         return image
     
-    def generate_frame_from_reference(self, 
-                                    reference_img: Image.Image,
-                                    frame_idx: int,
-                                    character_name: str) -> Image.Image:
-        """基於參考圖片生成單幀"""
-        
-        # 構建提示詞
-        char_config = self.config['prompts']['character_templates'].get(character_name, {})
+    def encode_images(self, images: List[Image.Image]) -> torch.Tensor:
+        """以VAE一次批次編碼圖片，回傳已乘上 scaling_factor 的潛空間
+        
+        取潛在分佈的眾數而非取樣，同一張圖片的編碼結果固定，可安全重用。
+        """
+        pipe = self.img2img_pipe
+        pixels = pipe.image_processor.preprocess([image.convert('RGB') for image in images])
+        pixels = pixels.to(device=pipe._execution_device, dtype=pipe.vae.dtype)
+        with torch.no_grad():
+            latents = pipe.vae.encode(pixels).latent_dist.mode()
+        return latents * pipe.vae.config.scaling_factor
+    
+    def encode_walking_references(self, prepared_ref: Image.Image, shifts: List[int]) -> torch.Tensor:
+        """將各幀的搖擺位移套用到參考圖片的潛空間，回傳 (幀數, 4, h, w)
+        
+        每個不同的位移只編碼一次；位移為VAE縮放倍數時直接在潛空間捲動，
+        不足一個潛空間像素的位移無法在潛空間精確表示，改以位移後的圖片編碼並快取。
+        """
+        factor = self.img2img_pipe.vae_scale_factor
+        unique_shifts = sorted(set(shifts))
+        to_encode = [shift for shift in unique_shifts if shift % factor]
+        if any(shift % factor == 0 for shift in unique_shifts):
+            to_encode.insert(0, 0)
+        
+        ref_array = np.array(prepared_ref)
+        shifted = [Image.fromarray(np.roll(ref_array, shift, axis=1), prepared_ref.mode) for shift in to_encode]
+        encoded: Dict[int, torch.Tensor] = dict(zip(to_encode, self.encode_images(shifted).split(1)))
+        
+        for shift in unique_shifts:
+            if shift not in encoded:
+                encoded[shift] = torch.roll(encoded[0], shift // factor, dims=3)
+        
+        console.print(f"🧬 參考圖片VAE編碼 {len(to_encode)} 次（{len(shifts)} 幀）", style="blue")
+        return torch.cat([encoded[shift] for shift in shifts])
+    
+    def build_frame_prompts(self, character_name: str, frame_idx: int) -> Tuple[str, str]:
+        """構建強調與參考一致的正向與負向提示詞"""
+        char_config = self.roster.get(character_name) or {}
         base_prompt = self.config['prompts']['base_positive']
         char_prompt = char_config.get('positive', '')
         
-        # 創建更強調一致性的提示詞
         full_prompt = f"{base_prompt}, {char_prompt}, walking animation frame {frame_idx}, consistent character design, same outfit, same hairstyle"
         negative_prompt = f"{self.config['prompts']['base_negative']}, different character, changed outfit, different hairstyle"
-        
-        # img2img生成參數
-        gen_params = {
-            "prompt": full_prompt,
-            "negative_prompt": negative_prompt,
-            "image": reference_img,
-            "strength": 0.3,  # 較低的strength保持參考圖片特徵
-            "num_inference_steps": self.config['generation_params']['num_inference_steps'],
-            "guidance_scale": self.config['generation_params']['guidance_scale'],
-            "generator": torch.Generator(device=self.device).manual_seed(42 + frame_idx),
-        }
-        
-        try:
-            # 生成圖像
-            with torch.no_grad():
-                result = self.img2img_pipe(**gen_params)
-                generated_image = result.images[0]
-            
-            return generated_image
-            
-        except Exception as e:
-            console.print(f"❌ 生成幀 {frame_idx} 失敗: {e}", style="red")
-            # 返回參考圖片作為後備
-            return reference_img
+        return full_prompt, negative_prompt
+    
+    def frame_strength(self, frame_idx: int) -> float:
+        """取得指定幀的img2img strength"""
+        if self.frame_strengths:
+            return self.frame_strengths[frame_idx % len(self.frame_strengths)]
+        return self.strength
+    
+    def generate_frames_from_latents(self,
+                                     reference_latents: torch.Tensor,
+                                     frame_indices: List[int],
+                                     character_name: str) -> List[Img2ImgResult]:
+        """以已編碼的參考潛空間批次執行img2img，每幀使用各自的提示詞、strength與種子"""
+        requests = []
+        for latents, frame_idx in zip(reference_latents.split(1), frame_indices):
+            prompt, negative_prompt = self.build_frame_prompts(character_name, frame_idx)
+            requests.append(Img2ImgRequest(
+                frame_idx=frame_idx,
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                latents=latents,
+                strength=self.frame_strength(frame_idx),
+                seed=self.seed + frame_idx,
+            ))
+        return self.engine.run(requests)
+    
+    def generate_frame_from_reference(self, 
+                                    reference_img: Image.Image,
+                                    frame_idx: int,
+                                    character_name: str) -> Image.Image:
+        """基於參考圖片生成單幀，失敗時拋出 Img2ImgFrameError"""
+        latents = self.encode_images([reference_img])
+        result = self.generate_frames_from_latents(latents, [frame_idx], character_name)[0]
+        if not result.ok:
+            raise Img2ImgFrameError(f"生成幀 {frame_idx} 失敗: {result.error}")
+        return result.image
     
     def generate_kelly_walking_cycle(self, reference_path: str) -> List[Image.Image]:
         """專門為Kelly生成行走週期"""
-        console.print("🎯 開始基於參考圖片生成Kelly行走週期", style="bold magenta")
+        return self.generate_reference_walking_cycle(reference_path, "kelly")
+    
+    def generate_reference_walking_cycle(self, reference_path: str, character_name: str,
+                                         frame_count: int = 8) -> List[Image.Image]:
+        """基於角色參考圖片生成行走週期（失敗的幀不在回傳列表中）"""
+        console.print(f"🎯 開始基於參考圖片生成 {character_name} 行走週期", style="bold magenta")
         
         # 載入參考圖片
         ref_image = self.load_reference_image(reference_path)
@@ -197,10 +267,13 @@ class ReferenceGuidedGenerator:
                       self.config['image_settings']['height'])
         prepared_ref = self.prepare_reference_for_generation(ref_image, target_size)
         
-        # 創建行走變化
-        walking_refs = self.create_walking_variations(prepared_ref, 8)
+        # 行走變化以潛空間位移表示，參考圖片只編碼一次
+        shifts = [self.walking_sway(i / frame_count) for i in range(frame_count)]
+        reference_latents = self.encode_walking_references(prepared_ref, shifts)
         
         frames = []
+        failures = []
+        executed_steps = 0
         
         with Progress(
             TextColumn("[progress.description]{task.description}"),
@@ -208,21 +281,36 @@ class ReferenceGuidedGenerator:
             TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
             console=console
         ) as progress:
-            task = progress.add_task("生成Kelly行走幀", total=len(walking_refs))
+            task = progress.add_task(f"生成{character_name}行走幀", total=frame_count)
             
-            for i, ref_variant in enumerate(walking_refs):
-                # 生成基於參考的幀
-                frame = self.generate_frame_from_reference(ref_variant, i, "kelly")
-                frames.append(frame)
+            for start in range(0, frame_count, self.batch_size):
+                frame_indices = list(range(start, min(start + self.batch_size, frame_count)))
+                results = self.generate_frames_from_latents(
+                    reference_latents[frame_indices[0]:frame_indices[-1] + 1], frame_indices, character_name
+                )
                 
-                # 保存幀
-                frame_path = self.output_dir / f"kelly_ref_frame_{i:02d}.png"
-                frame.save(frame_path, "PNG")
+                for result in results:
+                    executed_steps += result.effective_steps
+                    if not result.ok:
+                        failures.append(result)
+                        console.print(f"❌ 生成幀 {result.frame_idx} 失敗: {result.error}", style="red")
+                        continue
+                    frames.append(result.image)
+                    
+                    # 保存幀
+                    frame_path = self.output_dir / f"{character_name}_ref_frame_{result.frame_idx:02d}.png"
+                    result.image.save(frame_path, "PNG")
                 
-                progress.update(task, advance=1,
-                              description=f"Kelly參考生成 第 {i+1}/{len(walking_refs)} 幀")
+                progress.update(task, advance=len(frame_indices),
+                              description=f"{character_name}參考生成 第 {frame_indices[-1]+1}/{frame_count} 幀")
+        
+        num_steps = self.config['generation_params']['num_inference_steps']
+        console.print(f"⏱️  實際執行 {executed_steps}/{num_steps * frame_count} 個推理步", style="cyan")
         
-        console.print("✅ Kelly參考指導生成完成", style="green")
+        if failures:
+            console.print(f"⚠️  {len(failures)} 幀生成失敗: {[result.frame_idx for result in failures]}", style="yellow")
+        else:
+            console.print(f"✅ {character_name} 參考指導生成完成", style="green")
         return frames
     
     def create_simple_reference_copy(self, reference_path: str, output_count: int = 8):
@@ -5,22 +5,30 @@
 """
 
 import os
-import yaml
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 import numpy as np
 from rich.console import Console
 from rich.progress import Progress, BarColumn, TextColumn
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 import json
 
+from scripts.background_removal import BackgroundRemover
+from scripts.frame_trimmer import trim_frames, pack_frames, foot_pivots
+from scripts.binary_metadata import write_binary_metadata
+from scripts.texture_export import TextureArrayExporter
+from scripts.animation_preview import AnimationPreviewExporter
+from scripts.directions import direction_settings, frame_prefix, MIRROR_FLIP
+from scripts.config_service import load_config
+from scripts.template_store import CharacterRoster
+from scripts.generator_backends import read_backend_manifest
+
 console = Console()
 
 class SpriteSheetComposer:
     def __init__(self, config_path: str = "configs/generation_config.yaml"):
         """初始化精靈表組合器"""
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+        self.config = load_config(config_path)
         
         self.frames_dir = Path("output/frames")
         self.output_dir = Path("output/sprite_sheets")
@@ -30,20 +38,56 @@ class SpriteSheetComposer:
         self.sprite_size = tuple(self.config['image_settings']['original_sprite_size'])
         self.padding = self.config['postprocess']['add_padding']
         self.layout = self.config['postprocess']['sprite_sheet_layout']
+        self.trim = self.config['postprocess'].get('trim', False)
+        self.binary_metadata = self.config['postprocess'].get('binary_metadata', False)
+        self.background_remover = BackgroundRemover.from_config(self.config)
+        self.export_textures = self.config.get('texture_export', {}).get('enabled', False)
+        self.texture_exporter = TextureArrayExporter.from_config(self.config)
+        self.export_previews = self.config.get('animation_preview', {}).get('enabled', False)
+        self.preview_exporter = AnimationPreviewExporter.from_config(self.config)
+        self.directions = direction_settings(self.config)
+        self.roster = CharacterRoster(self.config)
+        # 各幀前綴由哪個生成後端產生（第一次組合時才讀取）
+        self._frame_backends: Optional[Dict[str, str]] = None
+    
+    def frame_backend(self, prefix: str) -> Optional[str]:
+        """產生該幀前綴的生成後端，未記錄時為 None"""
+        if self._frame_backends is None:
+            self._frame_backends = read_backend_manifest(self.frames_dir)
+        return self._frame_backends.get(prefix)
     
-    def collect_character_frames(self, character_type: str) -> List[Path]:
-        """收集指定角色的所有幀"""
-        pattern = f"{character_type}_processed_frame_*.png"
+    def collect_character_frames(self, character_type: str, direction: Optional[str] = None) -> List[Path]:
+        """收集指定角色（與方向）的所有幀"""
+        prefix = frame_prefix(character_type, direction, self.directions["base"])
+        pattern = f"{prefix}_processed_frame_*.png"
         frames = sorted(list(self.frames_dir.glob(pattern)))
         
         if not frames:
             # 如果沒有處理過的幀，使用原始幀
-            pattern = f"{character_type}_frame_*.png"
+            pattern = f"{prefix}_frame_*.png"
             frames = sorted(list(self.frames_dir.glob(pattern)))
         
-        console.print(f"📋 收集到 {character_type} 的 {len(frames)} 幀", style="blue")
+        console.print(f"📋 收集到 {prefix} 的 {len(frames)} 幀", style="blue")
         return frames
     
+    def load_character_frames(self, character_type: str, direction: Optional[str] = None) -> List[Image.Image]:
+        """載入角色的幀，完成背景移除並縮放到目標尺寸"""
+        # 收集幀文件
+        frame_paths = self.collect_character_frames(character_type, direction)
+        if not frame_paths:
+            console.print(f"❌ 未找到 {frame_prefix(character_type, direction, self.directions['base'])} 的幀文件", style="red")
+            return []
+        
+        # 載入幀
+        frames = [Image.open(frame_path) for frame_path in frame_paths]
+        
+        # 背景移除（整個週期共用同一份色鍵查表）
+        if self.config['postprocess']['background_removal']:
+            frames = self.background_remover.remove_batch(frames)
+        
+        # 縮放到目標尺寸
+        return [self.resize_frame_to_target(image) for image in frames]
+    
     def resize_frame_to_target(self, image: Image.Image) -> Image.Image:
         """將幀縮放到目標像素尺寸"""
         target_size = (
@@ -60,18 +104,8 @@ class SpriteSheetComposer:
         return final_resized
     
     def remove_background(self, image: Image.Image) -> Image.Image:
-        """移除背景（簡單版本）"""
-        if image.mode != 'RGBA':
-            image = image.convert('RGBA')
-        
-        # 將白色背景轉為透明
-        data = np.array(image)
-        
-        # 找到接近白色的像素
-        white_pixels = (data[:, :, 0] > 240) & (data[:, :, 1] > 240) & (data[:, :, 2] > 240)
-        data[white_pixels] = [0, 0, 0, 0]  # 設為透明
-        
-        return Image.fromarray(data, 'RGBA')
+        """移除與邊界連通的背景，保留角色內部的白色"""
+        return self.background_remover.remove(image)
     
     def create_horizontal_sprite_sheet(self, frames: List[Image.Image], character_type: str) -> Image.Image:
         """創建水平排列的精靈表"""
@@ -121,7 +155,8 @@ class SpriteSheetComposer:
         return sprite_sheet
     
     def add_metadata_overlay(self, sprite_sheet: Image.Image, character_type: str, 
-                           frame_count: int) -> Image.Image:
+                           frame_count: int,
+                           sheet_rects: Optional[List[Tuple[int, int, int, int]]] = None) -> Image.Image:
         """在精靈表上添加元數據覆蓋"""
         # 創建一個副本來添加標註
         annotated_sheet = sprite_sheet.copy()
@@ -138,21 +173,32 @@ class SpriteSheetComposer:
         draw.text((5, sprite_sheet.height - 20), title, fill=(255, 255, 255, 255), font=font)
         
         # 添加幀編號
-        if self.layout == "horizontal":
+        if sheet_rects is not None:
+            for i, (x, y, _, _) in enumerate(sheet_rects):
+                draw.text((x + 2, y + 2), str(i), fill=(255, 255, 255, 255), font=font)
+        elif self.layout == "horizontal":
             for i in range(frame_count):
                 x_pos = i * (self.sprite_size[0] + self.padding) + 2
                 draw.text((x_pos, 2), str(i), fill=(255, 255, 255, 255), font=font)
         
         return annotated_sheet
     
-    def generate_sprite_metadata(self, character_type: str, frame_count: int) -> dict:
-        """生成精靈表元數據"""
+    def generate_sprite_metadata(self, character_type: str, frame_count: int,
+                               sheet_rects: Optional[List[Tuple[int, int, int, int]]] = None,
+                               source_rects: Optional[np.ndarray] = None,
+                               sheet_size: Optional[Tuple[int, int]] = None) -> dict:
+        """生成精靈表元數據（TexturePacker JSON陣列格式相容）
+        
+        sheet_rects 為每幀在精靈表中的位置，source_rects 為裁切前在原始幀中的外框；
+        未裁切時兩者皆依固定幀尺寸計算。
+        """
         metadata = {
             "character_type": character_type,
             "frame_count": frame_count,
             "frame_size": self.sprite_size,
             "layout": self.layout,
             "padding": self.padding,
+            "trimmed": source_rects is not None,
             "animation": {
                 "fps": self.config['animation']['fps'],
                 "loop": True,
@@ -161,90 +207,177 @@ class SpriteSheetComposer:
             "frames": []
         }
         
+        # 未裁切時依固定幀尺寸計算位置
+        if sheet_rects is None:
+            sheet_rects = []
+            for i in range(frame_count):
+                if self.layout == "horizontal":
+                    x = i * (self.sprite_size[0] + self.padding)
+                    y = 0
+                else:  # grid layout
+                    cols = 4
+                    x = (i % cols) * (self.sprite_size[0] + self.padding)
+                    y = (i // cols) * (self.sprite_size[1] + self.padding)
+                sheet_rects.append((x, y, self.sprite_size[0], self.sprite_size[1]))
+        
+        trimmed = source_rects is not None
+        if not trimmed:
+            source_rects = np.array([[0, 0, self.sprite_size[0], self.sprite_size[1]]] * frame_count)
+        pivots = foot_pivots(source_rects, self.sprite_size)
+        
         # 添加每幀的位置信息
-        for i in range(frame_count):
-            if self.layout == "horizontal":
-                x = i * (self.sprite_size[0] + self.padding)
-                y = 0
-            else:  # grid layout
-                cols = 4
-                x = (i % cols) * (self.sprite_size[0] + self.padding)
-                y = (i // cols) * (self.sprite_size[1] + self.padding)
-            
+        for i, ((x, y, w, h), (sx, sy, sw, sh), (px, py)) in enumerate(zip(sheet_rects, source_rects, pivots)):
             frame_info = {
-                "frame": i,
+                "filename": f"{character_type}_{i:02d}",
+                "frame": {"x": x, "y": y, "w": w, "h": h},
+                "rotated": False,
+                "trimmed": trimmed,
+                "spriteSourceSize": {"x": int(sx), "y": int(sy), "w": int(sw), "h": int(sh)},
+                "sourceSize": {"w": self.sprite_size[0], "h": self.sprite_size[1]},
+                "pivot": {"x": round(float(px), 4), "y": round(float(py), 4)},
+                # 舊版欄位
+                "index": i,
                 "x": x,
                 "y": y,
-                "width": self.sprite_size[0],
-                "height": self.sprite_size[1]
+                "width": w,
+                "height": h
             }
             metadata["frames"].append(frame_info)
         
+        if sheet_size is None:
+            sheet_size = (
+                max(x + w for x, _, w, _ in sheet_rects) if sheet_rects else 0,
+                max(y + h for _, y, _, h in sheet_rects) if sheet_rects else 0,
+            )
+        metadata["meta"] = {
+            "app": "maplestory-sprite-generator",
+            "image": f"{character_type}_sprite_sheet.png",
+            "format": "RGBA8888",
+            "size": {"w": sheet_size[0], "h": sheet_size[1]},
+            "scale": "1"
+        }
+        
         return metadata
     
+    def direction_sheets(self, character_type: str) -> dict:
+        """每個方向對應的精靈表與是否需水平翻轉
+
+        鏡像方向在 metadata 模式下指向來源方向的精靈表並標記 flipX，
+        在 flip 模式下與生成的方向一樣有自己的精靈表。
+        """
+        sheets = {}
+        for direction, source in self.directions["plan"].items():
+            if source is not None and self.directions["mirror_mode"] != MIRROR_FLIP:
+                sheet = frame_prefix(character_type, source, self.directions["base"])
+                sheets[direction] = {"sheet": f"{sheet}_sprite_sheet.png", "flipX": True}
+            else:
+                sheet = frame_prefix(character_type, direction, self.directions["base"])
+                sheets[direction] = {"sheet": f"{sheet}_sprite_sheet.png", "flipX": False}
+        return sheets
+    
     def compose_character_sheet(self, character_type: str):
-        """組合指定角色的精靈表"""
-        console.print(f"📑 組合 {character_type} 精靈表...", style="bold blue")
-        
-        # 收集幀文件
-        frame_paths = self.collect_character_frames(character_type)
-        if not frame_paths:
-            console.print(f"❌ 未找到 {character_type} 的幀文件", style="red")
+        """組合指定角色所有方向的精靈表"""
+        frames = self.load_character_frames(character_type)
+        if not frames:
             return
         
-        # 載入和處理幀
-        frames = []
-        for frame_path in frame_paths:
-            image = Image.open(frame_path)
-            
-            # 背景移除
-            if self.config['postprocess']['background_removal']:
-                image = self.remove_background(image)
-            
-            # 縮放到目標尺寸
-            image = self.resize_frame_to_target(image)
-            frames.append(image)
+        base = self.directions["base"]
+        directions = self.direction_sheets(character_type)
+        self.compose_direction_sheet(character_type, base, frames, directions)
+        
+        for direction, source in self.directions["plan"].items():
+            if direction == base:
+                continue
+            if source is None:
+                # 不對稱方向：使用另外生成的幀
+                direction_frames = self.load_character_frames(character_type, direction)
+            elif self.directions["mirror_mode"] == MIRROR_FLIP:
+                # 鏡像方向：水平翻轉來源方向的幀，不重新生成
+                source_frames = frames if source == base else self.load_character_frames(character_type, source)
+                direction_frames = [ImageOps.mirror(frame) for frame in source_frames]
+            else:
+                # 鏡像方向只記錄在元數據中
+                continue
+            if direction_frames:
+                self.compose_direction_sheet(character_type, direction, direction_frames, directions)
+    
+    def compose_direction_sheet(self, character_type: str, direction: str,
+                                frames: List[Image.Image], directions: dict):
+        """組合單一方向的精靈表"""
+        sheet_name = frame_prefix(character_type, direction, self.directions["base"])
+        console.print(f"📑 組合 {sheet_name} 精靈表...", style="bold blue")
+        
+        # 從組合中的幀直接匯出紋理陣列（裁切前，各層同尺寸）
+        if self.export_textures:
+            self.texture_exporter.export(sheet_name, frames)
+        
+        # 動畫預覽在背景執行緒編碼，不阻塞精靈表組合
+        if self.export_previews:
+            self.preview_exporter.submit(sheet_name, frames)
         
         # 創建精靈表
-        if self.layout == "horizontal":
-            sprite_sheet = self.create_horizontal_sprite_sheet(frames, character_type)
+        sheet_rects = None
+        source_rects = None
+        if self.trim:
+            # 裁掉透明邊緣，依各幀實際尺寸排入精靈表
+            frames, source_rects = trim_frames(frames)
+            sprite_sheet, sheet_rects = pack_frames(frames, self.layout, self.padding)
+            console.print(f"✂️  裁切後 {sheet_name} 精靈表尺寸: {sprite_sheet.width}x{sprite_sheet.height}", style="blue")
+        elif self.layout == "horizontal":
+            sprite_sheet = self.create_horizontal_sprite_sheet(frames, sheet_name)
         else:
-            sprite_sheet = self.create_grid_sprite_sheet(frames, character_type)
+            sprite_sheet = self.create_grid_sprite_sheet(frames, sheet_name)
         
         # 保存原始精靈表
-        output_path = self.output_dir / f"{character_type}_sprite_sheet.png"
+        output_path = self.output_dir / f"{sheet_name}_sprite_sheet.png"
         sprite_sheet.save(output_path, "PNG")
         
         # 創建帶標註的版本
-        annotated_sheet = self.add_metadata_overlay(sprite_sheet, character_type, len(frames))
-        annotated_path = self.output_dir / f"{character_type}_sprite_sheet_annotated.png"
+        annotated_sheet = self.add_metadata_overlay(sprite_sheet, sheet_name, len(frames), sheet_rects)
+        annotated_path = self.output_dir / f"{sheet_name}_sprite_sheet_annotated.png"
         annotated_sheet.save(annotated_path, "PNG")
         
         # 生成元數據JSON
-        metadata = self.generate_sprite_metadata(character_type, len(frames))
-        metadata_path = self.output_dir / f"{character_type}_metadata.json"
+        metadata = self.generate_sprite_metadata(sheet_name, len(frames), sheet_rects,
+                                                 source_rects, sprite_sheet.size)
+        metadata["direction"] = direction
+        metadata["directions"] = directions
+        # 鏡像方向的幀來自基準方向
+        metadata["generator_backend"] = self.frame_backend(sheet_name) or self.frame_backend(character_type)
+        metadata_path = self.output_dir / f"{sheet_name}_metadata.json"
         with open(metadata_path, 'w', encoding='utf-8') as f:
             json.dump(metadata, f, indent=2, ensure_ascii=False)
         
-        console.print(f"✅ {character_type} 精靈表組合完成", style="green")
+        # 生成可記憶體映射的二進位元數據
+        binary_path = None
+        if self.binary_metadata:
+            binary_path = self.output_dir / f"{sheet_name}_metadata.bin"
+            write_binary_metadata(binary_path, [(sheet_name, metadata)],
+                                  output_path.name, sprite_sheet.size)
+        
+        console.print(f"✅ {sheet_name} 精靈表組合完成", style="green")
         console.print(f"📄 輸出文件:", style="blue")
         console.print(f"   - 精靈表: {output_path}", style="cyan")
         console.print(f"   - 標註版: {annotated_path}", style="cyan")
         console.print(f"   - 元數據: {metadata_path}", style="cyan")
+        if binary_path:
+            console.print(f"   - 二進位元數據: {binary_path}", style="cyan")
     
     def create_master_sheet(self):
         """創建包含所有角色的主精靈表"""
         console.print("🎯 創建主精靈表...", style="bold magenta")
         
-        character_types = list(self.config['prompts']['character_templates'].keys())
+        character_types = self.roster.names()
         all_sheets = []
         
-        # 載入所有角色的精靈表
+        # 載入所有角色（含各方向）的精靈表；共用精靈表的鏡像方向不重複放置
         for char_type in character_types:
-            sheet_path = self.output_dir / f"{char_type}_sprite_sheet.png"
-            if sheet_path.exists():
-                sheet = Image.open(sheet_path)
-                all_sheets.append((char_type, sheet))
+            sheet_files = dict.fromkeys(entry["sheet"] for entry in self.direction_sheets(char_type).values())
+            for sheet_file in sheet_files:
+                sheet_path = self.output_dir / sheet_file
+                if sheet_path.exists():
+                    sheet = Image.open(sheet_path)
+                    all_sheets.append((sheet_file[:-len("_sprite_sheet.png")], sheet))
         
         if not all_sheets:
             console.print("❌ 沒有找到任何精靈表", style="red")
@@ -259,8 +392,10 @@ class SpriteSheetComposer:
         
         # 放置每個角色的精靈表
         y_offset = 0
+        y_offsets = []
         for char_type, sheet in all_sheets:
             master_sheet.paste(sheet, (0, y_offset), sheet)
+            y_offsets.append(y_offset)
             y_offset += sheet.height + self.padding
         
         # 保存主精靈表
@@ -268,12 +403,37 @@ class SpriteSheetComposer:
         master_sheet.save(master_path, "PNG")
         
         console.print(f"✅ 主精靈表創建完成: {master_path}", style="green")
+        
+        if self.binary_metadata:
+            self.create_master_index(all_sheets, y_offsets, master_path.name, master_sheet.size)
     
-    def compose_all_sheets(self):
-        """組合所有角色的精靈表"""
+    def create_master_index(self, all_sheets: List[Tuple[str, Image.Image]], y_offsets: List[int],
+                            image_name: str, sheet_size: Tuple[int, int]):
+        """創建涵蓋主精靈表所有角色的二進位幀索引"""
+        characters = []
+        offsets = []
+        for (char_type, _), y_offset in zip(all_sheets, y_offsets):
+            metadata_path = self.output_dir / f"{char_type}_metadata.json"
+            if not metadata_path.exists():
+                console.print(f"⚠️ 缺少 {char_type} 的元數據，主索引將略過此角色", style="yellow")
+                continue
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                characters.append((char_type, json.load(f)))
+            offsets.append(y_offset)
+        
+        if not characters:
+            return
+        
+        index_path = self.output_dir / "master_sprite_sheet.bin"
+        write_binary_metadata(index_path, characters, image_name, sheet_size, offsets)
+        console.print(f"✅ 主精靈表索引創建完成: {index_path}", style="green")
+    
+    def compose_all_sheets(self, character_types: Optional[List[str]] = None):
+        """組合所有角色（或指定角色子集）的精靈表"""
         console.print("🚀 開始組合所有精靈表", style="bold magenta")
         
-        character_types = list(self.config['prompts']['character_templates'].keys())
+        if character_types is None:
+            character_types = self.roster.names()
         
         with Progress(
             TextColumn("[progress.description]{task.description}"),
@@ -291,18 +451,35 @@ class SpriteSheetComposer:
             self.create_master_sheet()
             progress.update(task, advance=1, description="主精靈表完成")
         
+        # 等待背景的動畫預覽匯出完成
+        if self.export_previews:
+            previews = self.preview_exporter.wait()
+            console.print(f"🎬 動畫預覽: {len(previews)} 個檔案輸出至 {self.preview_exporter.output_dir}", style="green")
+        
         console.print("🎉 所有精靈表組合完成！", style="bold green")
         
         # 輸出總結
         self.print_summary()
     
+    def export_all_textures(self, character_type: Optional[str] = None):
+        """不組合精靈表，直接從 output/frames 匯出紋理陣列"""
+        console.print("🧊 匯出紋理陣列...", style="bold magenta")
+        
+        character_types = [character_type] if character_type else self.roster.names()
+        for char_type in character_types:
+            frames = self.load_character_frames(char_type)
+            if frames:
+                self.texture_exporter.export(char_type, frames)
+        
+        console.print(f"✅ 紋理陣列輸出至: {self.texture_exporter.output_dir}", style="green")
+    
     def print_summary(self):
         """輸出處理總結"""
         console.print("\n📊 處理總結:", style="bold yellow")
         
         # 統計輸出文件
         sheet_files = list(self.output_dir.glob("*_sprite_sheet.png"))
-        metadata_files = list(self.output_dir.glob("*_metadata.json"))
+        metadata_files = list(self.output_dir.glob("*_metadata.json")) + list(self.output_dir.glob("*_metadata.bin"))
         
         console.print(f"✨ 生成的精靈表: {len(sheet_files)} 個", style="green")
         console.print(f"📋 元數據文件: {len(metadata_files)} 個", style="green")
@@ -5,33 +5,60 @@
 """
 
 import os
-import yaml
+import queue
+import hashlib
+import threading
 import torch
 from pathlib import Path
 from PIL import Image
 import numpy as np
 from rich.console import Console
 from rich.progress import Progress, BarColumn, TextColumn
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, Callable, Iterator
 
 # Diffusers 相關導入
 from diffusers import (
     StableDiffusionControlNetPipeline,
     ControlNetModel,
     DPMSolverMultistepScheduler,
-    StableDiffusionPipeline
+    StableDiffusionPipeline,
+    StableDiffusionControlNetImg2ImgPipeline,
+    StableDiffusionImg2ImgPipeline
 )
 from diffusers.utils import load_image
 from transformers import pipeline
 import cv2
 
+from scripts.memory_budget import MemoryBudget
+from scripts.job_queue import JobQueue, Job
+from scripts.directions import direction_settings, frame_prefix, generated_directions
+from scripts.config_service import load_config
+from scripts.template_store import CharacterRoster
+from scripts.pose_library import sample_pose_clip
+from scripts.pixel_art_optimizer import posterize_pixel_art
+from scripts.generator_backends import WalkCycleEvent
+
 console = Console()
 
+# SD1.5 潛空間4通道到RGB的線性近似係數，用於不經VAE的快速預覽
+LATENT_RGB_FACTORS = [
+    #   R        G        B
+    [ 0.3512,  0.2297,  0.3227],
+    [ 0.3250,  0.4974,  0.2350],
+    [-0.2829,  0.1762,  0.2721],
+    [-0.2120, -0.2616, -0.7177],
+]
+
+class FrameGenerationError(RuntimeError):
+    """單幀生成失敗"""
+
+class PreviewCancelled(BaseException):
+    """預覽迭代器關閉時由步驟回呼拋出以中斷去噪；非 Exception，不會被包裝成生成失敗"""
+
 class SpriteGenerator:
     def __init__(self, config_path: str = "configs/generation_config.yaml"):
         """初始化精靈生成器"""
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+        self.config = load_config(config_path)
         
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.output_dir = Path("output/frames")
@@ -39,10 +66,44 @@ class SpriteGenerator:
         
         console.print(f"🔧 使用設備: {self.device}", style="blue")
         
+        # 潛空間重用設定：關鍵幀完整生成，後續幀從前一幀潛空間部分去噪
+        reuse_config = self.config['generation_params'].get('latent_reuse', {})
+        self.latent_reuse = reuse_config.get('enabled', False)
+        self.latent_reuse_strength = reuse_config.get('strength', 0.35)
+        
+        # 行走方向：鏡像方向由組合階段翻轉，只有不對稱方向需要生成
+        self.directions = direction_settings(self.config)
+        
+        # 角色名單：大量角色時由SQLite模板儲存按需載入
+        self.roster = CharacterRoster(self.config)
+        
+        # 記憶體預算：決定記憶體優化選項與微批次大小
+        self.memory = MemoryBudget(self.config)
+        
         # 初始化模型
         self.pipe = None
+        self.img2img_pipe = None
         self.controlnet = None
-        self._load_models()
+        # 串流預覽時由 iter_walk_cycle 設定的每步回呼
+        self._step_callback = None
+        with self.memory.track("載入模型"):
+            self._load_models()
+        
+        width = self.config['image_settings']['width']
+        height = self.config['image_settings']['height']
+        self.memory.apply_to_pipeline(self.pipe, width, height)
+        self.micro_batch_size = self.memory.plan_micro_batch(width, height)
+        if self.memory.enabled:
+            console.print(f"📦 微批次大小: {self.micro_batch_size}", style="blue")
+        
+        # 跨角色批次：不同角色的同一幀共用姿勢條件，一次管線呼叫生成；潛空間重用需逐幀串接，不適用
+        batch_config = self.config['generation_params'].get('cross_character_batch', {})
+        self.cross_batch_size = 1
+        if batch_config.get('enabled', False) and not self.latent_reuse:
+            self.cross_batch_size = batch_config.get('batch_size', 4)
+            if self.memory.enabled:
+                self.cross_batch_size = min(self.cross_batch_size, self.micro_batch_size)
+            console.print(f"📦 跨角色批次大小: {self.cross_batch_size}", style="blue")
     
     def _load_models(self):
         """載入Stable Diffusion和ControlNet模型"""
@@ -101,60 +162,98 @@ class SpriteGenerator:
         # 創建空白圖像
         pose_img = np.zeros((*img_size[::-1], 3), dtype=np.uint8)
         
-        # 計算行走週期中的位置
-        cycle_progress = frame_idx / self.config['animation']['walk_cycle_frames']
-        
-        # 基本人體比例（相對於圖像大小）
-        center_x = img_size[0] // 2
-        head_y = int(img_size[1] * 0.15)
-        torso_y = int(img_size[1] * 0.5)
-        hip_y = int(img_size[1] * 0.65)
-        foot_y = int(img_size[1] * 0.9)
+        # 姿勢由動作關鍵幀插值為目前的幀數（關鍵幀與插值結果皆快取）
+        animation = self.config['animation']
+        poses = sample_pose_clip(animation.get('pose_clip', 'walk'), animation['walk_cycle_frames'])
+        points = poses.pixel_frame(frame_idx, img_size, fill_defaults=True)
         
-        # 行走動作的腿部偏移
-        leg_offset = int(30 * np.sin(2 * np.pi * cycle_progress))
+        head_x, head_y = points["head"]
+        hip_center = ((points["left_hip"][0] + points["right_hip"][0]) // 2,
+                      (points["left_hip"][1] + points["right_hip"][1]) // 2)
         
         # 繪製簡單的骨架
         # 頭部
-        cv2.circle(pose_img, (center_x, head_y), 15, (255, 255, 255), 2)
+        cv2.circle(pose_img, (head_x, head_y), 15, (255, 255, 255), 2)
         
         # 軀幹
-        cv2.line(pose_img, (center_x, head_y + 15), (center_x, hip_y), (255, 255, 255), 3)
+        cv2.line(pose_img, (head_x, head_y + 15), hip_center, (255, 255, 255), 3)
         
         # 手臂
-        arm_offset = int(20 * np.cos(2 * np.pi * cycle_progress))
-        cv2.line(pose_img, (center_x, torso_y), (center_x - 40 + arm_offset, torso_y + 30), (255, 255, 255), 3)
-        cv2.line(pose_img, (center_x, torso_y), (center_x + 40 - arm_offset, torso_y + 30), (255, 255, 255), 3)
+        cv2.line(pose_img, points["torso"], points["left_hand"], (255, 255, 255), 3)
+        cv2.line(pose_img, points["torso"], points["right_hand"], (255, 255, 255), 3)
         
         # 腿部
-        cv2.line(pose_img, (center_x, hip_y), (center_x - 15 + leg_offset, foot_y), (255, 255, 255), 3)
-        cv2.line(pose_img, (center_x, hip_y), (center_x + 15 - leg_offset, foot_y), (255, 255, 255), 3)
+        cv2.line(pose_img, hip_center, points["left_foot"], (255, 255, 255), 3)
+        cv2.line(pose_img, hip_center, points["right_foot"], (255, 255, 255), 3)
         
         return pose_img
     
-    def generate_character_frame(self, 
-                               character_type: str, 
-                               frame_idx: int, 
-                               pose_image: Optional[np.ndarray] = None) -> Image.Image:
-        """生成單幀角色圖像"""
-        
-        # 構建提示詞
+    def _build_prompts(self, character_type: str, frame_idx: int,
+                       direction: Optional[str] = None) -> Tuple[str, str]:
+        """構建 (正向提示詞, 負向提示詞)"""
         base_prompt = self.config['prompts']['base_positive']
-        char_prompt = self.config['prompts']['character_templates'][character_type]['positive']
+        char_prompt = self.roster.get(character_type)['positive']
         full_prompt = f"{base_prompt}, {char_prompt}, frame {frame_idx}"
         
-        negative_prompt = self.config['prompts']['base_negative']
+        # 非基準方向加上方向描述
+        if direction is not None and direction != self.directions["base"]:
+            direction_prompt = self.directions["prompts"].get(direction, f"facing {direction}")
+            full_prompt = f"{full_prompt}, {direction_prompt}"
+        
+        return full_prompt, self.config['prompts']['base_negative']
+        
+    def _build_generation_params(self, character_type: str, frame_idx: int,
+                                 direction: Optional[str] = None) -> Dict[str, Any]:
+        """構建文字到圖像與img2img共用的生成參數"""
+        full_prompt, negative_prompt = self._build_prompts(character_type, frame_idx, direction)
         
-        # 生成參數
         gen_params = {
             "prompt": full_prompt,
             "negative_prompt": negative_prompt,
+            "num_inference_steps": self.config['generation_params']['num_inference_steps'],
+            "guidance_scale": self.config['generation_params']['guidance_scale'],
+            "generator": torch.Generator(device=self.device).manual_seed(42 + frame_idx),
+        }
+        
+        if self._step_callback is not None:
+            gen_params["callback_on_step_end"] = self._step_callback
+            gen_params["callback_on_step_end_tensor_inputs"] = ["latents"]
+        
+        return gen_params
+    
+    def generated_directions(self) -> List[str]:
+        """需要擴散生成的方向（鏡像方向不在其中）"""
+        return generated_directions(self.directions)
+    
+    def job_params(self, character_type: str, frame_idx: int,
+                   direction: Optional[str] = None) -> Dict[str, Any]:
+        """任務佇列記錄的生成參數快照，參數改變時對應項目會重新生成
+        
+        提示詞以雜湊記錄，編輯角色模板或方向描述後續跑也會重新生成。
+        """
+        prompt, negative_prompt = self._build_prompts(character_type, frame_idx, direction)
+        return {
+            "direction": direction,
+            "prompt_hash": hashlib.sha256(f"{prompt}\n{negative_prompt}".encode('utf-8')).hexdigest()[:16],
             "width": self.config['image_settings']['width'],
             "height": self.config['image_settings']['height'],
             "num_inference_steps": self.config['generation_params']['num_inference_steps'],
             "guidance_scale": self.config['generation_params']['guidance_scale'],
-            "generator": torch.Generator(device=self.device).manual_seed(42 + frame_idx),
+            "seed": 42 + frame_idx,
+            "latent_reuse": self.latent_reuse,
         }
+    
+    def generate_character_frame(self, 
+                               character_type: str, 
+                               frame_idx: int, 
+                               pose_image: Optional[np.ndarray] = None,
+                               direction: Optional[str] = None) -> Image.Image:
+        """生成單幀角色圖像"""
+        
+        # 生成參數
+        gen_params = self._build_generation_params(character_type, frame_idx, direction)
+        gen_params["width"] = self.config['image_settings']['width']
+        gen_params["height"] = self.config['image_settings']['height']
         
         # 如果有ControlNet和姿勢圖像
         if self.controlnet is not None and pose_image is not None:
@@ -164,27 +263,279 @@ class SpriteGenerator:
         
         try:
             # 生成圖像
-            with torch.no_grad():
+            with torch.no_grad(), self.memory.track("去噪與解碼"):
                 result = self.pipe(**gen_params)
                 image = result.images[0]
             
             return image
             
         except Exception as e:
-            console.print(f"❌ 生成幀 {frame_idx} 失敗: {e}", style="red")
-            # 返回空白圖像作為後備
-            return Image.new('RGBA', 
-                           (self.config['image_settings']['width'], 
-                            self.config['image_settings']['height']), 
-                           (255, 255, 255, 0))
+            raise FrameGenerationError(f"生成幀 {frame_idx} 失敗: {e}") from e
     
-    def generate_walk_cycle(self, character_type: str) -> List[Image.Image]:
+    def generate_frame_batch(self,
+                           character_type: str,
+                           frame_indices: List[int],
+                           pose_images: List[np.ndarray],
+                           direction: Optional[str] = None) -> List[Image.Image]:
+        """以單次管線呼叫生成同一角色一個微批次的幀"""
+        return self.generate_mixed_batch([(character_type, i, direction) for i in frame_indices], pose_images)
+    
+    def generate_mixed_batch(self,
+                           items: List[Tuple[str, int, Optional[str]]],
+                           pose_images: List[np.ndarray]) -> List[Image.Image]:
+        """以單次管線呼叫生成一個微批次，項目 (角色, 幀號, 方向) 可來自不同角色
+        
+        每個項目有各自的提示詞與種子；pose_images 只有一張時整批共用同一張姿勢控制圖像。
+        去噪與VAE解碼分開記錄記憶體。
+        """
+        per_frame = [self._build_generation_params(*item) for item in items]
+        
+        gen_params = {
+            "prompt": [params["prompt"] for params in per_frame],
+            "negative_prompt": [params["negative_prompt"] for params in per_frame],
+            "num_inference_steps": per_frame[0]["num_inference_steps"],
+            "guidance_scale": per_frame[0]["guidance_scale"],
+            "generator": [params["generator"] for params in per_frame],
+            "width": self.config['image_settings']['width'],
+            "height": self.config['image_settings']['height'],
+            "output_type": "latent",
+        }
+        
+        if self.controlnet is not None:
+            # 單張條件圖像由管線擴展到整批，不重複處理
+            if len(pose_images) == 1:
+                gen_params["image"] = Image.fromarray(pose_images[0])
+            else:
+                gen_params["image"] = [Image.fromarray(pose) for pose in pose_images]
+            gen_params["controlnet_conditioning_scale"] = self.config['controlnet']['conditioning_scale']
+        
+        try:
+            with torch.no_grad(), self.memory.track("去噪"):
+                latents = self.pipe(**gen_params).images
+            return self.decode_latents(latents)
+            
+        except Exception as e:
+            label = ", ".join(f"{character_type} 第 {frame_idx} 幀" for character_type, frame_idx, _ in items)
+            raise FrameGenerationError(f"批次生成 {label} 失敗: {e}") from e
+    
+    def generate_job_batch(self, jobs: List[Job],
+                           targets: Dict[str, Tuple[str, Optional[str]]]) -> List[Tuple[Job, Optional[Image.Image], Optional[str]]]:
+        """生成一個跨角色微批次並拆回各任務，回傳 (任務, 幀, 錯誤訊息)
+        
+        批次都是同一幀時共用姿勢控制圖像；整批失敗時逐項重新生成，只有個別失敗的項目回報錯誤。
+        """
+        items = []
+        for job in jobs:
+            char_type, direction = targets[job.character]
+            items.append((char_type, job.frame, direction))
+        
+        poses = {frame_idx: self.create_pose_conditioning(frame_idx) for frame_idx in sorted({job.frame for job in jobs})}
+        pose_images = list(poses.values()) if len(poses) == 1 else [poses[job.frame] for job in jobs]
+        
+        try:
+            frames = self.generate_mixed_batch(items, pose_images)
+            return [(job, frame, None) for job, frame in zip(jobs, frames)]
+        except FrameGenerationError as e:
+            console.print(f"⚠️  {e}，改為逐項生成", style="yellow")
+        
+        outcomes = []
+        for job, (char_type, frame_idx, direction) in zip(jobs, items):
+            try:
+                outcomes.append((job, self.generate_character_frame(char_type, frame_idx, poses[frame_idx], direction), None))
+            except FrameGenerationError as e:
+                outcomes.append((job, None, str(e)))
+        return outcomes
+    
+    def _get_img2img_pipeline(self):
+        """以現有管線元件建立img2img管線（共用權重，不重新載入模型）"""
+        if self.img2img_pipe is None:
+            if self.controlnet is not None:
+                self.img2img_pipe = StableDiffusionControlNetImg2ImgPipeline(**self.pipe.components)
+            else:
+                self.img2img_pipe = StableDiffusionImg2ImgPipeline(**self.pipe.components)
+        return self.img2img_pipe
+    
+    def decode_latents(self, latents: torch.Tensor) -> List[Image.Image]:
+        """將潛空間張量經VAE解碼為圖像（已啟用VAE切片時逐張解碼）"""
+        vae = self.pipe.vae
+        with torch.no_grad(), self.memory.track("VAE解碼"):
+            if getattr(vae, "use_slicing", False) and latents.shape[0] > 1:
+                decoded = torch.cat([
+                    vae.decode(latent / vae.config.scaling_factor, return_dict=False)[0]
+                    for latent in latents.split(1)
+                ])
+            else:
+                decoded = vae.decode(latents / vae.config.scaling_factor, return_dict=False)[0]
+        return self.pipe.image_processor.postprocess(decoded, output_type="pil")
+    
+    def generate_reused_frame(self,
+                            character_type: str,
+                            frame_idx: int,
+                            pose_image: np.ndarray,
+                            prev_latents: Optional[torch.Tensor] = None,
+                            direction: Optional[str] = None) -> Tuple[Image.Image, Optional[torch.Tensor]]:
+        """潛空間重用模式生成單幀
+        
+        沒有前一幀潛空間時完整生成關鍵幀；否則以前一幀潛空間為起點，
+        在新的姿勢控制下以較低strength部分去噪，只執行約 strength 比例的步驟。
+        回傳 (圖像, 潛空間)。
+        """
+        gen_params = self._build_generation_params(character_type, frame_idx, direction)
+        gen_params["output_type"] = "latent"
+        use_pose = self.controlnet is not None and pose_image is not None
+        
+        try:
+            with torch.no_grad(), self.memory.track("去噪"):
+                if prev_latents is None:
+                    # 關鍵幀：完整文字到圖像生成
+                    gen_params["width"] = self.config['image_settings']['width']
+                    gen_params["height"] = self.config['image_settings']['height']
+                    if use_pose:
+                        gen_params["image"] = Image.fromarray(pose_image)
+                        gen_params["controlnet_conditioning_scale"] = self.config['controlnet']['conditioning_scale']
+                    latents = self.pipe(**gen_params).images
+                else:
+                    # 後續幀：從前一幀潛空間部分去噪
+                    gen_params["image"] = prev_latents
+                    gen_params["strength"] = self.latent_reuse_strength
+                    if use_pose:
+                        gen_params["control_image"] = Image.fromarray(pose_image)
+                        gen_params["controlnet_conditioning_scale"] = self.config['controlnet']['conditioning_scale']
+                    latents = self._get_img2img_pipeline()(**gen_params).images
+            
+            return self.decode_latents(latents)[0], latents
+            
+        except Exception as e:
+            raise FrameGenerationError(f"生成幀 {frame_idx} 失敗: {e}") from e
+    
+    def latents_to_preview(self, latents: torch.Tensor) -> List[Image.Image]:
+        """以線性近似將潛空間轉為低成本RGB預覽（不經VAE）"""
+        factors = torch.tensor(LATENT_RGB_FACTORS, dtype=torch.float32, device=latents.device)
+        rgb = torch.einsum("bchw,cr->bhwr", latents.float(), factors)
+        rgb = ((rgb + 1) / 2).clamp(0, 1).mul(255).to(torch.uint8).cpu().numpy()
+        
+        # 潛空間為圖像的 1/8 解析度，最近鄰放大回原尺寸
+        size = (self.config['image_settings']['width'], self.config['image_settings']['height'])
+        return [Image.fromarray(img).resize(size, Image.NEAREST) for img in rgb]
+    
+    def _run_with_previews(self,
+                           run: Callable[[], Any],
+                           character_type: str,
+                           frame_indices: List[int],
+                           preview_every: int) -> Iterator[WalkCycleEvent]:
+        """在背景執行緒執行生成，並即時產出去噪中間預覽；生成結果作為產生器回傳值
+        
+        迭代器提前關閉（取消）時，背景去噪在下一個步驟結束即中斷，不必等整個微批次完成。
+        """
+        events = queue.Queue()
+        finished = object()
+        outcome = {}
+        stop = threading.Event()
+        
+        def on_step_end(pipe, step, timestep, callback_kwargs):
+            if stop.is_set():
+                raise PreviewCancelled()
+            if (step + 1) % preview_every == 0:
+                total_steps = getattr(pipe, "num_timesteps", None)
+                previews = self.latents_to_preview(callback_kwargs["latents"])
+                for frame_idx, preview in zip(frame_indices, previews):
+                    events.put(WalkCycleEvent("preview", character_type, frame_idx,
+                                              preview, step + 1, total_steps))
+            return callback_kwargs
+        
+        def worker():
+            try:
+                outcome["result"] = run()
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                events.put(finished)
+        
+        self._step_callback = on_step_end
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        try:
+            while (event := events.get()) is not finished:
+                yield event
+        finally:
+            stop.set()
+            thread.join()
+            self._step_callback = None
+        
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["result"]
+    
+    def iter_walk_cycle(self,
+                        character_type: str,
+                        preview_every: int = 0,
+                        callback: Optional[Callable[[WalkCycleEvent], None]] = None,
+                        direction: Optional[str] = None) -> Iterator[WalkCycleEvent]:
+        """逐幀產出行走週期
+        
+        每完成一幀即產出 "frame" 事件並保存單幀；preview_every > 0 時，
+        每隔 preview_every 個去噪步驟另產出 "preview" 事件。
+        callback 會在每個事件產出前被呼叫。direction 為 None 時生成基準方向。
+        """
+        num_frames = self.config['animation']['walk_cycle_frames']
+        prefix = frame_prefix(character_type, direction, self.directions["base"])
+        prev_latents = None
+        
+        # 潛空間重用需逐幀串接，其餘模式依記憶體預算分微批次
+        step = 1 if self.latent_reuse else self.micro_batch_size
+        
+        for start in range(0, num_frames, step):
+            frame_indices = list(range(start, min(start + step, num_frames)))
+            
+            # 創建姿勢控制
+            pose_images = [self.create_pose_conditioning(i) for i in frame_indices]
+            
+            def run():
+                if self.latent_reuse:
+                    frame, latents = self.generate_reused_frame(
+                        character_type, start, pose_images[0], prev_latents, direction
+                    )
+                    return [frame], latents
+                if len(frame_indices) > 1:
+                    return self.generate_frame_batch(character_type, frame_indices, pose_images, direction), None
+                return [self.generate_character_frame(character_type, start, pose_images[0], direction)], None
+            
+            # 生成幀
+            if preview_every > 0:
+                previews = self._run_with_previews(run, character_type, frame_indices, preview_every)
+                try:
+                    while True:
+                        event = next(previews)
+                        if callback is not None:
+                            callback(event)
+                        yield event
+                except StopIteration as stop:
+                    batch_frames, prev_latents = stop.value
+                finally:
+                    previews.close()
+            else:
+                batch_frames, prev_latents = run()
+            
+            for frame_idx, frame in zip(frame_indices, batch_frames):
+                # 保存單幀
+                frame_path = self.output_dir / f"{prefix}_frame_{frame_idx:02d}.png"
+                frame.save(frame_path, "PNG")
+                
+                event = WalkCycleEvent("frame", character_type, frame_idx, frame)
+                if callback is not None:
+                    callback(event)
+                yield event
+    
+    def generate_walk_cycle(self, character_type: str, direction: Optional[str] = None) -> List[Image.Image]:
         """生成完整的行走週期"""
-        console.print(f"🎨 生成 {character_type} 角色行走週期...", style="bold blue")
+        console.print(f"🎨 生成 {character_type} 角色行走週期 ({direction or self.directions['base']})...", style="bold blue")
         
         frames = []
         num_frames = self.config['animation']['walk_cycle_frames']
         
+        if self.latent_reuse:
+            console.print(f"♻️  潛空間重用模式 (strength={self.latent_reuse_strength})", style="cyan")
+        
         with Progress(
             TextColumn("[progress.description]{task.description}"),
             BarColumn(),
@@ -193,70 +544,50 @@ class SpriteGenerator:
         ) as progress:
             task = progress.add_task(f"生成 {character_type} 幀數", total=num_frames)
             
-            for frame_idx in range(num_frames):
-                # 創建姿勢控制
-                pose_image = self.create_pose_conditioning(frame_idx)
-                
-                # 生成幀
-                frame = self.generate_character_frame(character_type, frame_idx, pose_image)
-                frames.append(frame)
-                
-                # 保存單幀
-                frame_path = self.output_dir / f"{character_type}_frame_{frame_idx:02d}.png"
-                frame.save(frame_path, "PNG")
-                
+            for event in self.iter_walk_cycle(character_type, direction=direction):
+                frames.append(event.image)
                 progress.update(task, advance=1, 
-                              description=f"已生成 {character_type} 第 {frame_idx+1}/{num_frames} 幀")
+                              description=f"已生成 {character_type} 第 {event.frame_idx+1}/{num_frames} 幀")
+        
+        if self.memory.enabled:
+            self.memory.report()
         
         console.print(f"✅ {character_type} 行走週期生成完成", style="green")
         return frames
     
     def process_frame_for_pixel_art(self, image: Image.Image) -> Image.Image:
         """後處理圖像以增強像素藝術效果"""
-        # 轉換為numpy陣列
-        img_array = np.array(image)
-        
-        # 簡單的色彩量化
-        # 減少顏色數量以獲得更像素化的效果
-        img_array = img_array // 32 * 32
-        
-        # 轉回PIL圖像
-        processed_img = Image.fromarray(img_array.astype(np.uint8))
-        
-        # 縮小後放大以創建像素效果
-        original_size = processed_img.size
-        small_size = (original_size[0] // 8, original_size[1] // 8)
-        
-        processed_img = processed_img.resize(small_size, Image.NEAREST)
-        processed_img = processed_img.resize(original_size, Image.NEAREST)
-        
-        return processed_img
+        return posterize_pixel_art(image)
     
     def generate_single_character(self, character_type: str):
         """生成指定角色的行走週期"""
         console.print(f"🎯 開始生成 {character_type} 角色行走圖", style="bold magenta")
         
         # 檢查角色是否存在於配置中
-        if character_type not in self.config['prompts']['character_templates']:
+        if character_type not in self.roster:
             console.print(f"❌ 角色 '{character_type}' 不存在於配置中", style="red")
-            console.print("📋 可用角色:", style="cyan")
-            for char in self.config['prompts']['character_templates'].keys():
+            console.print(f"📋 可用角色（共 {self.roster.count()} 個，列出前 20 個）:", style="cyan")
+            for char in self.roster.names(limit=20):
                 console.print(f"   • {char}", style="cyan")
             return
         
+        self._report_mirrored_directions()
+        
         try:
-            frames = self.generate_walk_cycle(character_type)
-            
-            # 後處理增強像素藝術效果
-            processed_frames = []
-            for frame in frames:
-                processed_frame = self.process_frame_for_pixel_art(frame)
-                processed_frames.append(processed_frame)
-            
-            # 保存處理後的幀
-            for i, frame in enumerate(processed_frames):
-                frame_path = self.output_dir / f"{character_type}_processed_frame_{i:02d}.png"
-                frame.save(frame_path, "PNG")
+            for direction in self.generated_directions():
+                frames = self.generate_walk_cycle(character_type, direction)
+                prefix = frame_prefix(character_type, direction, self.directions["base"])
+                
+                # 後處理增強像素藝術效果
+                processed_frames = []
+                for frame in frames:
+                    processed_frame = self.process_frame_for_pixel_art(frame)
+                    processed_frames.append(processed_frame)
+                
+                # 保存處理後的幀
+                for i, frame in enumerate(processed_frames):
+                    frame_path = self.output_dir / f"{prefix}_processed_frame_{i:02d}.png"
+                    frame.save(frame_path, "PNG")
             
             console.print(f"✅ {character_type} 完成", style="green")
             
@@ -265,38 +596,136 @@ class SpriteGenerator:
         
         console.print(f"🎉 {character_type} 角色生成完成！", style="bold green")
     
-    def generate_all_characters(self):
-        """生成所有角色類型的行走週期"""
+    def _report_mirrored_directions(self):
+        """列出由翻轉產生、不需擴散生成的方向"""
+        for direction, source in self.directions["plan"].items():
+            if source is not None:
+                console.print(f"🪞 {direction} 方向由 {source} 方向鏡像，不重新生成", style="cyan")
+    
+    def generate_all_characters(self, resume: bool = False, character_types: Optional[List[str]] = None) -> List[str]:
+        """透過持久化任務佇列生成所有角色類型的行走週期
+        
+        resume=True 時沿用上次的佇列：已完成的幀不重新生成，
+        中斷時仍在執行中的幀重設為待處理。character_types 可限定角色子集。
+        回傳所有幀都已完成的幀前綴（角色+方向）。
+        """
         console.print("🚀 開始生成所有角色行走圖", style="bold magenta")
         
-        character_types = list(self.config['prompts']['character_templates'].keys())
+        queue_config = self.config.get('job_queue', {})
+        job_queue = JobQueue(queue_config.get('db_path', "output/job_queue.sqlite"),
+                             queue_config.get('max_retries', 3))
         
-        for char_type in character_types:
-            try:
-                frames = self.generate_walk_cycle(char_type)
-                
-                # 後處理增強像素藝術效果
-                processed_frames = []
-                for frame in frames:
-                    processed_frame = self.process_frame_for_pixel_art(frame)
-                    processed_frames.append(processed_frame)
-                
-                # 保存處理後的幀
-                for i, frame in enumerate(processed_frames):
-                    frame_path = self.output_dir / f"{char_type}_processed_frame_{i:02d}.png"
-                    frame.save(frame_path, "PNG")
-                
-                console.print(f"✅ {char_type} 完成", style="green")
+        if resume:
+            recovered = job_queue.recover_interrupted()
+            console.print(f"🔁 續跑任務佇列，重設 {recovered} 個中斷項目", style="cyan")
+        else:
+            job_queue.reset()
+        
+        self._report_mirrored_directions()
+        
+        # 任務以幀檔名前綴識別（角色+方向），鏡像方向不入佇列
+        if character_types is None:
+            character_types = self.roster.names()
+        num_frames = self.config['animation']['walk_cycle_frames']
+        targets = {
+            frame_prefix(char_type, direction, self.directions["base"]): (char_type, direction)
+            for char_type in character_types
+            for direction in self.generated_directions()
+        }
+        job_queue.enqueue(
+            (prefix, frame_idx, self.job_params(char_type, frame_idx, direction))
+            for prefix, (char_type, direction) in targets.items()
+            for frame_idx in range(num_frames)
+        )
+        skipped = job_queue.out_of_scope_pending()
+        if skipped:
+            console.print(f"⏭️  略過 {skipped} 個不在本次目標中的待處理項目"
+                          f"（角色已移除、方向或幀數已變更，或不在本次選取的角色中）", style="yellow")
+        
+        # 潛空間重用只在同一角色連續幀之間串接
+        last_frame = None
+        prev_latents = None
+        
+        # 跨角色批次依解析度與步數分組、同一幀的角色相鄰取出；否則逐項依角色與幀號取出
+        def claim() -> List[Job]:
+            if self.cross_batch_size > 1:
+                return job_queue.claim_batch(self.cross_batch_size)
+            job = job_queue.claim_next()
+            return [job] if job is not None else []
+        
+        batch_calls = 0
+        batched_frames = 0
+        
+        try:
+            with Progress(
+                TextColumn("[progress.description]{task.description}"),
+                BarColumn(),
+                TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+                console=console
+            ) as progress:
+                task = progress.add_task("生成角色幀", total=job_queue.counts()['pending'])
                 
-            except Exception as e:
-                console.print(f"❌ {char_type} 生成失敗: {e}", style="red")
+                while (jobs := claim()):
+                    if len(jobs) > 1:
+                        outcomes = self.generate_job_batch(jobs, targets)
+                        batch_calls += 1
+                        batched_frames += len(jobs)
+                    else:
+                        job = jobs[0]
+                        pose_image = self.create_pose_conditioning(job.frame)
+                        char_type, direction = targets[job.character]
+                        
+                        try:
+                            if self.latent_reuse:
+                                if last_frame != (job.character, job.frame - 1):
+                                    prev_latents = None
+                                frame, prev_latents = self.generate_reused_frame(
+                                    char_type, job.frame, pose_image, prev_latents, direction
+                                )
+                            else:
+                                frame = self.generate_character_frame(char_type, job.frame, pose_image, direction)
+                            outcomes = [(job, frame, None)]
+                            last_frame = (job.character, job.frame)
+                        except FrameGenerationError as e:
+                            last_frame = None
+                            outcomes = [(job, None, str(e))]
+                    
+                    # 結果拆回各角色的幀檔
+                    for job, frame, error in outcomes:
+                        if error is not None:
+                            if job_queue.mark_failed(job, error):
+                                console.print(f"⚠️  {job.character} 第 {job.frame} 幀失敗，稍後重試: {error}", style="yellow")
+                            else:
+                                console.print(f"❌ {job.character} 第 {job.frame} 幀已達重試上限: {error}", style="red")
+                                progress.update(task, advance=1)
+                            continue
+                        
+                        # 保存原始幀與後處理幀
+                        frame.save(self.output_dir / f"{job.character}_frame_{job.frame:02d}.png", "PNG")
+                        processed_path = self.output_dir / f"{job.character}_processed_frame_{job.frame:02d}.png"
+                        self.process_frame_for_pixel_art(frame).save(processed_path, "PNG")
+                        
+                        job_queue.mark_done(job, str(processed_path))
+                        progress.update(task, advance=1,
+                                      description=f"已生成 {job.character} 第 {job.frame+1}/{num_frames} 幀")
+            
+            if batch_calls:
+                console.print(f"📦 跨角色批次: {batch_calls} 次管線呼叫，平均每批 {batched_frames / batch_calls:.1f} 幀",
+                              style="blue")
+            job_queue.print_summary()
+            failed = {character for character, _, _ in job_queue.failed_jobs()}
+        finally:
+            job_queue.close()
         
         console.print("🎉 所有角色生成完成！", style="bold green")
+        return [prefix for prefix in targets if prefix not in failed]
     
     def cleanup(self):
         """清理GPU記憶體"""
         if self.pipe is not None:
             del self.pipe
+        if self.img2img_pipe is not None:
+            del self.img2img_pipe
         if self.controlnet is not None:
             del self.controlnet
         
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+程序化2D骨架
+依 data/references/poses 的姿勢關鍵點把精靈切成頭、軀幹、雙臂、雙腿，
+每個部位以繞關節的仿射變換產生行走週期；反向映射索引陣列預先計算一次，
+之後每個角色只需一次索引取值，不經擴散模型即可在毫秒內產生整個週期
+"""
+
+import numpy as np
+from dataclasses import dataclass
+from pathlib import Path
+from PIL import Image
+from rich.console import Console
+from typing import Dict, List, Tuple, Optional
+
+from scripts.pose_library import POSE_DIR, DEFAULT_KEYPOINTS as POSE_DEFAULTS, load_pose_library
+
+console = Console()
+
+# 與姿勢庫相同的預設關鍵點（相對座標）
+DEFAULT_KEYPOINTS: Dict[str, Tuple[float, float]] = {
+    name: point for name, point in POSE_DEFAULTS.items() if not name.endswith(("_hand", "_foot"))
+}
+
+# 部位編號；側視圖面向右時 left 為遠側、right 為近側
+HEAD, TORSO, LEFT_ARM, RIGHT_ARM, LEFT_LEG, RIGHT_LEG = range(6)
+PART_NAMES = ["head", "torso", "left_arm", "right_arm", "left_leg", "right_leg"]
+
+# 由後往前的繪製順序
+DRAW_ORDER = [LEFT_ARM, LEFT_LEG, TORSO, RIGHT_LEG, HEAD, RIGHT_ARM]
+
+def load_rig_keypoints(pose_dir: str = POSE_DIR) -> Dict[str, Tuple[float, float]]:
+    """讀取姿勢庫第一幀作為骨架的靜止姿勢，缺少的關鍵點以預設值補齊"""
+    keypoints = dict(DEFAULT_KEYPOINTS)
+    points = load_pose_library(pose_dir).frame(0)
+    keypoints.update({name: point for name, point in points.items() if name in keypoints})
+
+    # 只有腳底端點的簡化格式：髖關節取軀幹與腳底的中點
+    for side in ("left", "right"):
+        foot = points.get(f"{side}_foot")
+        if foot is not None and f"{side}_hip" not in points:
+            torso_y = keypoints["torso"][1]
+            keypoints[f"{side}_hip"] = (foot[0], (torso_y + foot[1]) / 2)
+    return keypoints
+
+@dataclass
+class WalkMotion:
+    """行走週期的擺動幅度"""
+    leg_swing_deg: float = 18.0
+    arm_swing_deg: float = 10.0
+    head_tilt_deg: float = 2.0
+    # 軀幹向四肢延伸的比例：四肢擺開時以靜止姿勢的關節附近像素補上縫隙
+    joint_fill: float = 0.25
+
+class SpriteRig:
+    def __init__(self, size: Tuple[int, int],
+                 keypoints: Optional[Dict[str, Tuple[float, float]]] = None,
+                 motion: Optional[WalkMotion] = None):
+        """以精靈尺寸與關鍵點建立骨架；部位分割只依幾何位置，相同尺寸的角色可共用"""
+        self.width, self.height = size
+        self.keypoints = keypoints or dict(DEFAULT_KEYPOINTS)
+        self.motion = motion or WalkMotion()
+        self.labels = self.segment()
+        self.torso_fill = self.joint_fill_mask()
+        self._maps: Dict[int, List[List[Tuple[int, np.ndarray, np.ndarray]]]] = {}
+
+    def point(self, name: str) -> np.ndarray:
+        """關鍵點的像素座標 (x, y)"""
+        x, y = self.keypoints[name]
+        return np.array([x * self.width, y * self.height], dtype=np.float32)
+
+    def segment(self) -> np.ndarray:
+        """依關鍵點將畫面分為各部位，回傳 (H, W) 部位編號"""
+        ys, xs = np.mgrid[0:self.height, 0:self.width].astype(np.float32) + 0.5
+        neck_y = self.point("neck")[1]
+        hip_y = (self.point("left_hip")[1] + self.point("right_hip")[1]) / 2
+        hip_x = (self.point("left_hip")[0] + self.point("right_hip")[0]) / 2
+        left_x = min(self.point("left_shoulder")[0], self.point("right_shoulder")[0])
+        right_x = max(self.point("left_shoulder")[0], self.point("right_shoulder")[0])
+
+        labels = np.full((self.height, self.width), TORSO, dtype=np.int8)
+        labels[ys < neck_y] = HEAD
+        band = (ys >= neck_y) & (ys < hip_y)
+        labels[band & (xs < left_x)] = LEFT_ARM
+        labels[band & (xs >= right_x)] = RIGHT_ARM
+        legs = ys >= hip_y
+        labels[legs & (xs < hip_x)] = LEFT_LEG
+        labels[legs & (xs >= hip_x)] = RIGHT_LEG
+        return labels
+    
+    def joint_fill_mask(self) -> np.ndarray:
+        """軀幹取樣時額外涵蓋的四肢根部區域 (H, W)"""
+        ys, xs = np.mgrid[0:self.height, 0:self.width].astype(np.float32) + 0.5
+        hip_y = (self.point("left_hip")[1] + self.point("right_hip")[1]) / 2
+        left_x = min(self.point("left_shoulder")[0], self.point("right_shoulder")[0])
+        right_x = max(self.point("left_shoulder")[0], self.point("right_shoulder")[0])
+
+        leg_margin = (self.height - hip_y) * self.motion.joint_fill
+        arm_margin = left_x * self.motion.joint_fill
+        legs = np.isin(self.labels, (LEFT_LEG, RIGHT_LEG)) & (ys < hip_y + leg_margin)
+        arms = ((self.labels == LEFT_ARM) & (xs >= left_x - arm_margin)) | \
+               ((self.labels == RIGHT_ARM) & (xs < right_x + arm_margin))
+        return legs | arms
+
+    def part_transforms(self, phase: float) -> Dict[int, Tuple[float, np.ndarray, np.ndarray]]:
+        """行走相位對應各部位的 (旋轉角, 關節點, 位移)"""
+        swing = np.sin(2 * np.pi * phase)
+        hip_center = (self.point("left_hip") + self.point("right_hip")) / 2
+
+        leg = np.radians(self.motion.leg_swing_deg) * swing
+        arm = np.radians(self.motion.arm_swing_deg) * swing
+
+        # 雙腳張開時腿的垂直高度變短，整個身體下沉使腳維持著地
+        leg_length = self.height - hip_center[1]
+        shift = np.array([0.0, round(leg_length * (1 - np.cos(leg)))], dtype=np.float32)
+        return {
+            HEAD: (np.radians(self.motion.head_tilt_deg) * swing, self.point("neck"), shift),
+            TORSO: (0.0, hip_center, shift),
+            # 手臂與同側腿反向擺動
+            LEFT_ARM: (arm, self.point("left_shoulder"), shift),
+            RIGHT_ARM: (-arm, self.point("right_shoulder"), shift),
+            LEFT_LEG: (-leg, self.point("left_hip"), shift),
+            RIGHT_LEG: (leg, self.point("right_hip"), shift),
+        }
+
+    def frame_maps(self, frame_count: int) -> List[List[Tuple[int, np.ndarray, np.ndarray]]]:
+        """預先計算每幀每個部位的反向映射 [(部位, 目標索引, 來源索引)]（依繪製順序）"""
+        if frame_count in self._maps:
+            return self._maps[frame_count]
+
+        ys, xs = np.mgrid[0:self.height, 0:self.width].astype(np.float32)
+        dst = np.stack([xs.ravel(), ys.ravel()], axis=1)
+        dst_index = np.arange(self.width * self.height, dtype=np.int32)
+        flat_labels = self.labels.ravel()
+        flat_fill = self.torso_fill.ravel()
+
+        maps = []
+        for frame_idx in range(frame_count):
+            transforms = self.part_transforms(frame_idx / frame_count)
+            frame = []
+            for part in DRAW_ORDER:
+                angle, pivot, shift = transforms[part]
+                # 目標像素反向旋轉回靜止姿勢取樣，避免前向映射留下空洞
+                cos, sin = np.cos(-angle), np.sin(-angle)
+                rel = dst - pivot - shift
+                src_x = np.rint(cos * rel[:, 0] - sin * rel[:, 1] + pivot[0]).astype(np.int32)
+                src_y = np.rint(sin * rel[:, 0] + cos * rel[:, 1] + pivot[1]).astype(np.int32)
+
+                # 超出邊界的像素不取樣（不像 np.roll 會從另一側捲回）
+                inside = (src_x >= 0) & (src_x < self.width) & (src_y >= 0) & (src_y < self.height)
+                src = np.where(inside, src_y * self.width + src_x, 0)
+                valid = inside & (flat_labels[src] == part)
+                if part == TORSO:
+                    valid |= inside & flat_fill[src]
+                frame.append((part, dst_index[valid], src[valid]))
+            maps.append(frame)
+
+        self._maps[frame_count] = maps
+        return maps
+
+    def render_cycle(self, sprite: np.ndarray, frame_count: int = 8) -> np.ndarray:
+        """將 (H, W, 4) 精靈渲染為 (N, H, W, 4) 行走週期"""
+        if sprite.shape[:2] != (self.height, self.width):
+            raise ValueError(f"精靈尺寸 {sprite.shape[1]}x{sprite.shape[0]} 與骨架 {self.width}x{self.height} 不符")
+
+        flat = sprite.reshape(-1, 4)
+        frames = np.zeros((frame_count, self.height * self.width, 4), dtype=sprite.dtype)
+        for frame, part_maps in zip(frames, self.frame_maps(frame_count)):
+            for _, dst, src in part_maps:
+                pixels = flat[src]
+                opaque = pixels[:, 3] > 0
+                frame[dst[opaque]] = pixels[opaque]
+        return frames.reshape(frame_count, self.height, self.width, 4)
+
+    def render_images(self, image: Image.Image, frame_count: int = 8) -> List[Image.Image]:
+        """渲染PIL圖片的行走週期"""
+        frames = self.render_cycle(np.asarray(image.convert('RGBA')), frame_count)
+        return [Image.fromarray(frame, 'RGBA') for frame in frames]
+
+def main():
+    """主函數：以骨架為目錄中所有精靈產生行走週期幀（不需GPU）"""
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="程序化2D骨架行走週期")
+    parser.add_argument("input_dir", help="單張角色精靈所在目錄")
+    parser.add_argument("--output-dir", default="output/frames", help="幀輸出目錄")
+    parser.add_argument("--frames", type=int, default=8, help="每個週期的幀數")
+    parser.add_argument("--pose-dir", default=POSE_DIR, help="姿勢關鍵點目錄")
+    args = parser.parse_args()
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(exist_ok=True, parents=True)
+    keypoints = load_rig_keypoints(args.pose_dir)
+
+    # 相同尺寸的角色共用骨架與映射索引
+    rigs: Dict[Tuple[int, int], SpriteRig] = {}
+    sprite_paths = sorted(Path(args.input_dir).glob("*.png"))
+    start = time.perf_counter()
+    for sprite_path in sprite_paths:
+        with Image.open(sprite_path) as img:
+            sprite = img.convert('RGBA')
+        if sprite.size not in rigs:
+            rigs[sprite.size] = SpriteRig(sprite.size, keypoints)
+        rig = rigs[sprite.size]
+        name = sprite_path.stem.lower()
+        for i, frame in enumerate(rig.render_images(sprite, args.frames)):
+            frame.save(output_dir / f"{name}_frame_{i:02d}.png", "PNG")
+
+    elapsed = time.perf_counter() - start
+    console.print(f"🦴 {len(sprite_paths)} 個角色行走週期完成，耗時 {elapsed:.2f}s（{len(rigs)} 種尺寸的骨架）",
+                  style="green")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+合成工作負載產生器
+不經任何模型，產生 N 個角色 × M 幀的確定性假生成結果（白底、淡漸層底或帶雜訊的白底，
+角色依姿勢庫的行走動作繪製並帶有明暗與雜訊紋理），直接寫入幀目錄，
+供後處理與精靈表組合在大量角色下做壓力測試
+"""
+
+import os
+import time
+import zlib
+import numpy as np
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from PIL import Image
+from rich.console import Console
+from typing import Dict, List, Tuple, Optional
+
+from scripts.pose_library import sample_pose_clip
+
+console = Console()
+
+# 背景樣式：純白、由左至右的淡漸層、白底加上類似擴散模型殘留的雜訊
+BACKGROUNDS = ("white", "gradient", "noise")
+
+# 相對於畫面寬度的部位粗細
+HEAD_RADIUS = 0.06
+TORSO_RADIUS = 0.06
+LIMB_RADIUS = 0.025
+
+# 各肢段 (起點, 終點, 半徑)；hip_center 為左右髖關節中點
+SEGMENTS = [
+    ("neck", "hip_center", TORSO_RADIUS),
+    ("torso", "left_hand", LIMB_RADIUS),
+    ("torso", "right_hand", LIMB_RADIUS),
+    ("hip_center", "left_foot", LIMB_RADIUS),
+    ("hip_center", "right_foot", LIMB_RADIUS),
+]
+
+@dataclass
+class SyntheticWorkload:
+    """工作負載規模：角色數、每角色幀數、解析度與背景樣式"""
+    characters: int = 8
+    frames: int = 8
+    size: Tuple[int, int] = (512, 512)
+    seed: int = 0
+    backgrounds: Tuple[str, ...] = BACKGROUNDS
+    prefix: str = "synthetic"
+    clip: str = "walk"
+
+    @property
+    def total_frames(self) -> int:
+        return self.characters * self.frames
+
+    def character_names(self) -> List[str]:
+        return [f"{self.prefix}_{i:05d}" for i in range(self.characters)]
+
+    def background_for(self, index: int) -> str:
+        return self.backgrounds[index % len(self.backgrounds)]
+
+class SyntheticSpriteRenderer:
+    def __init__(self, size: Tuple[int, int] = (512, 512), seed: int = 0, clip: str = "walk"):
+        """以解析度與種子初始化；同樣的角色名稱與幀號永遠產生相同的圖像"""
+        self.width, self.height = size
+        self.seed = seed
+        self.clip = clip
+        # 漸層底在每幀共用
+        ramp = np.linspace(255, 246, self.width, dtype=np.float32).round().astype(np.uint8)
+        self._gradient = np.broadcast_to(ramp[None, :, None], (self.height, self.width, 3))
+
+    def _rng(self, character: str, frame_idx: int) -> np.random.Generator:
+        return np.random.default_rng([self.seed, zlib.crc32(character.encode('utf-8')), frame_idx])
+
+    def character_color(self, character: str) -> np.ndarray:
+        """角色的主色（只依名稱決定）"""
+        rng = np.random.default_rng([self.seed, zlib.crc32(character.encode('utf-8'))])
+        return rng.integers(40, 200, size=3).astype(np.float32)
+
+    def background(self, style: str, rng: np.random.Generator) -> np.ndarray:
+        """(H, W, 3) 背景"""
+        if style == "white":
+            return np.full((self.height, self.width, 3), 255, dtype=np.uint8)
+        if style == "gradient":
+            return self._gradient.copy()
+        if style == "noise":
+            noise = rng.integers(-4, 1, size=(self.height, self.width, 3), dtype=np.int16)
+            return (255 + noise).astype(np.uint8)
+        raise ValueError(f"未知的背景樣式: {style}（可用: {', '.join(BACKGROUNDS)}）")
+
+    def character_mask(self, points: Dict[str, Tuple[int, int]]) -> Tuple[Tuple[slice, slice], np.ndarray]:
+        """角色剪影；回傳 (外框切片, 外框內的布林遮罩)"""
+        points = dict(points)
+        points["hip_center"] = tuple((np.array(points["left_hip"]) + np.array(points["right_hip"])) // 2)
+        margin = int(np.ceil(max(HEAD_RADIUS, TORSO_RADIUS) * self.width)) + 1
+        coords = np.array(list(points.values()))
+        x0, y0 = np.clip(coords.min(axis=0) - margin, 0, None)
+        x1 = min(coords[:, 0].max() + margin, self.width)
+        y1 = min(coords[:, 1].max() + margin, self.height)
+        box = (slice(y0, y1), slice(x0, x1))
+
+        ys, xs = np.mgrid[y0:y1, x0:x1].astype(np.float32)
+        head = np.array(points["head"], dtype=np.float32)
+        mask = (xs - head[0]) ** 2 + (ys - head[1]) ** 2 <= (HEAD_RADIUS * self.width) ** 2
+        for start, end, radius in SEGMENTS:
+            a = np.array(points[start], dtype=np.float32)
+            ab = np.array(points[end], dtype=np.float32) - a
+            t = np.clip(((xs - a[0]) * ab[0] + (ys - a[1]) * ab[1]) / max(float(ab @ ab), 1e-6), 0, 1)
+            mask |= (xs - a[0] - t * ab[0]) ** 2 + (ys - a[1] - t * ab[1]) ** 2 <= (radius * self.width) ** 2
+        return box, mask
+
+    def render_frame(self, character: str, frame_idx: int, frame_count: int = 8,
+                     background: str = "white") -> np.ndarray:
+        """產生單幀 (H, W, 3) uint8"""
+        rng = self._rng(character, frame_idx)
+        image = self.background(background, rng)
+        points = sample_pose_clip(self.clip, frame_count).pixel_frame(frame_idx, (self.width, self.height), True)
+        box, mask = self.character_mask(points)
+
+        # 由上而下變暗的明暗與逐像素雜訊，接近擴散模型輸出的質感
+        # 只計算剪影內的像素
+        rows = np.nonzero(mask)[0]
+        shade = np.linspace(1.15, 0.75, mask.shape[0], dtype=np.float32)[rows, None]
+        noise = rng.integers(-10, 11, size=(len(rows), 3), dtype=np.int16)
+        texture = self.character_color(character) * shade + noise
+        image[box][mask] = np.clip(texture, 0, 255).astype(np.uint8)
+
+        # 角色內部的白色領口，背景移除不應移除
+        neck_x, neck_y = points["neck"]
+        collar = max(int(self.width * 0.02), 1)
+        image[neck_y:neck_y + collar, neck_x - 2 * collar:neck_x + 2 * collar] = 255
+        return image
+
+    def render_character(self, character: str, frame_count: int, background: str = "white") -> np.ndarray:
+        """產生角色完整週期 (N, H, W, 3)"""
+        return np.stack([self.render_frame(character, i, frame_count, background) for i in range(frame_count)])
+
+def populate_frame_store(workload: SyntheticWorkload, frames_dir="output/frames",
+                         workers: Optional[int] = None, compress_level: int = 1) -> Dict[str, float]:
+    """將合成幀以生成器相同的檔名（{角色}_frame_{幀:02d}.png）平行寫入幀目錄
+
+    壓力測試關注後處理吞吐量，預設以低壓縮等級寫出PNG。
+    """
+    frames_dir = Path(frames_dir)
+    frames_dir.mkdir(exist_ok=True, parents=True)
+    renderer = SyntheticSpriteRenderer(workload.size, workload.seed, workload.clip)
+
+    def write_character(item):
+        index, name = item
+        stack = renderer.render_character(name, workload.frames, workload.background_for(index))
+        for frame_idx, frame in enumerate(stack):
+            Image.fromarray(frame, 'RGB').save(frames_dir / f"{name}_frame_{frame_idx:02d}.png",
+                                               "PNG", compress_level=compress_level)
+        return len(stack)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        written = sum(executor.map(write_character, enumerate(workload.character_names())))
+    elapsed = time.perf_counter() - start
+    return {"frames": written, "seconds": elapsed}
+
+def main():
+    """主函數：將合成幀寫入幀目錄"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="合成精靈工作負載產生器")
+    parser.add_argument("--characters", type=int, default=8, help="角色數")
+    parser.add_argument("--frames", type=int, default=8, help="每個角色的幀數")
+    parser.add_argument("--size", default="512x512", help="幀解析度，例如 512x512")
+    parser.add_argument("--seed", type=int, default=0, help="隨機種子")
+    parser.add_argument("--backgrounds", default=",".join(BACKGROUNDS), help="輪流使用的背景樣式")
+    parser.add_argument("--frames-dir", default="output/frames", help="幀輸出目錄")
+    parser.add_argument("--workers", type=int, help="平行寫出的執行緒數")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    workload = SyntheticWorkload(args.characters, args.frames, (width, height), args.seed,
+                                 tuple(args.backgrounds.split(",")))
+    stats = populate_frame_store(workload, args.frames_dir, args.workers)
+    console.print(f"🧪 已寫出 {stats['frames']} 幀合成結果到 {args.frames_dir}，"
+                  f"耗時 {stats['seconds']:.2f}s（{stats['frames'] / max(stats['seconds'], 1e-9):.0f} 幀/秒）",
+                  style="green")
+
+if __name__ == "__main__":
+    main()
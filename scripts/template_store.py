@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+分片角色模板儲存
+角色數量龐大時將模板存放在本地SQLite（每個角色一列並以名稱與標籤建立索引），
+只在需要時載入單一角色，支援萬用字元與標籤篩選及分頁列出；
+未啟用時沿用配置檔中的 character_templates
+"""
+
+import fnmatch
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+from rich.console import Console
+
+console = Console()
+
+DEFAULT_DB_PATH = "data/character_templates.sqlite"
+
+# 最近使用的模板快取數量
+TEMPLATE_CACHE_SIZE = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS template_tags (
+    tag TEXT NOT NULL,
+    name TEXT NOT NULL REFERENCES templates (name) ON DELETE CASCADE,
+    PRIMARY KEY (tag, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_template_tags_name ON template_tags (name);
+"""
+
+def _filter_clause(pattern: Optional[str], tag: Optional[str]) -> Tuple[str, List[Any]]:
+    """組出名稱萬用字元與標籤篩選的 WHERE 子句"""
+    conditions, args = [], []
+    if pattern:
+        # GLOB 區分大小寫且與 fnmatch 語法一致；固定前綴可使用主鍵索引
+        conditions.append("t.name GLOB ?")
+        args.append(pattern)
+    if tag:
+        conditions.append("t.name IN (SELECT name FROM template_tags WHERE tag = ?)")
+        args.append(tag)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, args
+
+class TemplateStore:
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        """初始化模板儲存"""
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(exist_ok=True, parents=True)
+
+        # Web界面會在不同執行緒中查詢，連線共用並以鎖保護
+        self.conn = sqlite3.connect(str(self.db_path), isolation_level=None, timeout=30,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+        self._lock = threading.RLock()
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def close(self):
+        """關閉資料庫連線"""
+        self.conn.close()
+
+    def count(self, pattern: Optional[str] = None, tag: Optional[str] = None) -> int:
+        """符合篩選條件的角色數量"""
+        where, args = _filter_clause(pattern, tag)
+        with self._lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM templates t {where}", args).fetchone()[0]
+
+    def names(self, pattern: Optional[str] = None, tag: Optional[str] = None,
+              offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        """依名稱排序列出角色，只讀取索引不載入模板內容"""
+        where, args = _filter_clause(pattern, tag)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT t.name FROM templates t {where} ORDER BY t.name LIMIT ? OFFSET ?",
+                [*args, -1 if limit is None else limit, offset]
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """載入單一角色模板，不存在時回傳 None"""
+        with self._lock:
+            if name in self._cache:
+                self._cache.move_to_end(name)
+                return dict(self._cache[name])
+
+            row = self.conn.execute("SELECT data FROM templates WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+
+            template = json.loads(row[0])
+            self._cache[name] = template
+            if len(self._cache) > TEMPLATE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return dict(template)
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            if name in self._cache:
+                return True
+            return self.conn.execute("SELECT 1 FROM templates WHERE name = ?", (name,)).fetchone() is not None
+
+    def put_many(self, templates: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """在單一交易中寫入多個角色模板（同名覆蓋），回傳寫入數量"""
+        written = 0
+        now = time.time()
+
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for name, template in templates:
+                    self.conn.execute(
+                        "INSERT INTO templates (name, data, updated_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT (name) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                        (name, json.dumps(template, ensure_ascii=False), now)
+                    )
+                    self.conn.execute("DELETE FROM template_tags WHERE name = ?", (name,))
+                    self.conn.executemany(
+                        "INSERT OR IGNORE INTO template_tags (tag, name) VALUES (?, ?)",
+                        [(tag, name) for tag in template.get('tags', [])]
+                    )
+                    self._cache.pop(name, None)
+                    written += 1
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        return written
+
+    def put(self, name: str, template: Dict[str, Any]):
+        """寫入單一角色模板"""
+        self.put_many([(name, template)])
+
+    def delete(self, name: str) -> bool:
+        """刪除角色模板，回傳是否存在"""
+        with self._lock:
+            self._cache.pop(name, None)
+            cursor = self.conn.execute("DELETE FROM templates WHERE name = ?", (name,))
+            return cursor.rowcount > 0
+
+    def tags(self) -> Dict[str, int]:
+        """列出所有標籤及其角色數量"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT tag, COUNT(*) FROM template_tags GROUP BY tag ORDER BY tag"
+            ).fetchall()
+        return dict(rows)
+
+    def import_templates(self, templates: Dict[str, Dict[str, Any]]) -> int:
+        """匯入配置檔格式的 character_templates 映射"""
+        return self.put_many(templates.items())
+
+class CharacterRoster:
+    """角色名單的統一入口：啟用模板儲存時查詢SQLite，否則使用配置檔中的模板"""
+
+    def __init__(self, config: Dict[str, Any]):
+        # 保留配置參照，配置重新載入後只需替換 self.config
+        self.config = config
+        store_config = config.get('template_store', {})
+        self.store: Optional[TemplateStore] = None
+        if store_config.get('enabled', False):
+            self.store = TemplateStore(store_config.get('db_path', DEFAULT_DB_PATH))
+
+    @property
+    def inline(self) -> Dict[str, Dict[str, Any]]:
+        return self.config.get('prompts', {}).get('character_templates', {})
+
+    def _inline_names(self, pattern: Optional[str], tag: Optional[str]) -> List[str]:
+        return [
+            name for name, template in self.inline.items()
+            if (not pattern or fnmatch.fnmatchcase(name, pattern))
+            and (not tag or tag in (template.get('tags') or []))
+        ]
+
+    def names(self, pattern: Optional[str] = None, tag: Optional[str] = None,
+              offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        """列出符合篩選條件的角色名稱（可分頁）"""
+        if self.store is not None:
+            return self.store.names(pattern, tag, offset, limit)
+        names = self._inline_names(pattern, tag)
+        return names[offset:] if limit is None else names[offset:offset + limit]
+
+    def count(self, pattern: Optional[str] = None, tag: Optional[str] = None) -> int:
+        """符合篩選條件的角色數量"""
+        if self.store is not None:
+            return self.store.count(pattern, tag)
+        return len(self._inline_names(pattern, tag))
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """取得單一角色模板，不存在時回傳 None"""
+        if self.store is not None:
+            return self.store.get(name)
+        return self.inline.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        if self.store is not None:
+            return name in self.store
+        return name in self.inline
+
+    def resolve(self, selectors: Iterable[str], tag: Optional[str] = None) -> List[str]:
+        """將角色名稱或萬用字元樣式展開為角色列表（保持順序並去除重複）"""
+        resolved: Dict[str, None] = {}
+        for selector in selectors:
+            if any(ch in selector for ch in "*?["):
+                resolved.update(dict.fromkeys(self.names(selector, tag)))
+            elif selector in self and (not tag or tag in (self.get(selector).get('tags') or [])):
+                resolved[selector] = None
+        return list(resolved)
+
+def main():
+    """主函數：匯入配置檔中的模板或列出儲存內容"""
+    import argparse
+    from scripts.config_service import load_config
+
+    parser = argparse.ArgumentParser(description="角色模板儲存")
+    parser.add_argument("--config", default="configs/generation_config.yaml", help="生成配置檔")
+    parser.add_argument("--db", help="模板資料庫路徑（預設讀取配置的 template_store.db_path）")
+    parser.add_argument("--import-config", action="store_true", help="將配置檔中的角色模板匯入資料庫")
+    parser.add_argument("--list", metavar="PATTERN", nargs="?", const="*", help="列出符合萬用字元樣式的角色")
+    parser.add_argument("--tag", help="只列出帶有此標籤的角色")
+    parser.add_argument("--page", type=int, default=1, help="列出的頁碼")
+    parser.add_argument("--page-size", type=int, default=50, help="每頁角色數")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    db_path = args.db or config.get('template_store', {}).get('db_path', DEFAULT_DB_PATH)
+    store = TemplateStore(db_path)
+
+    try:
+        if args.import_config:
+            templates = config.get('prompts', {}).get('character_templates', {})
+            written = store.import_templates(templates)
+            console.print(f"✅ 已匯入 {written} 個角色模板到 {db_path}", style="green")
+
+        if args.list is not None or args.tag:
+            pattern = args.list if args.list is not None else "*"
+            total = store.count(pattern, args.tag)
+            names = store.names(pattern, args.tag, (args.page - 1) * args.page_size, args.page_size)
+            pages = max((total + args.page_size - 1) // args.page_size, 1)
+            console.print(f"📋 符合的角色: {total} 個（第 {args.page}/{pages} 頁）", style="cyan")
+            for name in names:
+                console.print(f"   • {name}", style="cyan")
+        elif not args.import_config:
+            console.print(f"📊 {db_path}: {store.count()} 個角色模板", style="cyan")
+            for tag, count in store.tags().items():
+                console.print(f"   🏷️ {tag}: {count}", style="cyan")
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+紋理陣列匯出
+將角色行走週期寫成遊戲引擎可零拷貝載入的紋理陣列：所有幀裁到共同外框並補齊到
+區塊對齊尺寸（ASTC/BC/KTX2 編碼器可直接使用），可選mip層級，
+內容為原始RGBA8或共用16色調色盤的4位元索引，並輸出描述各層位移的清單
+"""
+
+import json
+import numpy as np
+from pathlib import Path
+from PIL import Image
+from rich.console import Console
+from typing import List, Dict, Any, Optional
+
+from scripts.frame_trimmer import compute_alpha_bboxes
+
+console = Console()
+
+FORMAT_RGBA8 = "rgba8"
+FORMAT_PALETTE4 = "palette4"
+
+# 各層級資料起點的對齊位元組數
+LEVEL_ALIGNMENT = 16
+
+# 4位元調色盤：索引0保留為全透明，其餘15色由量化決定
+PALETTE_ENTRIES = 16
+ALPHA_THRESHOLD = 128
+
+def _round_up(value: int, multiple: int) -> int:
+    return (value + multiple - 1) // multiple * multiple
+
+def downsample_stack(stack: np.ndarray) -> np.ndarray:
+    """以預乘alpha的2x2方框濾波將 (N, H, W, 4) 堆疊縮小一半"""
+    height, width = stack.shape[1:3]
+    pixels = stack.astype(np.float32)
+    pixels[..., :3] *= pixels[..., 3:4] / 255.0
+
+    # 奇數尺寸時複製最後一列/行補齊
+    if height % 2 and height > 1:
+        pixels = np.concatenate([pixels, pixels[:, -1:]], axis=1)
+    if width % 2 and width > 1:
+        pixels = np.concatenate([pixels, pixels[:, :, -1:]], axis=2)
+
+    fy = 2 if height > 1 else 1
+    fx = 2 if width > 1 else 1
+    n, h, w, c = pixels.shape
+    pixels = pixels.reshape(n, h // fy, fy, w // fx, fx, c).mean(axis=(2, 4))
+
+    alpha = pixels[..., 3:4]
+    pixels[..., :3] = np.where(alpha > 0, pixels[..., :3] * 255.0 / np.maximum(alpha, 1e-6), 0)
+    return np.clip(pixels.round(), 0, 255).astype(np.uint8)
+
+def build_palette(stack: np.ndarray) -> np.ndarray:
+    """從所有層的不透明像素量化出共用的 (16, 4) RGBA 調色盤"""
+    palette = np.zeros((PALETTE_ENTRIES, 4), dtype=np.uint8)
+    opaque = stack[stack[..., 3] >= ALPHA_THRESHOLD][:, :3]
+    if len(opaque) == 0:
+        return palette
+
+    strip = Image.fromarray(np.ascontiguousarray(opaque[None]), 'RGB')
+    quantized = strip.quantize(colors=PALETTE_ENTRIES - 1, method=Image.Quantize.MEDIANCUT)
+    colors = np.array(quantized.getpalette()[:3 * (PALETTE_ENTRIES - 1)], dtype=np.uint8).reshape(-1, 3)
+
+    palette[1:1 + len(colors), :3] = colors
+    palette[1:1 + len(colors), 3] = 255
+    return palette
+
+def map_to_palette(stack: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """將 (N, H, W, 4) 堆疊映射為調色盤索引 (N, H, W) uint8"""
+    rgb = stack[..., :3].reshape(-1, 3).astype(np.int32)
+    colors = palette[1:, :3].astype(np.int32)
+    distance = ((rgb[:, None, :] - colors[None, :, :]) ** 2).sum(axis=2)
+    indices = (distance.argmin(axis=1) + 1).astype(np.uint8)
+    indices[stack[..., 3].reshape(-1) < ALPHA_THRESHOLD] = 0
+    return indices.reshape(stack.shape[:3])
+
+def pack_nibbles(indices: np.ndarray) -> np.ndarray:
+    """將 (N, H, W) 索引逐列打包為每位元組兩像素（前一像素在高4位元）"""
+    if indices.shape[2] % 2:
+        indices = np.concatenate([indices, np.zeros_like(indices[:, :, :1])], axis=2)
+    return (indices[:, :, 0::2] << 4) | indices[:, :, 1::2]
+
+class TextureArrayExporter:
+    def __init__(self,
+                 output_dir: str = "output/textures",
+                 block_size: int = 4,
+                 mip_levels: int = 1,
+                 texture_format: str = FORMAT_RGBA8,
+                 fps: float = 8.0):
+        """初始化紋理陣列匯出器
+
+        mip_levels 為1時只輸出基底層，0表示完整mip鏈（直到1x1）。
+        """
+        if texture_format not in (FORMAT_RGBA8, FORMAT_PALETTE4):
+            raise ValueError(f"不支援的紋理格式: {texture_format}")
+
+        self.output_dir = Path(output_dir)
+        self.block_size = block_size
+        self.mip_levels = mip_levels
+        self.texture_format = texture_format
+        self.fps = fps
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "TextureArrayExporter":
+        """從生成配置的 texture_export 區段建立匯出器"""
+        export_config = config.get('texture_export', {})
+        return cls(
+            output_dir=export_config.get('output_dir', "output/textures"),
+            block_size=export_config.get('block_size', 4),
+            mip_levels=export_config.get('mip_levels', 1),
+            texture_format=export_config.get('format', FORMAT_RGBA8),
+            fps=config.get('animation', {}).get('fps', 8),
+        )
+
+    def build_layers(self, frames: List[Image.Image]) -> Dict[str, Any]:
+        """將同尺寸的幀裁到共同外框並補齊到區塊對齊的層尺寸"""
+        sizes = {frame.size for frame in frames}
+        if len(sizes) != 1:
+            raise ValueError(f"紋理陣列的幀必須同尺寸，收到 {sorted(sizes)}")
+
+        stack = np.stack([np.asarray(frame.convert('RGBA')) for frame in frames])
+        bboxes = compute_alpha_bboxes(stack)
+        visible = bboxes[(bboxes[:, 2] > 0) & (bboxes[:, 3] > 0)]
+
+        if len(visible):
+            left, top = visible[:, 0].min(), visible[:, 1].min()
+            right = (visible[:, 0] + visible[:, 2]).max()
+            bottom = (visible[:, 1] + visible[:, 3]).max()
+        else:
+            left, top, right, bottom = 0, 0, 1, 1
+
+        width = _round_up(int(right - left), self.block_size)
+        height = _round_up(int(bottom - top), self.block_size)
+        layers = np.zeros((len(frames), height, width, 4), dtype=np.uint8)
+        layers[:, :bottom - top, :right - left] = stack[:, top:bottom, left:right]
+
+        return {
+            "layers": layers,
+            "origin": (int(left), int(top)),
+            "ground_y": int(bottom - top),
+            "source_size": frames[0].size,
+            "content": [(max(int(x - left), 0), max(int(y - top), 0), int(w), int(h)) for x, y, w, h in bboxes],
+        }
+
+    def build_mips(self, layers: np.ndarray) -> List[np.ndarray]:
+        """產生mip鏈，第0層為原始尺寸"""
+        levels = [layers]
+        while self.mip_levels == 0 or len(levels) < self.mip_levels:
+            height, width = levels[-1].shape[1:3]
+            if height == 1 and width == 1:
+                break
+            levels.append(downsample_stack(levels[-1]))
+        return levels
+
+    def export(self, character_type: str, frames: List[Image.Image]) -> Optional[Path]:
+        """匯出一個角色的紋理陣列，回傳清單路徑"""
+        if not frames:
+            console.print(f"❌ 沒有 {character_type} 的幀可匯出", style="red")
+            return None
+
+        self.output_dir.mkdir(exist_ok=True, parents=True)
+        built = self.build_layers(frames)
+        levels = self.build_mips(built["layers"])
+
+        palette = None
+        if self.texture_format == FORMAT_PALETTE4:
+            palette = build_palette(levels[0])
+
+        blob_path = self.output_dir / f"{character_type}_texture.bin"
+        manifest_levels = []
+        with open(blob_path, "wb") as f:
+            if palette is not None:
+                f.write(palette.tobytes())
+
+            for level_idx, level in enumerate(levels):
+                if self.texture_format == FORMAT_PALETTE4:
+                    payload = pack_nibbles(map_to_palette(level, palette))
+                else:
+                    payload = level
+
+                f.write(b"\0" * (_round_up(f.tell(), LEVEL_ALIGNMENT) - f.tell()))
+                offset = f.tell()
+                f.write(np.ascontiguousarray(payload).tobytes())
+
+                layer_count, height, width = level.shape[:3]
+                row_pitch = payload.shape[2] * (4 if payload.ndim == 4 else 1)
+                manifest_levels.append({
+                    "level": level_idx,
+                    "width": width,
+                    "height": height,
+                    "offset": offset,
+                    "size": payload.nbytes,
+                    "row_pitch": row_pitch,
+                    "layer_stride": row_pitch * height,
+                })
+
+        layers = built["layers"]
+        origin_x, origin_y = built["origin"]
+        source_w, source_h = built["source_size"]
+        manifest = {
+            "character_type": character_type,
+            "blob": blob_path.name,
+            "format": self.texture_format,
+            "byte_order": "little",
+            "block_size": self.block_size,
+            "layer_count": len(layers),
+            "width": layers.shape[2],
+            "height": layers.shape[1],
+            "source_size": {"w": source_w, "h": source_h},
+            # 層的左上角在原始幀中的位置
+            "origin": {"x": origin_x, "y": origin_y},
+            # 以腳底為基準的錨點（層像素座標）
+            "pivot": {"x": source_w / 2 - origin_x, "y": built["ground_y"]},
+            "fps": self.fps,
+            "palette": None if palette is None else {
+                "offset": 0, "entries": PALETTE_ENTRIES, "format": "RGBA8",
+                "transparent_index": 0, "nibble_order": "high_first",
+            },
+            "levels": manifest_levels,
+            "layers": [
+                {"index": i, "name": f"{character_type}_{i:02d}",
+                 "content": {"x": x, "y": y, "w": w, "h": h}}
+                for i, (x, y, w, h) in enumerate(built["content"])
+            ],
+        }
+
+        manifest_path = self.output_dir / f"{character_type}_texture.json"
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+        console.print(f"🧊 {character_type} 紋理陣列: {len(layers)} 層 {layers.shape[2]}x{layers.shape[1]}, "
+                      f"{len(levels)} 個mip層級, {blob_path.stat().st_size} bytes ({self.texture_format})",
+                      style="blue")
+        return manifest_path
+
+def main():
+    """主函數：從 output/frames 匯出所有角色的紋理陣列"""
+    from scripts.sheet_composer import SpriteSheetComposer
+
+    composer = SpriteSheetComposer()
+    composer.export_all_textures()
+
+if __name__ == "__main__":
+    main()
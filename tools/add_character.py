@@ -6,47 +6,127 @@
 
 import os
 import sys
-import yaml
+import json
 import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Optional, Dict, Any, Tuple
 from PIL import Image
-import numpy as np
 from rich.console import Console
 from rich.prompt import Prompt, Confirm
 from rich.panel import Panel
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from scripts.background_removal import BackgroundRemover
+from scripts.config_service import get_config_service, atomic_write_text, file_lock
+from scripts.template_store import CharacterRoster
+
 console = Console()
 
+# 參考圖片標準尺寸
+STANDARD_SIZES = [(32, 48), (256, 384)]
+
+def file_sha256(path: Path) -> str:
+    """計算檔案內容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# 工作程序各自的背景移除引擎；色鍵查表有 16 MB，不隨每個任務序列化
+_worker_remover: Optional[BackgroundRemover] = None
+
+def init_ingest_worker(key_config: Optional[Dict[str, Any]]):
+    """程序池初始化：依色鍵配置建立一次背景移除引擎，None 表示不移除背景"""
+    global _worker_remover
+    _worker_remover = BackgroundRemover.from_key_config(key_config) if key_config is not None else None
+
+def ingest_image(task: Tuple[str, str, str]) -> Tuple[str, Optional[str], Optional[str]]:
+    """在工作程序中解碼、縮放並移除背景，回傳 (角色名稱, 輸出路徑, 錯誤訊息)"""
+    input_path, char_name, output_path = task
+    remover = _worker_remover
+    try:
+        with Image.open(input_path) as img:
+            img = img.convert('RGBA')
+        if img.size not in STANDARD_SIZES:
+            img = img.resize((32, 48), Image.NEAREST)
+        if remover is not None:
+            img = remover.remove(img)
+        img.save(output_path, 'PNG')
+        return char_name, output_path, None
+    except Exception as e:
+        return char_name, None, str(e)
+
 class CharacterAdder:
     def __init__(self):
         """初始化角色添加器"""
         self.config_path = Path("configs/generation_config.yaml")
         self.sprites_dir = Path("data/raw_sprites")
         self.references_dir = Path("data/references")
+        # 已匯入圖片的內容雜湊，批量匯入時據此略過重複圖片
+        self.manifest_path = self.references_dir / "ingest_manifest.json"
         
         # 確保目錄存在
         self.sprites_dir.mkdir(parents=True, exist_ok=True)
         self.references_dir.mkdir(parents=True, exist_ok=True)
         
+        self.config_service = get_config_service(str(self.config_path))
+        # 本程序新增、尚未寫入的角色模板
+        self.pending_templates: Dict[str, Dict[str, Any]] = {}
         self.load_config()
+        # 啟用模板儲存時新角色寫入SQLite，而非配置檔
+        self.roster = CharacterRoster(self.config)
+        self.background_remover = BackgroundRemover.from_config(self.config)
     
     def load_config(self):
         """載入現有配置"""
         try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                self.config = yaml.safe_load(f)
+            self.config = self.config_service.get()
         except FileNotFoundError:
             console.print("❌ 配置文件不存在，請先運行 main.py", style="red")
             sys.exit(1)
     
-    def save_config(self):
-        """保存配置到文件"""
-        with open(self.config_path, 'w', encoding='utf-8') as f:
-            yaml.dump(self.config, f, default_flow_style=False, 
-                     allow_unicode=True, sort_keys=False)
-        console.print("✅ 配置文件已更新", style="green")
+    def save_config(self, quiet: bool = False):
+        """在配置鎖內將新增的角色模板合併進最新配置並原子寫回
+
+        只寫入本程序新增的模板，其他程序同時添加的角色不會被覆蓋。
+        """
+        pending = dict(self.pending_templates)
+        
+        if self.roster.store is not None:
+            self.roster.store.put_many(pending.items())
+            self.pending_templates.clear()
+            if not quiet:
+                console.print(f"✅ 角色模板已寫入 {self.roster.store.db_path}", style="green")
+            return
+        
+        def merge(config):
+            config.setdefault('prompts', {}).setdefault('character_templates', {}).update(pending)
+        
+        self.config = self.config_service.update(merge)
+        self.roster.config = self.config
+        self.pending_templates.clear()
+        if not quiet:
+            console.print("✅ 配置文件已更新", style="green")
+    
+    def load_manifest(self) -> Dict[str, Any]:
+        """載入已匯入圖片的雜湊清單"""
+        if not self.manifest_path.exists():
+            return {}
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def save_manifest(self, manifest: Dict[str, Any]):
+        """在鎖內與磁碟上的清單合併後原子地保存"""
+        with file_lock(self.manifest_path):
+            merged = self.load_manifest()
+            merged.update(manifest)
+            atomic_write_text(self.manifest_path, json.dumps(merged, indent=2, ensure_ascii=False))
     
-    def preprocess_image(self, input_path: str, char_name: str) -> str:
+    def preprocess_image(self, input_path: str, char_name: str,
+                         remove_background: Optional[bool] = None) -> str:
         """預處理參考圖片"""
         console.print(f"🔧 處理圖片: {input_path}", style="blue")
         
@@ -58,22 +138,15 @@ class CharacterAdder:
                 img = img.convert('RGBA')
             
             # 檢查尺寸
-            if img.size not in [(32, 48), (256, 384)]:
+            if img.size not in STANDARD_SIZES:
                 console.print(f"⚠️  圖片尺寸 {img.size} 不標準，將縮放到 32x48", style="yellow")
                 img = img.resize((32, 48), Image.NEAREST)
             
-            # 背景處理選項
-            if Confirm.ask("是否要移除白色背景？"):
-                data = np.array(img)
-                # 將接近白色的像素設為透明
-                white_threshold = 240
-                white_pixels = (
-                    (data[:, :, 0] > white_threshold) & 
-                    (data[:, :, 1] > white_threshold) & 
-                    (data[:, :, 2] > white_threshold)
-                )
-                data[white_pixels] = [0, 0, 0, 0]
-                img = Image.fromarray(data, 'RGBA')
+            # 背景處理選項（未指定時詢問）
+            if remove_background is None:
+                remove_background = Confirm.ask("是否要移除白色背景？")
+            if remove_background:
+                img = self.background_remover.remove(img)
             
             # 保存處理後的圖片
             output_path = self.sprites_dir / f"{char_name}_reference.png"
@@ -89,11 +162,6 @@ class CharacterAdder:
     def add_character_template(self, char_name: str, positive_prompt: str, 
                              style: str, negative_prompt: str = ""):
         """添加角色模板到配置"""
-        if 'prompts' not in self.config:
-            self.config['prompts'] = {}
-        if 'character_templates' not in self.config['prompts']:
-            self.config['prompts']['character_templates'] = {}
-        
         char_config = {
             'positive': positive_prompt,
             'style': style
@@ -102,16 +170,23 @@ class CharacterAdder:
         if negative_prompt:
             char_config['negative'] = negative_prompt
         
-        self.config['prompts']['character_templates'][char_name] = char_config
+        self.stage_template(char_name, char_config)
         console.print(f"✅ 角色模板 '{char_name}' 已添加", style="green")
     
-    def list_existing_characters(self):
+    def stage_template(self, char_name: str, char_config: Dict[str, Any]):
+        """暫存角色模板，於下次 save_config 時寫入"""
+        if self.roster.store is None:
+            self.config.setdefault('prompts', {}).setdefault('character_templates', {})[char_name] = char_config
+        self.pending_templates[char_name] = char_config
+    
+    def list_existing_characters(self, limit: int = 50):
         """列出現有角色"""
-        templates = self.config.get('prompts', {}).get('character_templates', {})
+        total = self.roster.count()
         
-        if templates:
-            console.print("\n📋 現有角色模板:", style="bold blue")
-            for name, config in templates.items():
+        if total:
+            console.print(f"\n📋 現有角色模板（共 {total} 個，列出前 {min(total, limit)} 個）:", style="bold blue")
+            for name in self.roster.names(limit=limit):
+                config = self.roster.get(name) or {}
                 console.print(f"  • {name}: {config.get('positive', 'N/A')}", style="cyan")
         else:
             console.print("📋 目前沒有角色模板", style="yellow")
@@ -131,8 +206,7 @@ class CharacterAdder:
         char_name = Prompt.ask("\n輸入角色名稱 (英文，不含空格)")
         
         # 檢查是否已存在
-        existing_templates = self.config.get('prompts', {}).get('character_templates', {})
-        if char_name in existing_templates:
+        if char_name in self.roster:
             if not Confirm.ask(f"角色 '{char_name}' 已存在，是否覆蓋？"):
                 console.print("操作已取消", style="yellow")
                 return
@@ -192,14 +266,21 @@ class CharacterAdder:
         console.print(f"   python main.py --generate", style="blue")
         console.print(f"   python web_ui.py", style="blue")
     
-    def batch_add_from_directory(self, directory_path: str):
-        """從目錄批量添加角色"""
+    def batch_add_from_directory(self, directory_path: str,
+                                 remove_background: bool = True,
+                                 workers: Optional[int] = None,
+                                 commit_every: int = 50):
+        """從目錄非互動式批量添加角色
+
+        圖片解碼、縮放與背景移除在程序池中平行執行；內容雜湊已匯入過的圖片直接略過；
+        每完成 commit_every 張即原子地寫入一次配置與匯入清單，中斷後可重新執行續跑。
+        """
         dir_path = Path(directory_path)
         if not dir_path.exists():
             console.print("❌ 目錄不存在", style="red")
             return
         
-        image_files = list(dir_path.glob("*.png")) + list(dir_path.glob("*.jpg"))
+        image_files = sorted(list(dir_path.glob("*.png")) + list(dir_path.glob("*.jpg")))
         
         if not image_files:
             console.print("❌ 目錄中沒有找到圖片文件", style="red")
@@ -207,28 +288,82 @@ class CharacterAdder:
         
         console.print(f"📁 找到 {len(image_files)} 個圖片文件", style="blue")
         
+        # 以內容雜湊略過已匯入（或本批次重複）的圖片
+        manifest = self.load_manifest()
+        taken_names = set()
+        tasks = []
+        hashes = {}
+        seen = set()
+        skipped = 0
         for img_file in image_files:
-            char_name = img_file.stem.lower().replace(" ", "_")
-            
-            console.print(f"\n處理: {img_file.name}", style="cyan")
-            
-            # 處理圖片
-            processed_path = self.preprocess_image(str(img_file), char_name)
-            if not processed_path:
+            content_hash = file_sha256(img_file)
+            if content_hash in manifest or content_hash in seen:
+                skipped += 1
                 continue
+            seen.add(content_hash)
             
-            # 簡單的提示詞生成
-            positive_prompt = f"pixel art character, {char_name} style, walking animation"
-            style = "pixel art game character"
+            # 同名但內容不同的圖片加上編號
+            base_name = img_file.stem.lower().replace(" ", "_")
+            char_name, suffix = base_name, 2
+            while char_name in taken_names or char_name in self.roster:
+                char_name, suffix = f"{base_name}_{suffix}", suffix + 1
+            taken_names.add(char_name)
             
-            # 添加模板
-            self.add_character_template(char_name, positive_prompt, style)
+            hashes[char_name] = content_hash
+            output_path = self.sprites_dir / f"{char_name}_reference.png"
+            tasks.append((str(img_file), char_name, str(output_path)))
+        
+        if skipped:
+            console.print(f"⏭️  略過 {skipped} 個已匯入的圖片", style="yellow")
+        if not tasks:
+            console.print("✅ 沒有新的圖片需要匯入", style="green")
+            return
+        
+        added = 0
+        failed = 0
+        uncommitted = 0
+        
+        def commit():
+            self.save_config(quiet=True)
+            self.save_manifest(manifest)
+        
+        key_config = self.config.get('postprocess', {}).get('background_key', {}) if remove_background else None
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_ingest_worker,
+                                 initargs=(key_config,)) as executor:
+            futures = [executor.submit(ingest_image, task) for task in tasks]
+            sources = {task[1]: task[0] for task in tasks}
             
-            console.print(f"✅ {char_name} 已添加", style="green")
+            for future in as_completed(futures):
+                char_name, output_path, error = future.result()
+                if error is not None:
+                    failed += 1
+                    console.print(f"❌ {char_name} 圖片處理失敗: {error}", style="red")
+                    continue
+                
+                # 簡單的提示詞生成
+                positive_prompt = f"pixel art character, {char_name} style, walking animation"
+                self.stage_template(char_name, {
+                    'positive': positive_prompt,
+                    'style': "pixel art game character",
+                })
+                manifest[hashes[char_name]] = {
+                    "character": char_name,
+                    "source": sources[char_name],
+                    "reference": output_path,
+                }
+                added += 1
+                uncommitted += 1
+                
+                if uncommitted >= commit_every:
+                    commit()
+                    uncommitted = 0
+                    console.print(f"💾 已寫入 {added}/{len(tasks)} 個角色", style="blue")
         
-        # 保存配置
-        self.save_config()
-        console.print(f"\n🎉 批量添加完成，共處理 {len(image_files)} 個角色", style="bold green")
+        if uncommitted:
+            commit()
+        
+        console.print(f"\n🎉 批量添加完成：新增 {added} 個角色，略過 {skipped} 個，失敗 {failed} 個",
+                     style="bold green")
 
 def main():
     """主函數"""
@@ -241,6 +376,10 @@ def main():
                        help="從目錄批量添加角色")
     parser.add_argument("--list", "-l", action="store_true", 
                        help="列出現有角色")
+    parser.add_argument("--keep-background", action="store_true",
+                       help="批量添加時不移除背景")
+    parser.add_argument("--workers", "-w", type=int, default=None,
+                       help="批量添加的平行程序數（預設為CPU核心數）")
     
     args = parser.parse_args()
     
@@ -249,7 +388,9 @@ def main():
     if args.list:
         adder.list_existing_characters()
     elif args.batch:
-        adder.batch_add_from_directory(args.batch)
+        adder.batch_add_from_directory(args.batch,
+                                       remove_background=not args.keep_background,
+                                       workers=args.workers)
     elif args.interactive:
         adder.interactive_add_character()
     else:
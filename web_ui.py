@@ -5,8 +5,8 @@
 """
 
 import gradio as gr
+import asyncio
 import os
-import yaml
 from pathlib import Path
 from PIL import Image
 import subprocess
@@ -15,8 +15,14 @@ from typing import List, Tuple, Optional
 
 # 導入自定義模組
 from scripts.data_preparation import DataPreparation
-from scripts.sprite_generator import SpriteGenerator
+from scripts.generator_backends import BACKENDS
 from scripts.sheet_composer import SpriteSheetComposer
+from scripts.job_manager import GenerationJobManager, QueueFullError, QUEUED, RUNNING, DONE, CANCELLED
+from scripts.config_service import get_config_service
+from scripts.template_store import CharacterRoster
+
+# 依配置逐角色選擇生成後端
+AUTO_BACKEND = "auto"
 
 class WebUI:
     def __init__(self):
@@ -24,13 +30,36 @@ class WebUI:
         self.config_path = "configs/generation_config.yaml"
         self.load_config()
         
+        # 所有使用者共用一個常駐管線與請求佇列
+        ui_config = self.config.get('web_ui', {})
+        self.job_manager = GenerationJobManager(
+            self.config_path,
+            max_queued_jobs=ui_config.get('max_queued_jobs', 8),
+            poll_interval=ui_config.get('preview_poll_interval', 0.5),
+            preview_every=ui_config.get('preview_every', 5),
+        )
+        
     def load_config(self):
-        """載入配置"""
+        """載入配置，並訂閱其他程序（如角色添加工具）對配置的修改"""
+        self.config_service = get_config_service(self.config_path)
         try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                self.config = yaml.safe_load(f)
+            self.config = self.config_service.get()
+            self.config_service.subscribe(self.on_config_changed)
         except FileNotFoundError:
+            self.config_service = None
             self.config = self.get_default_config()
+        self.roster = CharacterRoster(self.config)
+        self.character_page_size = self.config.get('web_ui', {}).get('character_page_size', 50)
+    
+    def on_config_changed(self, config: dict):
+        """配置檔變更時更新角色清單等設定"""
+        self.config = config
+        self.roster.config = config
+        
+    def refresh_config(self):
+        """檢查配置檔是否被修改（未變更時只需一次stat）"""
+        if self.config_service is not None:
+            self.config_service.check_for_changes()
     
     def get_default_config(self) -> dict:
         """獲取預設配置"""
@@ -70,46 +99,55 @@ class WebUI:
         except Exception as e:
             return f"❌ 資料準備失敗: {str(e)}"
     
-    def generate_characters(self, 
-                          character_types: List[str],
-                          guidance_scale: float,
-                          num_frames: int,
-                          progress=gr.Progress()) -> Tuple[str, List]:
-        """生成角色行走圖"""
+    def format_job_status(self, job) -> str:
+        """將任務狀態轉為顯示文字"""
+        if job.status == QUEUED:
+            position = self.job_manager.queue_position(job.job_id)
+            eta = self.job_manager.eta_seconds(job.job_id)
+            return f"⏳ 任務 {job.job_id} 排隊中：第 {position} 位，預估 {eta:.0f} 秒後完成"
+        if job.status == RUNNING:
+            eta = self.job_manager.eta_seconds(job.job_id)
+            return (f"🎨 任務 {job.job_id}: {job.message} "
+                    f"({len(job.frames)}/{job.total_frames} 幀，預估剩餘 {eta:.0f} 秒)")
+        if job.status == DONE:
+            return "✅ 角色生成完成！"
+        if job.status == CANCELLED:
+            return f"🛑 任務 {job.job_id} 已取消"
+        return f"❌ 角色生成失敗: {job.message}"
+    
+    async def generate_characters(self, 
+                                character_types: List[str],
+                                guidance_scale: float,
+                                num_frames: int,
+                                backend: str,
+                                request: gr.Request):
+        """提交生成任務並串流排隊狀態與逐幀預覽；backend 為 "auto" 時依配置逐角色選擇"""
+        self.refresh_config()
+        
+        # 過濾不存在於配置中的角色
+        character_types = [char_type for char_type in character_types
+                           if char_type in self.roster]
+        
         try:
-            # 更新配置
-            self.config['generation_params']['guidance_scale'] = guidance_scale
-            self.config['animation']['walk_cycle_frames'] = num_frames
-            
-            progress(0.1, desc="初始化AI模型...")
-            generator = SpriteGenerator()
-            
-            generated_images = []
-            total_chars = len(character_types)
-            
-            for i, char_type in enumerate(character_types):
-                if char_type in self.config['prompts']['character_templates']:
-                    progress((i + 0.5) / total_chars, desc=f"生成 {char_type} 角色...")
-                    
-                    # 生成單個角色
-                    frames = generator.generate_walk_cycle(char_type)
-                    
-                    # 收集生成的圖片
-                    frame_paths = []
-                    for j, frame in enumerate(frames):
-                        frame_path = f"output/frames/{char_type}_frame_{j:02d}.png"
-                        frame.save(frame_path, "PNG")
-                        frame_paths.append(frame_path)
-                    
-                    generated_images.extend(frame_paths)
-            
-            generator.cleanup()
-            progress(1.0, desc="角色生成完成！")
-            
-            return "✅ 角色生成完成！", generated_images
-            
-        except Exception as e:
-            return f"❌ 角色生成失敗: {str(e)}", []
+            job = await self.job_manager.submit(
+                request.session_hash, character_types, guidance_scale, num_frames,
+                None if backend == AUTO_BACKEND else backend
+            )
+        except QueueFullError as e:
+            yield f"❌ 角色生成失敗: {e}", [], None
+            return
+        
+        async for snapshot in self.job_manager.stream(job.job_id):
+            gallery = list(snapshot.frames)
+            if snapshot.preview is not None:
+                gallery.append(snapshot.preview)
+            yield self.format_job_status(snapshot), gallery, snapshot.job_id
+    
+    async def cancel_job(self, job_id: Optional[str], request: gr.Request) -> str:
+        """取消目前使用者的任務"""
+        if job_id and await self.job_manager.cancel(job_id, request.session_hash):
+            return f"🛑 已送出取消請求: {job_id}"
+        return "⚠️ 沒有可取消的任務"
     
     def compose_sprite_sheets(self, progress=gr.Progress()) -> Tuple[str, List]:
         """組合精靈表"""
@@ -135,42 +173,58 @@ class WebUI:
         except Exception as e:
             return f"❌ 精靈表組合失敗: {str(e)}", []
     
-    def run_full_pipeline(self,
-                         character_types: List[str],
-                         guidance_scale: float,
-                         num_frames: int,
-                         progress=gr.Progress()) -> Tuple[str, List]:
+    async def run_full_pipeline(self,
+                                character_types: List[str],
+                                guidance_scale: float,
+                                num_frames: int,
+                                backend: str,
+                                request: gr.Request):
         """執行完整流程"""
         try:
             # 步驟1: 資料準備
-            progress(0.0, desc="步驟 1/3: 資料準備...")
-            prep_result = self.run_data_preparation()
+            yield "步驟 1/3: 資料準備...", [], None
+            prep_result = await asyncio.to_thread(self.run_data_preparation)
             if "❌" in prep_result:
-                return prep_result, []
-            
-            # 步驟2: 生成角色
-            progress(0.33, desc="步驟 2/3: 生成角色...")
-            gen_result, gen_images = self.generate_characters(
-                character_types, guidance_scale, num_frames
-            )
-            if "❌" in gen_result:
-                return gen_result, []
+                yield prep_result, [], None
+                return
+            
+            # 步驟2: 生成角色（串流排隊狀態與逐幀預覽）
+            gen_result, job_id = "", None
+            async for gen_result, frames, job_id in self.generate_characters(
+                character_types, guidance_scale, num_frames, backend, request
+            ):
+                yield f"步驟 2/3: {gen_result}", frames, job_id
+            if not gen_result.startswith("✅"):
+                return
             
             # 步驟3: 組合精靈表
-            progress(0.66, desc="步驟 3/3: 組合精靈表...")
-            comp_result, sprite_sheets = self.compose_sprite_sheets()
+            yield "步驟 3/3: 組合精靈表...", [], job_id
+            comp_result, sprite_sheets = await asyncio.to_thread(self.compose_sprite_sheets)
             if "❌" in comp_result:
-                return comp_result, []
+                yield comp_result, [], job_id
+                return
             
-            progress(1.0, desc="完整流程完成！")
-            return "🎉 完整流程執行完成！所有角色行走圖已生成。", sprite_sheets
+            yield "🎉 完整流程執行完成！所有角色行走圖已生成。", sprite_sheets, job_id
             
         except Exception as e:
-            return f"❌ 流程執行失敗: {str(e)}", []
+            yield f"❌ 流程執行失敗: {str(e)}", [], None
+    
+    def get_character_list(self, pattern: str = "", page: int = 1) -> List[str]:
+        """獲取可用角色類型列表（一頁，可用萬用字元樣式篩選）"""
+        self.refresh_config()
+        offset = (max(int(page), 1) - 1) * self.character_page_size
+        return self.roster.names(pattern or None, offset=offset, limit=self.character_page_size)
+    
+    def format_page_info(self, pattern: str, page: int) -> str:
+        """角色清單的分頁資訊"""
+        total = self.roster.count(pattern or None)
+        pages = max((total + self.character_page_size - 1) // self.character_page_size, 1)
+        return f"符合 {total} 個角色，第 {min(max(int(page), 1), pages)}/{pages} 頁"
     
-    def get_character_list(self) -> List[str]:
-        """獲取可用角色類型列表"""
-        return list(self.config['prompts']['character_templates'].keys())
+    def search_characters(self, pattern: str, page: int):
+        """依搜尋樣式與頁碼更新角色選單"""
+        names = self.get_character_list(pattern, page)
+        return gr.update(choices=names, value=[]), self.format_page_info(pattern, page)
     
     def create_interface(self):
         """創建Gradio界面"""
@@ -195,9 +249,25 @@ class WebUI:
             with gr.Tab("🎨 完整流程"):
                 with gr.Row():
                     with gr.Column():
+                        # 角色數量龐大時只顯示一頁，以萬用字元搜尋（如 npc_*）縮小範圍
+                        with gr.Row():
+                            character_search = gr.Textbox(
+                                label="搜尋角色",
+                                placeholder="例如 npc_*"
+                            )
+                            character_page = gr.Number(
+                                value=1,
+                                label="頁碼",
+                                precision=0,
+                                minimum=1
+                            )
+                        
+                        character_page_info = gr.Markdown(self.format_page_info("", 1))
+                        
+                        initial_characters = self.get_character_list()
                         character_selector = gr.CheckboxGroup(
-                            choices=self.get_character_list(),
-                            value=self.get_character_list(),
+                            choices=initial_characters,
+                            value=initial_characters,
                             label="選擇角色類型",
                             info="選擇要生成的角色類型"
                         )
@@ -220,11 +290,20 @@ class WebUI:
                             info="行走動畫的幀數"
                         )
                         
+                        backend_choice = gr.Dropdown(
+                            choices=[AUTO_BACKEND, *BACKENDS],
+                            value=AUTO_BACKEND,
+                            label="生成後端",
+                            info="auto 依配置逐角色選擇；procedural / synthetic / solid 不需GPU"
+                        )
+                        
                         run_button = gr.Button(
                             "🚀 執行完整流程",
                             variant="primary",
                             size="lg"
                         )
+                        
+                        cancel_button = gr.Button("🛑 取消任務")
                     
                     with gr.Column():
                         status_output = gr.Textbox(
@@ -246,6 +325,7 @@ class WebUI:
                     with gr.Column():
                         prep_button = gr.Button("📋 資料準備")
                         gen_button = gr.Button("🎨 生成角色")
+                        step_cancel_button = gr.Button("🛑 取消生成")
                         comp_button = gr.Button("📑 組合精靈表")
                     
                     with gr.Column():
@@ -316,11 +396,32 @@ class WebUI:
                 - 請勿用於商業用途
                 """)
             
+            # 目前使用者最近一次提交的任務ID
+            job_state = gr.State(None)
+            
             # 綁定事件
+            character_search.submit(
+                fn=lambda pattern: (1, *self.search_characters(pattern, 1)),
+                inputs=[character_search],
+                outputs=[character_page, character_selector, character_page_info]
+            )
+            
+            character_page.change(
+                fn=self.search_characters,
+                inputs=[character_search, character_page],
+                outputs=[character_selector, character_page_info]
+            )
+            
             run_button.click(
                 fn=self.run_full_pipeline,
-                inputs=[character_selector, guidance_scale, num_frames],
-                outputs=[status_output, result_gallery]
+                inputs=[character_selector, guidance_scale, num_frames, backend_choice],
+                outputs=[status_output, result_gallery, job_state]
+            )
+            
+            cancel_button.click(
+                fn=self.cancel_job,
+                inputs=[job_state],
+                outputs=[status_output]
             )
             
             prep_button.click(
@@ -330,8 +431,14 @@ class WebUI:
             
             gen_button.click(
                 fn=self.generate_characters,
-                inputs=[character_selector, guidance_scale, num_frames],
-                outputs=[step_status, step_gallery]
+                inputs=[character_selector, guidance_scale, num_frames, backend_choice],
+                outputs=[step_status, step_gallery, job_state]
+            )
+            
+            step_cancel_button.click(
+                fn=self.cancel_job,
+                inputs=[job_state],
+                outputs=[step_status]
             )
             
             comp_button.click(
@@ -346,6 +453,13 @@ def main():
     ui = WebUI()
     interface = ui.create_interface()
     
+    # 串流處理大多在等待共用管線，允許多個使用者同時連線；實際生成由任務管理器排隊
+    ui_config = ui.config.get('web_ui', {})
+    interface.queue(
+        concurrency_count=ui_config.get('max_queued_jobs', 8) + 1,
+        max_size=ui_config.get('max_queued_jobs', 8) * 2
+    )
+    
     # 啟動界面
     interface.launch(
         server_name="0.0.0.0",